@@ -0,0 +1,94 @@
+"""Comptes utilisateurs des clients.
+
+Un compte est créé (ou relié) pour chaque client enrôlé, par lots : une
+requête pour retrouver les comptes existants, une pour les mettre à jour et
+une pour créer les autres, quel que soit le nombre de clients.
+
+Aucun mot de passe n'est haché à l'enrôlement : le compte reçoit un mot de
+passe inutilisable et le client l'active avec un code à usage unique
+(``activation_code``), remis par l'agent. Le code est dérivé, par HMAC, de ce
+mot de passe inutilisable, qui est aléatoire : il n'est pas stocké, ne se
+devine pas à partir du CIN et cesse d'être valable dès que le client a choisi
+son mot de passe. Le seul hachage a donc lieu à l'activation.
+"""
+from django.db.models import Q
+from django.utils.crypto import constant_time_compare, salted_hmac
+
+from .models import User
+from .stats import record_users_created
+
+ACTIVATION_ALPHABET = 'ABCDEFGHJKLMNPQRSTUVWXYZ23456789'
+ACTIVATION_CODE_LENGTH = 8
+ACCOUNT_FIELDS = ['client_linked', 'username', 'email', 'is_client', 'first_name', 'last_name']
+
+
+def client_email(client):
+    return f'client_{client.cin}@digitaratasy.mg'
+
+
+def provision_accounts(clients):
+    """Crée ou met à jour les comptes de ``clients`` (au plus trois requêtes)."""
+    clients = list(clients)
+    if not clients:
+        return
+    by_email = {client_email(client): client for client in clients}
+    by_id = {client.pk: client for client in clients}
+
+    existing = User.objects.filter(
+        Q(client_linked__in=list(by_id)) | Q(email__in=list(by_email))
+    )
+    updated = []
+    for user in sorted(existing, key=lambda user: user.client_linked_id not in by_id):
+        # Le compte relié prime sur celui qui porte déjà l'adresse du client
+        client = by_id.get(user.client_linked_id) or by_email.get(user.email)
+        if client is None or client_email(client) not in by_email:
+            continue
+        del by_email[client_email(client)]
+        user.client_linked = client
+        user.username = client.cin
+        user.email = client_email(client)
+        user.is_client = True
+        user.first_name = client.prenom
+        user.last_name = client.nom
+        updated.append(user)
+    if updated:
+        User.objects.bulk_update(updated, ACCOUNT_FIELDS)
+
+    new_users = []
+    for email, client in by_email.items():
+        user = User(
+            username=client.cin,
+            email=email,
+            is_client=True,
+            first_name=client.prenom,
+            last_name=client.nom,
+            client_linked=client,
+        )
+        user.set_unusable_password()
+        new_users.append(user)
+    record_users_created(User.objects.bulk_create(new_users))
+
+
+def activation_code(user):
+    """Code d'activation du compte, ou None s'il est déjà activé."""
+    if user.has_usable_password():
+        return None
+    digest = salted_hmac('app.accounts.activation', f'{user.pk}:{user.password}').digest()
+    return ''.join(
+        ACTIVATION_ALPHABET[byte % len(ACTIVATION_ALPHABET)]
+        for byte in digest[:ACTIVATION_CODE_LENGTH]
+    )
+
+
+def check_activation_code(user, code):
+    expected = activation_code(user)
+    return expected is not None and constant_time_compare(expected, code.strip().upper())
+
+
+def activate(user, code, password):
+    """Active le compte avec ``password`` ; retourne False si le code est invalide."""
+    if not check_activation_code(user, code):
+        return False
+    user.set_password(password)
+    user.save(update_fields=['password'])
+    return True
@@ -0,0 +1,212 @@
+"""Génération des actes (certificats PDF) des demandes traitées.
+
+Une demande arrivée au statut « traitée » (ou déjà « délivrée », pour une
+réimpression) est rendue en PDF A4 avec le QR code du client. Le rendu se
+fait en deux temps :
+
+1. ``acte_data`` rassemble tout ce qui est imprimé ; la clé de l'acte est le
+   SHA-256 de ces données (et de ``TEMPLATE_VERSION``). Tant qu'elles ne
+   changent pas, la réimpression relit le PDF dans ``acte_store`` ;
+2. ``render_acte`` est une fonction pure, sans base de données : les actes
+   absents du cache sont rendus par lots dans un pool de processus.
+
+``stream_zip`` produit une archive au fil de l'eau, sans la construire en
+mémoire ni sur disque.
+"""
+import hashlib
+import json
+import os
+import zipfile
+from concurrent.futures import ProcessPoolExecutor
+from io import BytesIO
+
+from django.conf import settings
+from PIL import Image, ImageDraw, ImageFont
+
+from .models import DemandeActe, TypeActe
+from .qrcodes import ContentStore, render_qrcode
+from .refcache import commune_name
+
+# À incrémenter à chaque changement de mise en page : tous les actes sont
+# alors rendus à nouveau
+TEMPLATE_VERSION = 1
+PRINTABLE = (DemandeActe.Statut.TRAITEE, DemandeActe.Statut.DELIVREE)
+
+PAGE_SIZE = (1240, 1754)  # A4 à 150 ppp
+MARGIN = 120
+
+
+def _build_store():
+    config = getattr(settings, 'ACTES_CACHE', {})
+    return ContentStore(
+        directory=config.get('DIR', os.path.join(settings.MEDIA_ROOT, 'actes')),
+        memory_entries=config.get('MEMORY_ENTRIES', 32),
+        disk_entries=config.get('DISK_ENTRIES', 100000),
+        extension='pdf',
+    )
+
+
+acte_store = _build_store()
+
+
+def printable_demandes():
+    return DemandeActe.objects.filter(statut__in=PRINTABLE).select_related('client')
+
+
+def acte_data(demande):
+    """Données imprimées sur l'acte (``demande.client`` doit être chargé)."""
+    client = demande.client
+    return {
+        'numero': demande.pk,
+        'type_acte': TypeActe(demande.type_acte).label,
+        'date_demande': demande.date_demande.date().isoformat(),
+        'commune': commune_name(demande.commune_id) if demande.commune_id else None,
+        'nom': client.nom,
+        'prenom': client.prenom,
+        'sexe': client.get_sexe_display(),
+        'date_naissance': str(client.date_naissance),
+        'lieu_naissance': commune_name(client.lieu_naissance_id) if client.lieu_naissance_id else None,
+        'adresse': client.adresse,
+        'cin': client.cin,
+        'qrcode': client.qrcode_payload(),
+    }
+
+
+def acte_key(data):
+    body = json.dumps([TEMPLATE_VERSION, data], sort_keys=True, ensure_ascii=False)
+    return hashlib.sha256(body.encode()).hexdigest()
+
+
+def acte_filename(data):
+    return f"acte-{data['numero']}-{data['cin']}.pdf"
+
+
+def render_acte(data):
+    """Rend un acte en PDF et retourne les octets du fichier."""
+    page = Image.new('RGB', PAGE_SIZE, 'white')
+    draw = ImageDraw.Draw(page)
+    title_font = ImageFont.load_default(size=56)
+    label_font = ImageFont.load_default(size=30)
+    text_font = ImageFont.load_default(size=34)
+
+    draw.text((MARGIN, MARGIN), "REPOBLIKAN'I MADAGASIKARA", font=label_font, fill='black')
+    if data['commune']:
+        draw.text((MARGIN, MARGIN + 45), f"Commune de {data['commune']}", font=label_font, fill='black')
+    draw.text((MARGIN, MARGIN + 170), data['type_acte'].upper(), font=title_font, fill='black')
+    draw.text((MARGIN, MARGIN + 250), f"N° {data['numero']} du {data['date_demande']}",
+              font=label_font, fill='black')
+
+    rows = [
+        ("Nom", data['nom']),
+        ("Prénom(s)", data['prenom']),
+        ("Sexe", data['sexe']),
+        ("Date de naissance", data['date_naissance']),
+        ("Lieu de naissance", data['lieu_naissance'] or '-'),
+        ("Adresse", data['adresse']),
+        ("CIN", data['cin']),
+    ]
+    y = MARGIN + 380
+    for label, value in rows:
+        draw.text((MARGIN, y), f"{label} :", font=label_font, fill='black')
+        draw.text((MARGIN + 380, y), str(value), font=text_font, fill='black')
+        y += 70
+
+    qr = Image.open(BytesIO(render_qrcode(data['qrcode']))).convert('RGB')
+    qr.thumbnail((360, 360))
+    page.paste(qr, (PAGE_SIZE[0] - MARGIN - qr.width, PAGE_SIZE[1] - MARGIN - qr.height))
+
+    buffered = BytesIO()
+    page.save(buffered, format='PDF', resolution=150)
+    return buffered.getvalue()
+
+
+def render_demandes(demandes, workers=1, pool=None):
+    """Rend les actes de ``demandes`` absents du cache ; retourne ``[(data, clé)]``.
+
+    Les données sont lues dans ce processus ; seuls les rendus partent dans le
+    pool (``pool`` s'il est fourni, sinon un pool de ``workers`` processus).
+    """
+    entries = [(data, acte_key(data)) for data in map(acte_data, demandes)]
+    missing = {}
+    for data, key in entries:
+        if key not in missing and not acte_store.contains(key):
+            missing[key] = data
+
+    if missing:
+        keys, datas = list(missing), list(missing.values())
+        if pool is None and workers > 1 and len(datas) > 1:
+            with ProcessPoolExecutor(max_workers=workers) as own_pool:
+                _render_into_store(own_pool, keys, datas, workers)
+        elif pool is not None and len(datas) > 1:
+            _render_into_store(pool, keys, datas, workers)
+        else:
+            for key, data in zip(keys, datas):
+                acte_store.store(key, render_acte(data))
+    return entries
+
+
+def _render_into_store(pool, keys, datas, workers):
+    pdfs = pool.map(render_acte, datas, chunksize=max(1, len(datas) // (workers * 4)))
+    for key, pdf in zip(keys, pdfs):
+        acte_store.store(key, pdf)
+
+
+def get_acte(demande):
+    """Retourne ``(clé, pdf)`` de l'acte d'une demande, rendu si nécessaire."""
+    data = acte_data(demande)
+    key = acte_key(data)
+    pdf = acte_store.load(key)
+    if pdf is None:
+        pdf = render_acte(data)
+        acte_store.store(key, pdf)
+    return key, pdf
+
+
+class ChunkWriter:
+    """Flux en écriture seule dont on récupère les octets au fur et à mesure."""
+
+    def __init__(self):
+        self.chunks = []
+
+    def write(self, data):
+        self.chunks.append(bytes(data))
+        return len(data)
+
+    def flush(self):
+        pass
+
+    def take(self):
+        data, self.chunks = b''.join(self.chunks), []
+        return data
+
+
+def stream_zip(demandes, batch_size=50, workers=1):
+    """Génère une archive ZIP des actes de ``demandes``, morceau par morceau.
+
+    Les actes sont rendus par lots de ``batch_size`` dans un même pool de
+    ``workers`` processus, démarré une fois pour toute l'archive. Les PDF sont
+    déjà compressés : ils sont stockés tels quels.
+    """
+    pool = ProcessPoolExecutor(max_workers=workers) if workers > 1 else None
+    out = ChunkWriter()
+    try:
+        with zipfile.ZipFile(out, 'w', compression=zipfile.ZIP_STORED) as archive:
+            batch = []
+            for demande in demandes.iterator(chunk_size=batch_size):
+                batch.append(demande)
+                if len(batch) == batch_size:
+                    yield from _zip_batch(archive, batch, out, workers, pool)
+                    batch = []
+            if batch:
+                yield from _zip_batch(archive, batch, out, workers, pool)
+        yield out.take()
+    finally:
+        if pool is not None:
+            pool.shutdown()
+
+
+def _zip_batch(archive, batch, out, workers, pool):
+    for data, key in render_demandes(batch, workers=workers, pool=pool):
+        pdf = acte_store.load(key) or render_acte(data)
+        archive.writestr(acte_filename(data), pdf)
+        yield out.take()
@@ -5,8 +5,15 @@ from .models import *
 class CommuneAdmin(admin.ModelAdmin):
     list_display = ('nom', 'region', 'admin_commune')
     list_filter = ('region',)
+    list_select_related = ('region', 'admin_commune')
+
+
+class DemandeActeAdmin(admin.ModelAdmin):
+    list_display = ('__str__', 'statut', 'commune', 'agent', 'date_demande')
+    list_filter = ('statut', 'type_acte')
+    list_select_related = ('client', 'commune__region', 'agent')
 
 admin.site.register(Region)
 admin.site.register(Commune, CommuneAdmin)
 admin.site.register(Client)
-admin.site.register(DemandeActe)
+admin.site.register(DemandeActe, DemandeActeAdmin)
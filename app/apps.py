@@ -4,3 +4,9 @@ from django.apps import AppConfig
 class AppConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'app'
+
+    def ready(self):
+        # Enregistrement des gestionnaires de tâches de fond, des compteurs
+        # de l'index plein texte, des caches de référence et d'authentification,
+        # du suivi des partitions
+        from . import authentication, partitions, refcache, search, stats, tasks  # noqa: F401
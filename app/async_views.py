@@ -0,0 +1,159 @@
+"""Variantes asynchrones des routes les plus sollicitées, servies sous ASGI.
+
+DRF n'exécute que des vues synchrones : sous ASGI, chacune occupe un thread
+le temps de la requête, y compris pendant les attentes (disque, base). Les
+vues de ce module sont des vues Django ``async def`` :
+
+- les lectures passent par l'ORM asynchrone (``aget``, ``afirst``,
+  ``aupdate``), sur le réplica ``reads`` quand il y en a (app/routing.py) ;
+- le rendu des QR codes (quelques millisecondes) et les accès au magasin de
+  fichiers passent dans des threads : la boucle d'événements reste libre
+  pour les autres requêtes ;
+- les e-mails sont mis en file (app/mailspool.py), jamais envoyés pendant
+  la requête, sous la même limite de débit que la route DRF ;
+- les statistiques, une série d'agrégats synchrones, sont calculées dans un
+  thread sur le réplica ``analytics``, hors du thread unique que
+  ``sync_to_async`` réserve par défaut aux appels synchrones.
+
+Les réponses sont les mêmes que celles des routes DRF correspondantes.
+Déploiement : ``uvicorn digitaratasy.asgi:application --workers N``.
+"""
+import asyncio
+import json
+from concurrent.futures import ThreadPoolExecutor
+from functools import partial
+from types import SimpleNamespace
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.core.exceptions import ValidationError
+from django.core.validators import validate_email
+from django.http import HttpResponse, JsonResponse
+from django.views.decorators.csrf import csrf_exempt
+from django.views.decorators.http import require_GET, require_POST
+from rest_framework.exceptions import APIException, Throttled
+from rest_framework.request import Request
+from rest_framework.throttling import ScopedRateThrottle
+
+from . import stats
+from .authentication import ClaimsJWTAuthentication
+from .mailspool import issue_reset_pin
+from .models import Client, User
+from .qrcodes import qrcode_store, render_qrcode, sign_client
+from .routing import identity, reading
+from .serializer import ClientSerializer, StatisticsSerializer
+
+_executors = {}
+
+
+def io_executor():
+    """Pool de threads pour les appels bloquants (disque)."""
+    if 'io' not in _executors:
+        _executors['io'] = ThreadPoolExecutor(
+            max_workers=getattr(settings, 'ASYNC_IO_WORKERS', 32), thread_name_prefix='async-io',
+        )
+    return _executors['io']
+
+
+async def run_in(executor, function, *args):
+    return await asyncio.get_running_loop().run_in_executor(executor, partial(function, *args))
+
+
+async def authenticate(request):
+    """Authentifie ``request`` par JWT s'il porte un en-tête ``Authorization``."""
+    if 'HTTP_AUTHORIZATION' not in request.META:
+        return
+    result = await sync_to_async(ClaimsJWTAuthentication().authenticate)(request)
+    if result is not None:
+        request.user = result[0]
+
+
+def check_throttle(request, scope):
+    """Applique la limite ``ScopedRateThrottle`` de ``scope``, partagée avec les vues DRF."""
+    throttle = ScopedRateThrottle()
+    if not throttle.allow_request(Request(request), SimpleNamespace(throttle_scope=scope)):
+        raise Throttled(throttle.wait())
+
+
+def error_response(exc):
+    response = JsonResponse({'detail': str(exc.detail)}, status=exc.status_code)
+    if getattr(exc, 'wait', None) is not None:
+        response['Retry-After'] = str(exc.wait)
+    return response
+
+
+@require_GET
+async def client_detail(request, pk):
+    """GET clients/{id}/ (lecture seule)."""
+    try:
+        await authenticate(request)
+    except APIException as exc:
+        return error_response(exc)
+    with reading('reads', identity(request)):
+        client = await Client.objects.filter(pk=pk).afirst()
+    if client is None:
+        return JsonResponse({'detail': 'Pas trouvé.'}, status=404)
+    # Sérialisation sans accès à la base : clés étrangères lues par leur id
+    serializer = ClientSerializer(client, context={'request': Request(request)})
+    return JsonResponse(serializer.data)
+
+
+@require_GET
+async def client_qrcode(request, pk):
+    """GET clients/{id}/qrcode.png : lecture du magasin, rendu hors de la boucle."""
+    with reading('reads', identity(request)):
+        client = await Client.objects.only(
+            'id', 'cin', 'date_naissance', 'lieu_naissance_id', 'qrcode_emis_le',
+        ).filter(pk=pk).afirst()
+    if client is None:
+        return JsonResponse({'detail': 'Pas trouvé.'}, status=404)
+
+    payload = sign_client(client)
+    key = qrcode_store.key_for(payload)
+    etag = f'"{key}"'
+    if request.headers.get('If-None-Match') == etag:
+        return HttpResponse(status=304, headers={'ETag': etag})
+    png = await run_in(io_executor(), qrcode_store.load, key)
+    if png is None:
+        png = await sync_to_async(render_qrcode, thread_sensitive=False)(payload)
+        await run_in(io_executor(), qrcode_store.store, key, png)
+    return HttpResponse(png, content_type='image/png', headers={
+        'ETag': etag,
+        'Cache-Control': 'private, max-age=3600',
+    })
+
+
+@require_GET
+async def statistics(request):
+    """GET stats/ : agrégats calculés dans un thread, sur le réplica analytics."""
+
+    def compute():
+        with reading('analytics'):
+            return StatisticsSerializer(stats.statistics()).data
+
+    return JsonResponse(await sync_to_async(compute, thread_sensitive=False)())
+
+
+@csrf_exempt
+@require_POST
+async def forgot_password(request):
+    """POST forgot-password/ : PIN enregistré et e-mail mis en file (app/mailspool.py)."""
+    try:
+        await sync_to_async(check_throttle)(request, 'forgot_password')
+    except APIException as exc:
+        return error_response(exc)
+    try:
+        email = json.loads(request.body or b'{}').get('email', '')
+        if not isinstance(email, str):
+            raise ValidationError('Adresse e-mail attendue')
+        validate_email(email)
+    except (ValueError, AttributeError, ValidationError):
+        return JsonResponse({'email': ['Saisissez une adresse e-mail valide.']}, status=400)
+
+    user = await User.objects.filter(email=email).only('pk', 'email').afirst()
+    if user is None:
+        return JsonResponse({'email': ['Aucun compte trouvé avec cet email.']}, status=400)
+
+    # PIN et e-mail en file dans une transaction, sans attendre le serveur SMTP
+    await sync_to_async(issue_reset_pin)(user)
+    return JsonResponse({'message': 'Un PIN de réinitialisation a été envoyé à votre email.'})
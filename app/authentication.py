@@ -0,0 +1,133 @@
+"""Authentification JWT sans lecture de la table des utilisateurs.
+
+``JWTAuthentication`` charge la ligne ``User`` à chaque requête. Les jetons
+émis par ``MyTokenObtainPairView`` portent déjà les informations utiles aux
+permissions (``email``, ``is_staff``, ``is_client``, ``is_admin_commune``...) :
+``ClaimsJWTAuthentication`` construit un ``ClaimsUser`` à partir de ces claims
+vérifiés.
+
+Seul l'état qui peut invalider un jeton avant son expiration est relu : compte
+désactivé, mot de passe changé (claim ``hash_password`` de ``SIMPLE_JWT``,
+``CHECK_REVOKE_TOKEN``) ou rôle annoncé par le jeton qui ne correspond plus
+(``is_staff``, ``is_superuser``, ``is_admin_commune`` retirés, compte devenu
+``is_client``). Il
+est gardé ``AUTH_STATE_CACHE_TTL`` secondes dans le cache partagé
+(``CACHES``) et effacé à chaque enregistrement de l'utilisateur ; le chemin
+courant ne fait donc aucune requête.
+
+Les jetons émis avant l'activation de ``CHECK_REVOKE_TOKEN`` ne portent pas
+le claim ``hash_password`` : ils restent acceptés jusqu'à leur expiration
+plutôt que de déconnecter tous les utilisateurs au déploiement.
+"""
+from django.conf import settings
+from django.core.cache import cache
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+from django.utils.functional import cached_property
+from django.utils.translation import gettext_lazy as _
+from rest_framework.exceptions import AuthenticationFailed
+from rest_framework_simplejwt.authentication import JWTAuthentication
+from rest_framework_simplejwt.exceptions import InvalidToken
+from rest_framework_simplejwt.models import TokenUser
+from rest_framework_simplejwt.settings import api_settings
+from rest_framework_simplejwt.utils import get_md5_hash_password
+
+from .models import User
+
+STATE_KEY = 'auth:state:v2:{}'
+
+
+def state_ttl():
+    return getattr(settings, 'AUTH_STATE_CACHE_TTL', 60)
+
+
+def user_state(user_id):
+    """``(is_active, empreinte du mot de passe, is_staff, is_superuser, is_client,
+    is_admin_commune)`` d'un utilisateur, ou None s'il n'existe plus."""
+    key = STATE_KEY.format(user_id)
+    state = cache.get(key)
+    if state is None:
+        row = (User.objects.filter(pk=user_id)
+               .values_list('is_active', 'password', 'is_staff', 'is_superuser',
+                            'is_client', 'is_admin_commune').first())
+        state = (row[0], get_md5_hash_password(row[1]), *row[2:]) if row else False
+        cache.set(key, state, state_ttl())
+    return state or None
+
+
+REVOKED = {
+    'password_changed': _("The user's password has been changed."),
+    'permissions_changed': "Les droits de l'utilisateur ont changé.",
+}
+
+
+def revoked_reason(payload, state):
+    """Code de ``REVOKED`` si le mot de passe a changé ou si le jeton annonce des
+    droits retirés depuis son émission ; None sinon.
+
+    ``is_client`` restreint les droits (``IsAgent``) : un jeton qui l'annonce
+    faux alors qu'il est devenu vrai est révoqué."""
+    _is_active, password_hash, is_staff, is_superuser, is_client, is_admin_commune = state
+    claimed_hash = payload.get(api_settings.REVOKE_TOKEN_CLAIM)
+    if (api_settings.CHECK_REVOKE_TOKEN and claimed_hash is not None
+            and claimed_hash != password_hash):
+        return 'password_changed'
+    if ((payload.get('is_staff') and not is_staff)
+            or (payload.get('is_superuser') and not is_superuser)
+            or (payload.get('is_admin_commune') and not is_admin_commune)
+            or (payload.get('is_client') is False and is_client)):
+        return 'permissions_changed'
+    return None
+
+
+@receiver(post_save, sender=User)
+@receiver(post_delete, sender=User)
+def forget_user_state(sender, instance, **kwargs):
+    cache.delete(STATE_KEY.format(instance.pk))
+
+
+class ClaimsUser(TokenUser):
+    """Utilisateur reconstruit à partir des claims du jeton.
+
+    Les attributs absents du jeton ne sont pas disponibles ; ``database_user``
+    charge la ligne complète quand une vue en a réellement besoin.
+    """
+
+    @cached_property
+    def email(self):
+        return self.token.get('email', '')
+
+    @cached_property
+    def is_client(self):
+        return self.token.get('is_client', False)
+
+    @cached_property
+    def is_admin_commune(self):
+        return self.token.get('is_admin_commune', False)
+
+    @cached_property
+    def database_user(self):
+        return User.objects.get(pk=self.pk)
+
+
+def database_user(user):
+    """Instance ``User`` correspondant à ``request.user``."""
+    return user.database_user if isinstance(user, ClaimsUser) else user
+
+
+class ClaimsJWTAuthentication(JWTAuthentication):
+    def get_user(self, validated_token):
+        try:
+            user_id = validated_token[api_settings.USER_ID_CLAIM]
+        except KeyError:
+            raise InvalidToken(_("Token contained no recognizable user identification"))
+
+        state = user_state(user_id)
+        if state is None:
+            raise AuthenticationFailed(_("User not found"), code="user_not_found")
+        if api_settings.CHECK_USER_IS_ACTIVE and not state[0]:
+            raise AuthenticationFailed(_("User is inactive"), code="user_inactive")
+        reason = revoked_reason(validated_token, state)
+        if reason:
+            raise AuthenticationFailed(REVOKED[reason], code=reason)
+        return ClaimsUser(validated_token)
@@ -0,0 +1,139 @@
+"""Enrôlement de clients en masse.
+
+``Client.objects.bulk_create`` contourne ``Client.save`` : sans ce module les
+clients importés n'ont ni compte utilisateur ni QR code. Ici, les lignes sont
+traitées par lots de taille fixe :
+
+1. validation de chaque ligne sans requête (``ClientRowSerializer``) ;
+2. une requête par lot pour les CIN déjà enregistrés et une pour les communes ;
+3. insertion du lot dans sa propre transaction, comptes utilisateurs compris ;
+4. une tâche de fond par lot pour les QR codes.
+
+Les comptes sont créés sans mot de passe haché et activés plus tard par code
+(voir app/accounts.py).
+
+La mémoire utilisée dépend de la taille du lot, pas du nombre de lignes.
+"""
+from itertools import islice
+
+from django.db import IntegrityError, transaction
+from django.utils import timezone
+
+from .accounts import provision_accounts
+from .duplicates import index_clients
+from .jobs import enqueue
+from .models import Client, Commune
+from .refcache import commune_region_id
+from .serializer import ClientRowSerializer
+from .stats import record_clients_created
+
+DEFAULT_BATCH_SIZE = 1000
+
+
+class BulkReport:
+    """Résultat d'un enrôlement : nombre de lignes créées et erreurs par ligne."""
+
+    def __init__(self):
+        self.created = 0
+        self.rejected = 0
+        self.errors = []
+
+    def reject(self, index, errors):
+        self.rejected += 1
+        self.errors.append({'index': index, 'errors': errors})
+
+    def as_dict(self):
+        return {'created': self.created, 'rejected': self.rejected, 'errors': self.errors}
+
+
+def batched(iterable, size):
+    iterator = iter(iterable)
+    while batch := list(islice(iterator, size)):
+        yield batch
+
+
+def enrol_clients(rows, batch_size=DEFAULT_BATCH_SIZE, report=None, commune_ids=None):
+    """Enrôle les clients décrits par ``rows`` (un itérable de dictionnaires).
+
+    Les indices d'erreur sont les positions des lignes dans ``rows``.
+    ``commune_ids`` permet de fournir un ensemble de communes préchargé.
+    """
+    report = report or BulkReport()
+    for batch in batched(enumerate(rows), batch_size):
+        enrol_batch(batch, report, commune_ids=commune_ids)
+    return report
+
+
+def enrol_batch(indexed_rows, report, commune_ids=None):
+    """Valide et insère un lot de ``(index, ligne)`` ; retourne les clients créés."""
+    valid = []
+    for index, row in indexed_rows:
+        serializer = ClientRowSerializer(data=row)
+        if serializer.is_valid():
+            valid.append((index, serializer.validated_data))
+        else:
+            report.reject(index, serializer.errors)
+
+    # Une requête pour les communes du lot (sauf si l'appelant a déjà un index)
+    if commune_ids is None:
+        wanted = {data['lieu_naissance'] for _, data in valid if data.get('lieu_naissance')}
+        commune_ids = set(Commune.objects.filter(pk__in=wanted).values_list('pk', flat=True))
+
+    # Une requête pour les CIN déjà enregistrés, plus les doublons internes au lot
+    cins = [data['cin'] for _, data in valid]
+    taken = set(Client.objects.filter(cin__in=cins).values_list('cin', flat=True))
+
+    clients = []
+    for index, data in valid:
+        commune_id = data.pop('lieu_naissance', None)
+        if commune_id and commune_id not in commune_ids:
+            report.reject(index, {'lieu_naissance': [f"Commune {commune_id} introuvable."]})
+            continue
+        if data['cin'] in taken:
+            report.reject(index, {'cin': ["Un client avec ce CIN existe déjà."]})
+            continue
+        taken.add(data['cin'])
+        clients.append((index, Client(lieu_naissance_id=commune_id, **data)))
+
+    if not clients:
+        return []
+
+    try:
+        created = create_clients([client for _, client in clients])
+    except IntegrityError:
+        # Un autre import a inséré les mêmes CIN entre la vérification et l'insertion
+        taken = set(Client.objects.filter(
+            cin__in=[client.cin for _, client in clients]
+        ).values_list('cin', flat=True))
+        if not taken:
+            raise  # Autre contrainte que l'unicité du CIN : erreur de l'appelant
+        for index, client in clients:
+            if client.cin in taken:
+                report.reject(index, {'cin': ["Un client avec ce CIN existe déjà."]})
+        remaining = [client for _, client in clients if client.cin not in taken]
+        created = create_clients(remaining) if remaining else []
+
+    report.created += len(created)
+    return created
+
+
+def create_clients(clients):
+    """Insère ``clients`` et leurs comptes dans une transaction, puis enfile les tâches."""
+    issued_at = timezone.now()
+    for client in clients:
+        client.refresh_search_name()
+        client.qrcode_emis_le = issued_at
+        client.region_id = commune_region_id(client.lieu_naissance_id) if client.lieu_naissance_id else None
+    with transaction.atomic():
+        created = Client.objects.bulk_create(clients)
+        provision_accounts(created)
+        record_clients_created(created)
+        index_clients(created, replace=False)
+
+        client_ids = [client.pk for client in created]
+        if client_ids:
+            batch_key = f"{client_ids[0]}-{client_ids[-1]}"
+            enqueue('clients.render_qrcodes', {'client_ids': client_ids},
+                    key=f'clients.render_qrcodes:{batch_key}')
+    return created
+
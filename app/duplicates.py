@@ -0,0 +1,178 @@
+"""Détection des doublons probables parmi les clients.
+
+Comparer chaque client à tous les autres est impossible à notre volume. Chaque
+client reçoit donc quelques clés de blocage (``ClientBlockKey``) ; seuls les
+clients qui partagent au moins une clé sont comparés :
+
+- ``n:<année>:<squelette du nom>:<début du squelette du prénom>`` et
+  ``p:<année>:<squelette du prénom>:<début du squelette du nom>``, où le
+  squelette garde les consonnes du début du nom (les fautes de frappe portent
+  surtout sur les voyelles : o/ou, i/y...) ;
+- ``d:<date de naissance>:<commune>``, qui retrouve un nom très mal saisi.
+
+Un nom ou un prénom courant ne suffit pas à former un bloc : chaque clé
+combine les deux, ce qui garde les blocs petits. Une faute dans un seul des
+champs laisse au moins une clé intacte. Les candidats sont ensuite notés
+(``similarity``) entre 0 et 1.
+"""
+import logging
+from difflib import SequenceMatcher
+
+from django.db import transaction
+
+from .models import Client, ClientBlockKey
+from .text import normalize
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_THRESHOLD = 0.8
+MAX_BLOCK_SIZE = 500
+# Consonnes de l'autre champ ajoutées aux clés ``n:`` et ``p:``
+PARTNER_LENGTH = 2
+INDEXED_FIELDS = ('nom', 'prenom', 'date_naissance', 'lieu_naissance_id')
+
+
+def skeleton(name, length=4):
+    """Consonnes initiales d'un nom normalisé, lettres doublées fusionnées."""
+    letters = []
+    for char in normalize(name).replace(' ', ''):
+        if char in 'aeiouy' or not char.isalpha():
+            continue
+        if not letters or letters[-1] != char:
+            letters.append(char)
+        if len(letters) == length:
+            break
+    return ''.join(letters)
+
+
+def block_keys(nom, prenom, date_naissance, lieu_naissance_id):
+    year = date_naissance.year if date_naissance else ''
+    keys = {
+        f'n:{year}:{skeleton(nom)}:{skeleton(prenom, PARTNER_LENGTH)}',
+        f'p:{year}:{skeleton(prenom)}:{skeleton(nom, PARTNER_LENGTH)}',
+    }
+    if date_naissance and lieu_naissance_id:
+        keys.add(f'd:{date_naissance.isoformat()}:{lieu_naissance_id}')
+    return keys
+
+
+def client_keys(client):
+    return block_keys(client.nom, client.prenom, client.date_naissance, client.lieu_naissance_id)
+
+
+def similarity(a, b, threshold=0.0):
+    """Score entre deux fiches ``(nom, prenom, date_naissance, lieu_naissance_id)``.
+
+    Retourne 0 dès que les bornes rapides de ``SequenceMatcher`` montrent que
+    ``threshold`` ne peut pas être atteint.
+    """
+    bonus = 0.0
+    if a[2] and a[2] == b[2]:
+        bonus += 0.25
+    elif a[2] and b[2] and a[2].year == b[2].year:
+        bonus += 0.1
+    if a[3] and a[3] == b[3]:
+        bonus += 0.15
+
+    matcher = SequenceMatcher(None, normalize(f'{a[0]} {a[1]}'), normalize(f'{b[0]} {b[1]}'))
+    for upper_bound in (matcher.real_quick_ratio, matcher.quick_ratio):
+        if bonus + 0.6 * upper_bound() < threshold:
+            return 0.0
+    return round(bonus + 0.6 * matcher.ratio(), 3)
+
+
+def index_clients(clients, replace=True):
+    """Écrit les clés de blocage de ``clients`` (remplace les anciennes)."""
+    clients = list(clients)
+    with transaction.atomic():
+        if replace:
+            ClientBlockKey.objects.filter(client__in=[c.pk for c in clients]).delete()
+        ClientBlockKey.objects.bulk_create(
+            ClientBlockKey(client_id=client.pk, key=key)
+            for client in clients for key in client_keys(client)
+        )
+
+
+def update_block_keys(client, created):
+    """Met à jour les clés d'un client enregistré, sans requête si elles sont inchangées."""
+    keys = client_keys(client)
+    if created:
+        ClientBlockKey.objects.bulk_create(ClientBlockKey(client=client, key=key) for key in keys)
+        return
+
+    loaded = getattr(client, '_loaded_values', None)
+    if loaded is None or any(field not in loaded for field in INDEXED_FIELDS):
+        index_clients([client])
+        return
+
+    previous = block_keys(*(loaded[field] for field in INDEXED_FIELDS))
+    removed, added = previous - keys, keys - previous
+    if removed:
+        ClientBlockKey.objects.filter(client=client, key__in=removed).delete()
+    if added:
+        ClientBlockKey.objects.bulk_create(ClientBlockKey(client=client, key=key) for key in added)
+
+
+def find_candidates(client, threshold=DEFAULT_THRESHOLD, limit=10, max_candidates=MAX_BLOCK_SIZE):
+    """Doublons probables d'un client, du plus au moins probable.
+
+    ``client`` peut ne pas être enregistré (vérification avant création).
+    Au plus ``max_candidates`` clients des blocs sont comparés ; au-delà, la
+    liste est tronquée et un avertissement est journalisé.
+    """
+    keys = client_keys(client)
+    candidate_ids = list(
+        ClientBlockKey.objects.filter(key__in=keys)
+        .exclude(client_id=client.pk)
+        .values_list('client_id', flat=True)
+        .distinct()[:max_candidates + 1]
+    )
+    if len(candidate_ids) > max_candidates:
+        logger.warning("Blocs %s : plus de %d candidats, seuls les %d premiers sont comparés",
+                       sorted(keys), max_candidates, max_candidates)
+        candidate_ids = candidate_ids[:max_candidates]
+    record = (client.nom, client.prenom, client.date_naissance, client.lieu_naissance_id)
+    scored = []
+    for other in Client.objects.filter(pk__in=candidate_ids).only(
+        'nom', 'prenom', 'date_naissance', 'lieu_naissance'
+    ):
+        score = similarity(
+            record, (other.nom, other.prenom, other.date_naissance, other.lieu_naissance_id),
+            threshold,
+        )
+        if score >= threshold:
+            scored.append((score, other))
+    scored.sort(key=lambda item: (-item[0], item[1].pk))
+    return scored[:limit]
+
+
+def owns_pair(key, a, b, skipped=frozenset()):
+    """Vrai si le bloc ``key`` est celui qui signale la paire ``(a, b)``.
+
+    Deux fiches peuvent partager plusieurs clés : la paire n'est signalée que
+    dans le bloc de la plus petite clé commune (hors blocs ``skipped``, non
+    analysés), ce qui évite de garder toutes les paires déjà vues.
+    """
+    shared = (block_keys(*a[1:]) & block_keys(*b[1:])) - skipped
+    # Index en retard sur la fiche : le bloc courant signale la paire
+    return key not in shared or key == min(shared)
+
+
+def score_block(key, records, threshold=DEFAULT_THRESHOLD, skipped=frozenset()):
+    """Compare deux à deux les fiches du bloc ``key`` ``[(id, nom, prenom, date, commune)]``.
+
+    Fonction pure (sans base de données), exécutée dans les processus du pool.
+    """
+    pairs = []
+    for i, a in enumerate(records):
+        for b in records[i + 1:]:
+            score = similarity(a[1:], b[1:], threshold)
+            if score >= threshold and owns_pair(key, a, b, skipped):
+                pairs.append((min(a[0], b[0]), max(a[0], b[0]), score))
+    return pairs
+
+
+def score_blocks(blocks, threshold=DEFAULT_THRESHOLD, skipped=frozenset()):
+    """``blocks`` : liste de ``(clé, fiches)``."""
+    return [pair for key, records in blocks
+            for pair in score_block(key, records, threshold, skipped)]
@@ -0,0 +1,205 @@
+"""Import en flux des registres communaux (CSV ou NDJSON).
+
+Le fichier est lu ligne par ligne par une chaîne de générateurs :
+
+    lecture (CSV/NDJSON) -> reprise au point de contrôle -> résolution des
+    communes -> lots de ``batch_size`` lignes -> app/bulk.enrol_batch
+
+Seul le lot courant est en mémoire. Chaque lot est inséré dans la même
+transaction que le point de contrôle (table ``ImportCheckpoint``) qui avance
+la position : un import interrompu reprend exactement au premier lot non
+enregistré, sans rejouer ni compter deux fois un lot. Les rejets d'un lot
+sont écrits dans le fichier des rejets à la validation de la transaction.
+"""
+import codecs
+import csv
+import json
+import time
+from functools import partial
+
+from django.db import transaction
+
+from .bulk import DEFAULT_BATCH_SIZE, BulkReport, batched, enrol_batch
+from .models import Commune, ImportCheckpoint
+from .text import normalize
+
+FORMATS = ('csv', 'ndjson')
+MAX_REPORTED_ERRORS = 100
+
+
+class CommuneIndex:
+    """Index en mémoire des communes, préchargé en une requête.
+
+    Une commune se résout par identifiant, par nom, ou par « Nom (Région) »
+    quand plusieurs communes portent le même nom.
+    """
+
+    def __init__(self, rows):
+        self.ids = set()
+        self.by_name = {}
+        self.by_name_region = {}
+        for pk, nom, region in rows:
+            self.ids.add(pk)
+            self.by_name.setdefault(normalize(nom), set()).add(pk)
+            self.by_name_region[(normalize(nom), normalize(region))] = pk
+
+    @classmethod
+    def load(cls):
+        return cls(Commune.objects.values_list('pk', 'nom', 'region__nom').iterator())
+
+    def resolve(self, value, region=None):
+        """Retourne ``(id, erreur)`` pour une valeur de la colonne lieu_naissance."""
+        if value in (None, ''):
+            return None, None
+        if isinstance(value, int) or str(value).isdigit():
+            pk = int(value)
+            return (pk, None) if pk in self.ids else (None, f"Commune {pk} introuvable.")
+
+        name = normalize(str(value))
+        if not region and name.endswith(')') and '(' in name:
+            name, _, region = name[:-1].partition('(')
+            name = name.strip()
+        if region:
+            pk = self.by_name_region.get((name, normalize(region)))
+            if pk is not None:
+                return pk, None
+            return None, f"Commune '{value}' introuvable dans la région '{region}'."
+
+        matches = self.by_name.get(name, set())
+        if len(matches) == 1:
+            return next(iter(matches)), None
+        if matches:
+            return None, f"Plusieurs communes nommées '{value}' : préciser la région."
+        return None, f"Commune '{value}' introuvable."
+
+
+class ImportReport(BulkReport):
+    """Rapport d'import : les rejets sont écrits au fil de l'eau, pas accumulés."""
+
+    def __init__(self, rejects_file=None, created=0, rejected=0):
+        super().__init__()
+        self.created = created
+        self.rejected = rejected
+        self.rejects_file = rejects_file
+        self.started_at = time.monotonic()
+        self.processed = 0
+
+    def reject(self, index, errors):
+        self.rejected += 1
+        if len(self.errors) < MAX_REPORTED_ERRORS:
+            self.errors.append({'index': index, 'errors': errors})
+        if self.rejects_file is not None:
+            # Un lot annulé (import interrompu) n'écrit pas ses rejets : il sera rejoué
+            line = json.dumps({'index': index, 'errors': errors}) + '\n'
+            transaction.on_commit(partial(self.rejects_file.write, line))
+
+    @property
+    def rows_per_second(self):
+        elapsed = time.monotonic() - self.started_at
+        return self.processed / elapsed if elapsed else 0.0
+
+    def as_dict(self):
+        data = super().as_dict()
+        data['rows_per_second'] = round(self.rows_per_second, 1)
+        return data
+
+
+class Checkpoint:
+    """Position d'import persistée dans ``ImportCheckpoint`` sous la clé ``key``.
+
+    Sans clé, la position n'est gardée qu'en mémoire.
+    """
+
+    def __init__(self, key):
+        self.key = key
+        self.state = {'position': 0, 'created': 0, 'rejected': 0, 'done': False}
+        if key:
+            stored = ImportCheckpoint.objects.filter(key=key).values_list('state', flat=True).first()
+            if stored:
+                self.state.update(stored)
+
+    @classmethod
+    def exists(cls, key):
+        return ImportCheckpoint.objects.filter(key=key).exists()
+
+    @property
+    def position(self):
+        return self.state['position']
+
+    def save(self, **state):
+        """Enregistre l'état, dans la transaction courante s'il y en a une."""
+        self.state.update(state)
+        if self.key:
+            ImportCheckpoint.objects.update_or_create(key=self.key, defaults={'state': self.state})
+
+
+def detect_format(filename):
+    return 'ndjson' if filename.endswith(('.ndjson', '.jsonl')) else 'csv'
+
+
+def read_rows(binary_stream, fmt):
+    """Génère les lignes du fichier sous forme de dictionnaires.
+
+    Une ligne CSV ou NDJSON illisible est produite comme une ``ValueError``
+    pour être rejetée sans interrompre l'import.
+    """
+    text = codecs.getreader('utf-8-sig')(binary_stream)
+    if fmt == 'csv':
+        reader = csv.DictReader(text)
+        while True:
+            try:
+                yield next(reader)
+            except StopIteration:
+                return
+            except csv.Error as exc:
+                # Ligne mal formée (octet NUL, guillemets) : rejetée, la suite est lue
+                yield ValueError(f"CSV invalide : {exc}")
+    for line in text:
+        if not line.strip():
+            continue
+        try:
+            row = json.loads(line)
+        except ValueError as exc:
+            yield ValueError(f"JSON invalide : {exc}")
+            continue
+        yield row if isinstance(row, dict) else ValueError("Un objet JSON est attendu.")
+
+
+def import_clients(binary_stream, fmt='csv', batch_size=DEFAULT_BATCH_SIZE,
+                   checkpoint=None, report=None, communes=None, on_batch=None):
+    """Importe un flux CSV/NDJSON de clients ; retourne un ``ImportReport``."""
+    checkpoint = checkpoint or Checkpoint(None)
+    report = report or ImportReport(
+        created=checkpoint.state['created'], rejected=checkpoint.state['rejected'],
+    )
+    communes = communes or CommuneIndex.load()
+
+    rows = enumerate(read_rows(binary_stream, fmt))
+    for batch in batched(rows, batch_size):
+        last_index = batch[-1][0]
+        if last_index < checkpoint.position:
+            continue  # Lot déjà enregistré lors d'un import précédent
+        batch = [(index, row) for index, row in batch if index >= checkpoint.position]
+
+        # Lot, compteurs et point de contrôle validés ensemble
+        with transaction.atomic():
+            resolved = []
+            for index, row in batch:
+                if isinstance(row, Exception):
+                    report.reject(index, {'non_field_errors': [str(row)]})
+                    continue
+                commune_id, error = communes.resolve(row.get('lieu_naissance'), row.get('region'))
+                if error:
+                    report.reject(index, {'lieu_naissance': [error]})
+                    continue
+                resolved.append((index, dict(row, lieu_naissance=commune_id)))
+
+            enrol_batch(resolved, report, commune_ids=communes.ids)
+            checkpoint.save(position=last_index + 1, created=report.created,
+                            rejected=report.rejected)
+        report.processed += len(batch)
+        if on_batch:
+            on_batch(report)
+
+    checkpoint.save(done=True, **report.as_dict())
+    return report
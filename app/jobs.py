@@ -0,0 +1,243 @@
+"""File de tâches de fond stockée dans la base de données.
+
+Les effets de bord lents (comptes clients, hachage de mots de passe, QR codes)
+sont enregistrés comme des lignes ``Job`` dans la même transaction que
+l'écriture qui les provoque, puis exécutés par ``manage.py run_jobs``.
+Aucun broker externe n'est nécessaire.
+
+Chaque tâche porte une clé d'idempotence : ré-enfiler une tâche déjà connue
+la remet simplement en attente au lieu d'en créer une seconde ; une tâche en
+cours d'exécution est laissée telle quelle (UPDATE conditionnel sur le statut). Les gestionnaires
+relisent l'état courant en base, ils peuvent donc être rejoués sans risque.
+
+Une tâche réservée l'est pour ``JOBS_LEASE`` : si le worker s'arrête en
+cours d'exécution, elle est reprise par un autre à l'expiration du bail.
+Tant que son gestionnaire s'exécute, le bail est prolongé toutes les
+``JOBS_LEASE / 3`` secondes (``Heartbeat``) : une tâche longue, comme un
+import de fichier, n'est pas reprise pendant qu'elle tourne. Les tâches
+terminées sont supprimées par ``prune`` (``run_jobs`` l'appelle).
+"""
+import json
+import logging
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import close_old_connections, connection, transaction
+from django.db.models import Case, F, JSONField, Value, When
+from django.utils import timezone
+
+from .models import Job
+
+logger = logging.getLogger(__name__)
+
+handlers = {}
+
+
+def job(kind):
+    """Décorateur enregistrant le gestionnaire d'un type de tâche."""
+    def decorator(func):
+        handlers[kind] = func
+        return func
+    return decorator
+
+
+def default_key(kind, payload):
+    return f"{kind}:{json.dumps(payload, sort_keys=True, separators=(',', ':'))}"
+
+
+def enqueue(kind, payload, key=None, max_attempts=5):
+    """Enfile une tâche (ou remet en attente celle qui a la même clé) ; retourne sa ligne."""
+    key = key or default_key(kind, payload)
+    enqueue_many([(kind, payload, key)], max_attempts=max_attempts)
+    return Job.objects.get(idempotency_key=key)
+
+
+def enqueue_many(specs, max_attempts=5):
+    """Enfile des tâches ``(kind, payload[, key])`` en deux requêtes.
+
+    Les clés inconnues sont insérées (les conflits sont ignorés), puis un
+    UPDATE conditionnel remet en attente, avec le nouveau payload, les tâches
+    connues qui ne sont pas en cours. Une tâche en cours n'est jamais
+    touchée, même réservée entre les deux requêtes : elle serait sinon
+    réservée une seconde fois pendant son exécution.
+    """
+    now = timezone.now()
+    jobs = []
+    for kind, payload, *key in specs:
+        key = (key[0] if key else None) or default_key(kind, payload)
+        jobs.append(Job(
+            kind=kind, payload=payload, idempotency_key=key, max_attempts=max_attempts,
+            status=Job.Statut.EN_ATTENTE, attempts=0, run_after=now, last_error='',
+        ))
+    if not jobs:
+        return
+    keys = [job_obj.idempotency_key for job_obj in jobs]
+    Job.objects.bulk_create(jobs, ignore_conflicts=True)
+    Job.objects.filter(
+        idempotency_key__in=keys,
+        status__in=[Job.Statut.EN_ATTENTE, Job.Statut.TERMINE, Job.Statut.ECHEC],
+    ).update(
+        payload=Case(*(
+            When(idempotency_key=job_obj.idempotency_key,
+                 then=Value(job_obj.payload, output_field=JSONField()))
+            for job_obj in jobs
+        )),
+        max_attempts=max_attempts, status=Job.Statut.EN_ATTENTE, attempts=0, run_after=now,
+        last_error='', updated_at=now,
+    )
+
+    if getattr(settings, 'JOBS_RUN_EAGERLY', False):
+        transaction.on_commit(lambda: run_keys(keys))
+
+
+def run_keys(keys):
+    """Exécute immédiatement les tâches ``keys`` (mode ``JOBS_RUN_EAGERLY``)."""
+    for pk in Job.objects.filter(idempotency_key__in=keys).values_list('pk', flat=True):
+        run_job_id(pk)
+
+
+def lease():
+    """Durée de réservation d'une tâche (``JOBS_LEASE``, en secondes)."""
+    return timedelta(seconds=getattr(settings, 'JOBS_LEASE', 1800))
+
+
+def claim(limit=10):
+    """Réserve jusqu'à ``limit`` tâches prêtes à être exécutées.
+
+    La réservation est un UPDATE conditionnel sur le statut et l'échéance :
+    deux workers ne peuvent pas obtenir la même tâche, quel que soit le moteur
+    de base. Une tâche en cours dont le bail a expiré (worker arrêté) est
+    réservée à nouveau.
+    """
+    now = timezone.now()
+    # Bail expiré après la dernière tentative permise : la tâche ne sera pas reprise
+    Job.objects.filter(
+        status=Job.Statut.EN_COURS, run_after__lte=now, attempts__gte=F('max_attempts'),
+    ).update(status=Job.Statut.ECHEC, last_error="Bail expiré : worker arrêté pendant l'exécution")
+    candidates = (
+        Job.objects
+        .filter(status__in=[Job.Statut.EN_ATTENTE, Job.Statut.EN_COURS], run_after__lte=now)
+        .order_by('run_after', 'id')
+        .values_list('pk', 'status')[:limit]
+    )
+    claimed = []
+    for pk, current in list(candidates):
+        won = Job.objects.filter(pk=pk, status=current, run_after__lte=now).update(
+            status=Job.Statut.EN_COURS, attempts=F('attempts') + 1, run_after=now + lease(),
+        )
+        if won:
+            claimed.append(pk)
+    return claimed
+
+
+class Heartbeat:
+    """Prolonge le bail d'une tâche en cours tant que le bloc ``with`` s'exécute."""
+
+    def __init__(self, pk):
+        self.pk = pk
+        self._stopped = threading.Event()
+        self._thread = threading.Thread(target=self._run, name=f'job-heartbeat-{pk}', daemon=True)
+
+    def beat(self):
+        """Repousse la fin du bail ; sans effet si la tâche n'est plus en cours."""
+        return Job.objects.filter(pk=self.pk, status=Job.Statut.EN_COURS).update(
+            run_after=timezone.now() + lease(),
+        )
+
+    def _run(self):
+        interval = lease().total_seconds() / 3
+        try:
+            while not self._stopped.wait(interval):
+                self.beat()
+        except Exception:
+            logger.exception("Prolongation du bail de la tâche %s impossible", self.pk)
+        finally:
+            connection.close()
+
+    def __enter__(self):
+        self._thread.start()
+        return self
+
+    def __exit__(self, *exc_info):
+        self._stopped.set()
+        self._thread.join()
+
+
+def backoff(attempts):
+    """Délai avant la prochaine tentative : 2, 4, 8... secondes, plafonné à 10 minutes."""
+    return timedelta(seconds=min(2 ** attempts, 600))
+
+
+def run_job_id(pk):
+    """Réserve puis exécute une tâche en attente (exécution directe)."""
+    if Job.objects.filter(pk=pk, status=Job.Statut.EN_ATTENTE).update(
+        status=Job.Statut.EN_COURS, attempts=F('attempts') + 1, run_after=timezone.now() + lease(),
+    ):
+        run_job_id_claimed(pk)
+
+
+def run_job(job_obj):
+    handler = handlers.get(job_obj.kind)
+    try:
+        if handler is None:
+            raise LookupError(f"Aucun gestionnaire pour la tâche '{job_obj.kind}'")
+        with Heartbeat(job_obj.pk):
+            handler(**job_obj.payload)
+    except Exception as exc:
+        logger.exception("La tâche %s (%s) a échoué", job_obj.pk, job_obj.kind)
+        if job_obj.attempts >= job_obj.max_attempts:
+            fields = {'status': Job.Statut.ECHEC}
+        else:
+            fields = {
+                'status': Job.Statut.EN_ATTENTE,
+                'run_after': timezone.now() + backoff(job_obj.attempts),
+            }
+        Job.objects.filter(pk=job_obj.pk, status=Job.Statut.EN_COURS).update(
+            last_error=repr(exc), **fields
+        )
+        return False
+
+    Job.objects.filter(pk=job_obj.pk, status=Job.Statut.EN_COURS).update(
+        status=Job.Statut.TERMINE, last_error='',
+    )
+    return True
+
+
+def _run_in_thread(pk):
+    try:
+        run_job_id_claimed(pk)
+    finally:
+        close_old_connections()
+
+
+def run_job_id_claimed(pk):
+    job_obj = Job.objects.filter(pk=pk, status=Job.Statut.EN_COURS).first()
+    if job_obj is not None:
+        run_job(job_obj)
+
+
+def run_pending(limit=100, workers=1):
+    """Réserve et exécute un lot de tâches ; retourne le nombre traité."""
+    claimed = claim(limit)
+    if workers <= 1:
+        for pk in claimed:
+            run_job_id_claimed(pk)
+    else:
+        with ThreadPoolExecutor(max_workers=workers) as pool:
+            list(pool.map(_run_in_thread, claimed))
+    return len(claimed)
+
+
+def prune(older_than=None):
+    """Supprime les tâches terminées depuis ``older_than`` (``JOBS_RETENTION`` secondes).
+
+    Les échecs sont gardés pour examen. Retourne le nombre de lignes supprimées.
+    """
+    if older_than is None:
+        older_than = timedelta(seconds=getattr(settings, 'JOBS_RETENTION', 7 * 24 * 3600))
+    deleted, _ = Job.objects.filter(
+        status=Job.Statut.TERMINE, updated_at__lt=timezone.now() - older_than,
+    ).delete()
+    return deleted
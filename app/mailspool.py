@@ -0,0 +1,144 @@
+"""File d'envoi des e-mails (PIN de réinitialisation...).
+
+Une requête HTTP n'attend jamais le serveur SMTP : le message est inséré dans
+``OutboundMail`` dans la même transaction que l'écriture qui le motive (un PIN
+annulé par un rollback n'est pas envoyé), puis remis par
+``manage.py send_mail_spool``.
+
+Le worker réserve les messages par lots et les envoie sur une seule connexion
+SMTP, gardée ouverte tant que la file n'est pas vide : la poignée de main
+(TLS, authentification) n'est payée qu'une fois par lot et non par message.
+Un message refusé est retenté plus tard (délai croissant, voir
+``jobs.backoff``) ; une connexion perdue renvoie le reste du lot à plus tard.
+
+Le corps des messages contient des secrets (PIN, codes d'activation) : il est
+effacé dès que le message est envoyé ou abandonné ; seuls le destinataire,
+l'objet et les dates restent en base.
+"""
+import logging
+import smtplib
+from datetime import timedelta
+
+from django.conf import settings
+from django.core.mail import EmailMessage, get_connection
+from django.db import transaction
+from django.db.models import F
+from django.utils import timezone
+
+from .jobs import backoff
+from .models import OutboundMail
+
+logger = logging.getLogger(__name__)
+
+# Durée de réservation d'un lot : passé ce délai (worker arrêté en cours
+# d'envoi), ses messages peuvent être repris par un autre worker
+LEASE = timedelta(minutes=5)
+# Erreurs propres à un message : les autres mettent en cause la connexion
+MESSAGE_ERRORS = (smtplib.SMTPRecipientsRefused, smtplib.SMTPSenderRefused, smtplib.SMTPDataError)
+
+RESET_PIN_SUBJECT = "Réinitialisation du mot de passe"
+RESET_PIN_BODY = "Votre code de réinitialisation est : {pin}\n\nIl est valide pendant 10 minutes."
+
+
+def spool(to, subject, body):
+    """Met un message en file ; envoyé après le commit de la transaction courante."""
+    return OutboundMail.objects.create(
+        to=to, subject=subject, body=body,
+        max_attempts=getattr(settings, 'MAIL_SPOOL_MAX_ATTEMPTS', 8),
+    )
+
+
+def issue_reset_pin(user):
+    """Génère le PIN de ``user`` et met en file l'e-mail qui le communique."""
+    with transaction.atomic():
+        user.generate_reset_pin()
+        spool(user.email, RESET_PIN_SUBJECT, RESET_PIN_BODY.format(pin=user.reset_pin))
+
+
+def claim(limit=100):
+    """Réserve jusqu'à ``limit`` messages à envoyer (UPDATE conditionnel, comme ``jobs.claim``)."""
+    now = timezone.now()
+    candidates = (
+        OutboundMail.objects
+        .filter(status__in=[OutboundMail.Statut.EN_ATTENTE, OutboundMail.Statut.EN_COURS],
+                send_after__lte=now)
+        .order_by('send_after', 'id')
+        .values_list('pk', 'status')[:limit]
+    )
+    claimed = []
+    for pk, current in list(candidates):
+        won = OutboundMail.objects.filter(pk=pk, status=current, send_after__lte=now).update(
+            status=OutboundMail.Statut.EN_COURS, send_after=now + LEASE,
+        )
+        if won:
+            claimed.append(pk)
+    return claimed
+
+
+def retry_later(pks, error):
+    """Compte une tentative pour ``pks`` et les replanifie (ou les abandonne)."""
+    now = timezone.now()
+    for mail in OutboundMail.objects.filter(pk__in=pks).only('pk', 'attempts', 'max_attempts'):
+        attempts = mail.attempts + 1
+        if attempts >= mail.max_attempts:
+            fields = {'status': OutboundMail.Statut.ECHEC, 'body': ''}
+        else:
+            fields = {'status': OutboundMail.Statut.EN_ATTENTE, 'send_after': now + backoff(attempts)}
+        OutboundMail.objects.filter(pk=mail.pk, status=OutboundMail.Statut.EN_COURS).update(
+            attempts=F('attempts') + 1, last_error=repr(error), **fields,
+        )
+
+
+def close_quietly(connection):
+    try:
+        connection.close()
+    except (smtplib.SMTPException, OSError):
+        pass
+
+
+def deliver(limit=100, connection=None):
+    """Envoie un lot de messages sur ``connection`` ; retourne ``(envoyés, en échec)``.
+
+    Sans ``connection``, une connexion est ouverte puis fermée pour le lot.
+    """
+    claimed = claim(limit)
+    if not claimed:
+        return 0, 0
+    own_connection = connection is None
+    if own_connection:
+        connection = get_connection()
+    try:
+        # Ouverte une fois pour tout le lot (sans effet si elle l'est déjà)
+        connection.open()
+    except (smtplib.SMTPException, OSError) as exc:
+        logger.warning("Serveur SMTP indisponible : %r", exc)
+        retry_later(claimed, exc)
+        return 0, len(claimed)
+    sent, failed = [], []
+    mails = list(OutboundMail.objects.filter(pk__in=claimed).order_by('id'))
+    try:
+        for index, mail in enumerate(mails):
+            message = EmailMessage(mail.subject, mail.body, to=[mail.to], connection=connection)
+            try:
+                connection.send_messages([message])
+            except MESSAGE_ERRORS as exc:
+                logger.warning("Message %s refusé : %r", mail.pk, exc)
+                retry_later([mail.pk], exc)
+                failed.append(mail.pk)
+            except (smtplib.SMTPException, OSError) as exc:
+                # Connexion perdue ou serveur indisponible : le reste du lot attendra
+                logger.warning("Envoi interrompu : %r", exc)
+                close_quietly(connection)
+                rest = [other.pk for other in mails[index:]]
+                retry_later(rest, exc)
+                failed.extend(rest)
+                break
+            else:
+                sent.append(mail.pk)
+    finally:
+        OutboundMail.objects.filter(pk__in=sent).update(
+            status=OutboundMail.Statut.ENVOYE, sent_at=timezone.now(), last_error='', body='',
+        )
+        if own_connection:
+            close_quietly(connection)
+    return len(sent), len(failed)
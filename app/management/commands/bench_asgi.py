@@ -0,0 +1,125 @@
+import asyncio
+import logging
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from django.core.mail.backends.locmem import EmailBackend
+from django.core.management.base import BaseCommand
+from django.db import close_old_connections
+from django.test import AsyncClient, Client as WSGIClient
+from django.test.utils import override_settings
+
+from app.models import Client, User
+
+BENCH_PREFIX = 'benchasgi'
+MAIL_LATENCY = {'seconds': 0.2}
+
+
+class SlowEmailBackend(EmailBackend):
+    """Boîte locale qui simule la latence d'un serveur SMTP distant."""
+
+    def send_messages(self, messages):
+        time.sleep(MAIL_LATENCY['seconds'])
+        return super().send_messages(messages)
+
+
+class Command(BaseCommand):
+    help = ("Compare le débit des routes synchrones (WSGI, pool de threads) et de leurs "
+            "variantes asynchrones (ASGI, une boucle) à concurrence croissante")
+
+    def add_arguments(self, parser):
+        parser.add_argument('--concurrency', type=int, nargs='+', default=[1, 8, 32, 128],
+                            help='Requêtes simultanées')
+        parser.add_argument('--wsgi-workers', type=int, default=8,
+                            help='Threads du déploiement WSGI simulé')
+        parser.add_argument('--requests', type=int, default=4, help='Requêtes par client simultané')
+        parser.add_argument('--mail-latency', type=float, default=0.2,
+                            help="Latence simulée du serveur SMTP (secondes)")
+
+    def handle(self, *args, **options):
+        MAIL_LATENCY['seconds'] = options['mail_latency']
+        client_ids = list(Client.objects.order_by('pk').values_list('pk', flat=True)[:200])
+        if not client_ids:
+            self.stderr.write('Aucun client en base : lancer seed_clients ou bench_search --size.')
+            return
+        emails = [f'{BENCH_PREFIX}{i}@digitaratasy.mg' for i in range(max(options['concurrency']))]
+        for i, email in enumerate(emails):
+            User.objects.get_or_create(email=email, defaults={'username': f'{BENCH_PREFIX}{i}'})
+
+        scenarios = [
+            ('client', 'GET', lambda i: f'/api/clients/{client_ids[i % len(client_ids)]}/',
+             lambda i: f'/api/async/clients/{client_ids[i % len(client_ids)]}/', None),
+            ('qrcode', 'GET', lambda i: f'/api/clients/{client_ids[i % len(client_ids)]}/qrcode.png/',
+             lambda i: f'/api/async/clients/{client_ids[i % len(client_ids)]}/qrcode.png', None),
+            ('stats', 'GET', lambda i: '/api/stats/', lambda i: '/api/async/stats/', None),
+            ('forgot-password', 'POST', lambda i: '/api/forgot-password/',
+             lambda i: '/api/async/forgot-password/', lambda i: {'email': emails[i % len(emails)]}),
+        ]
+        backend = f'{__name__}.SlowEmailBackend'
+        # Les erreurs sont comptées, pas journalisées requête par requête
+        logging.getLogger('django.request').setLevel(logging.CRITICAL)
+        try:
+            with override_settings(EMAIL_BACKEND=backend):
+                for name, method, sync_path, async_path, body in scenarios:
+                    self.stdout.write(f'{name} :')
+                    for concurrency in options['concurrency']:
+                        total = concurrency * options['requests']
+                        wsgi = self.run_wsgi(method, sync_path, body, total,
+                                             min(concurrency, options['wsgi_workers']))
+                        asgi = asyncio.run(self.run_asgi(method, async_path, body, total, concurrency))
+                        self.stdout.write(
+                            f'  concurrence {concurrency:>4} : WSGI {self.describe(wsgi)} | '
+                            f'ASGI {self.describe(asgi)}'
+                        )
+        finally:
+            User.objects.filter(email__startswith=BENCH_PREFIX).delete()
+
+    @staticmethod
+    def describe(result):
+        elapsed, latencies, errors = result
+        latencies.sort()
+        p95 = latencies[int(len(latencies) * 0.95)] * 1000 if latencies else 0
+        text = f'{len(latencies) / elapsed:7.0f} req/s, p95 {p95:6.0f} ms'
+        return text + (f', {errors} erreur(s)' if errors else '')
+
+    def run_wsgi(self, method, path, body, total, workers):
+        def request(i):
+            client = WSGIClient(raise_request_exception=False)
+            start = time.perf_counter()
+            try:
+                if method == 'GET':
+                    response = client.get(path(i))
+                else:
+                    response = client.post(path(i), body(i), content_type='application/json')
+            finally:
+                close_old_connections()
+            return time.perf_counter() - start, response.status_code
+
+        start = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=workers) as pool:
+            results = list(pool.map(request, range(total)))
+        return self.summarize(start, results)
+
+    async def run_asgi(self, method, path, body, total, concurrency):
+        client = AsyncClient(raise_request_exception=False)
+        limit = asyncio.Semaphore(concurrency)
+
+        async def request(i):
+            async with limit:
+                start = time.perf_counter()
+                if method == 'GET':
+                    response = await client.get(path(i))
+                else:
+                    response = await client.post(path(i), body(i), content_type='application/json')
+                return time.perf_counter() - start, response.status_code
+
+        start = time.perf_counter()
+        results = await asyncio.gather(*(request(i) for i in range(total)))
+        return self.summarize(start, results)
+
+    @staticmethod
+    def summarize(start, results):
+        elapsed = time.perf_counter() - start
+        latencies = [latency for latency, status_code in results if status_code < 400]
+        errors = sum(1 for _, status_code in results if status_code >= 400)
+        return elapsed, latencies, errors
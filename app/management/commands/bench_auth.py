@@ -0,0 +1,48 @@
+import time
+
+from django.core.management.base import BaseCommand
+from django.db import connection
+from django.test.utils import CaptureQueriesContext
+from rest_framework.permissions import IsAdminUser, IsAuthenticated
+from rest_framework.request import Request
+from rest_framework.test import APIRequestFactory
+from rest_framework_simplejwt.authentication import JWTAuthentication
+
+from app.authentication import ClaimsJWTAuthentication
+from app.models import User
+from app.serializer import MytokenObtainPairView
+
+BENCH_EMAIL = 'bench.auth@digitaratasy.mg'
+
+
+class Command(BaseCommand):
+    help = "Compare le débit de l'authentification JWT (ligne User relue ou claims)"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--requests', type=int, default=20000, help='Requêtes par backend')
+
+    def handle(self, *args, **options):
+        user = User.objects.filter(email=BENCH_EMAIL).first()
+        if user is None:
+            user = User.objects.create_user(
+                username='bench.auth', email=BENCH_EMAIL, password='bench', is_staff=True,
+            )
+        token = str(MytokenObtainPairView.get_token(user).access_token)
+        request = APIRequestFactory().get('/api/', HTTP_AUTHORIZATION=f'Bearer {token}')
+        permissions = [IsAuthenticated(), IsAdminUser()]
+
+        for name, backend in (('JWTAuthentication', JWTAuthentication()),
+                              ('ClaimsJWTAuthentication', ClaimsJWTAuthentication())):
+            # Premier passage hors mesure : remplit le cache d'état
+            backend.authenticate(Request(request))
+            with CaptureQueriesContext(connection) as context:
+                start = time.perf_counter()
+                for _ in range(options['requests']):
+                    drf_request = Request(request)
+                    drf_request.user, drf_request.auth = backend.authenticate(drf_request)
+                    assert all(p.has_permission(drf_request, None) for p in permissions)
+                elapsed = time.perf_counter() - start
+            self.stdout.write(
+                f'{name:<24} {options["requests"] / elapsed:10.0f} req/s  '
+                f'{len(context.captured_queries) / options["requests"]:.2f} requête(s) SQL/req'
+            )
@@ -0,0 +1,69 @@
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import date
+
+from django.core.management.base import BaseCommand
+from django.db import close_old_connections
+
+from app.bulk import batched
+from app.models import Client, DemandeActe, User
+from app.workflow import claim_next
+
+BENCH_PREFIX = 'BENCHQ'
+
+
+class Command(BaseCommand):
+    help = 'Mesure le débit de réservation des demandes par des agents concurrents'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--demandes', type=int, default=5000, help='Demandes synthétiques à créer')
+        parser.add_argument('--agents', type=int, default=16, help='Agents (threads) concurrents')
+        parser.add_argument('--batch', type=int, default=10, help='Demandes réservées par appel')
+
+    def handle(self, *args, **options):
+        agents = self.agents(options['agents'])
+        self.populate(options['demandes'])
+
+        def work(agent):
+            claimed = []
+            try:
+                while ids := claim_next(agent, limit=options['batch']):
+                    claimed.extend(ids)
+            finally:
+                close_old_connections()
+            return claimed
+
+        start = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=len(agents)) as pool:
+            results = list(pool.map(work, agents))
+        elapsed = time.perf_counter() - start
+
+        claimed = [pk for ids in results for pk in ids]
+        self.stdout.write(
+            f'{len(claimed)} demandes réservées par {len(agents)} agents en {elapsed:.2f} s '
+            f'({len(claimed) / elapsed:.0f}/s), {len(claimed) - len(set(claimed))} en double'
+        )
+        deleted, _ = Client.objects.filter(cin__startswith=BENCH_PREFIX).delete()
+        User.objects.filter(username__startswith=BENCH_PREFIX).delete()
+        self.stdout.write(f'{deleted} lignes synthétiques supprimées')
+
+    def agents(self, count):
+        users = []
+        for i in range(count):
+            user, _ = User.objects.get_or_create(
+                email=f'{BENCH_PREFIX.lower()}{i}@digitaratasy.mg',
+                defaults={'username': f'{BENCH_PREFIX}{i}'},
+            )
+            users.append(user.pk)
+        return users
+
+    def populate(self, count):
+        for batch in batched(range(count), 2000):
+            clients = Client.objects.bulk_create(
+                Client(sexe='M', nom='Bench', prenom=str(i), date_naissance=date(1990, 1, 1),
+                       adresse='-', cin=f'{BENCH_PREFIX}{i:09d}', search_name=f'bench {i}')
+                for i in batch
+            )
+            DemandeActe.objects.bulk_create(
+                DemandeActe(client=client, type_acte='naissance') for client in clients
+            )
@@ -0,0 +1,105 @@
+import statistics
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import date
+
+from django.core.management.base import BaseCommand
+from django.db import OperationalError, close_old_connections, connection, transaction
+
+from app.models import Client, DemandeActe, User
+from app.search import search_clients
+from app.workflow import claim_next
+
+BENCH_PREFIX = 'BENCHDB'
+
+
+class Command(BaseCommand):
+    help = ("Mesure le débit de la base sous des agents concurrents (enrôlement, "
+            "mise à jour, recherche, réservation) avec le profil DATABASE_PROFILE courant")
+
+    def add_arguments(self, parser):
+        parser.add_argument('--agents', type=int, default=16, help='Agents (threads) concurrents')
+        parser.add_argument('--operations', type=int, default=100, help='Itérations par agent')
+
+    def handle(self, *args, **options):
+        settings_dict = connection.settings_dict
+        self.stdout.write(
+            f"Moteur {connection.vendor}, CONN_MAX_AGE={settings_dict['CONN_MAX_AGE']}, "
+            f"options {sorted(settings_dict['OPTIONS'])}"
+        )
+        if connection.vendor == 'sqlite':
+            with connection.cursor() as cursor:
+                cursor.execute('PRAGMA journal_mode')
+                self.stdout.write(f'journal_mode={cursor.fetchone()[0]}')
+
+        agents = [
+            User.objects.get_or_create(
+                email=f'{BENCH_PREFIX.lower()}{i}@digitaratasy.mg',
+                defaults={'username': f'{BENCH_PREFIX}{i}'},
+            )[0].pk
+            for i in range(options['agents'])
+        ]
+        latencies = {'enrolement': [], 'mise a jour': [], 'recherche': [], 'reservation': []}
+        errors = []
+        lock = threading.Lock()
+        sequence = iter(range(10 ** 9))
+
+        def timed(name, function):
+            start = time.perf_counter()
+            try:
+                function()
+            except OperationalError as e:
+                with lock:
+                    errors.append(str(e))
+                return
+            with lock:
+                latencies[name].append(time.perf_counter() - start)
+
+        def work(agent):
+            try:
+                for _ in range(options['operations']):
+                    with lock:
+                        n = next(sequence)
+                    client = Client(sexe='M', nom='Bench', prenom=f'Agent {agent}',
+                                    date_naissance=date(1990, 1, 1), adresse='-',
+                                    cin=f'{BENCH_PREFIX}{n:09d}')
+
+                    def enrol():
+                        with transaction.atomic():
+                            client.save()
+                            DemandeActe.objects.create(client=client, type_acte='naissance')
+
+                    def update():
+                        client.adresse = f'Lot {n}'
+                        client.save()
+
+                    timed('enrolement', enrol)
+                    if client.pk:
+                        timed('mise a jour', update)
+                    timed('recherche', lambda: list(search_clients(q='bench agent')[:20]))
+                    timed('reservation', lambda: claim_next(agent, limit=1))
+            finally:
+                close_old_connections()
+
+        start = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=len(agents)) as pool:
+            list(pool.map(work, agents))
+        elapsed = time.perf_counter() - start
+
+        done = sum(len(values) for values in latencies.values())
+        self.stdout.write(f'{done} opérations en {elapsed:.2f} s ({done / elapsed:.0f}/s), '
+                          f'{len(errors)} erreur(s)')
+        for name, values in latencies.items():
+            if values:
+                values.sort()
+                self.stdout.write(
+                    f'  {name:<12} médiane {statistics.median(values) * 1000:7.1f} ms, '
+                    f'p95 {values[int(len(values) * 0.95)] * 1000:7.1f} ms'
+                )
+        for message in sorted(set(errors)):
+            self.stdout.write(self.style.WARNING(f'  {errors.count(message)} x {message}'))
+
+        deleted, _ = Client.objects.filter(cin__startswith=BENCH_PREFIX).delete()
+        User.objects.filter(username__startswith=BENCH_PREFIX).delete()
+        self.stdout.write(f'{deleted} lignes synthétiques supprimées')
@@ -0,0 +1,57 @@
+import time
+
+from django.conf import settings
+from django.contrib.auth.hashers import make_password
+from django.core.management.base import BaseCommand
+from django.db import connection
+from django.test import override_settings
+from django.test.utils import CaptureQueriesContext
+from rest_framework.test import APIRequestFactory
+
+from app.models import User
+from app.views import MyTokenObtainPairView
+
+BENCH_EMAIL = 'bench.login@digitaratasy.mg'
+BENCH_PASSWORD = 'bench-login'
+
+
+class Command(BaseCommand):
+    help = 'Mesure le débit de /api/token/ pour chaque hacheur de mot de passe'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--logins', type=int, default=30, help='Connexions par hacheur')
+        parser.add_argument('--hasher', action='append', dest='hashers',
+                            help='Chemin du hacheur à mesurer (répétable) ; '
+                                 'par défaut la politique actuelle et le PBKDF2 de Django')
+
+    def handle(self, *args, **options):
+        hashers = options['hashers'] or [
+            settings.PASSWORD_HASHERS[0],
+            'django.contrib.auth.hashers.PBKDF2PasswordHasher',
+        ]
+        user = User.objects.filter(email=BENCH_EMAIL).first()
+        if user is None:
+            user = User.objects.create_user(
+                username='bench.login', email=BENCH_EMAIL, password=BENCH_PASSWORD,
+            )
+        view = MyTokenObtainPairView.as_view()
+        factory = APIRequestFactory()
+
+        for hasher in hashers:
+            # Un seul hacheur actif : pas de réécriture du hachage pendant la mesure
+            with override_settings(PASSWORD_HASHERS=[hasher]):
+                User.objects.filter(pk=user.pk).update(password=make_password(BENCH_PASSWORD))
+                with CaptureQueriesContext(connection) as context:
+                    start = time.perf_counter()
+                    for _ in range(options['logins']):
+                        request = factory.post(
+                            '/api/token/', {'email': BENCH_EMAIL, 'password': BENCH_PASSWORD},
+                            format='json',
+                        )
+                        response = view(request)
+                        assert response.status_code == 200, response.data
+                    elapsed = time.perf_counter() - start
+            self.stdout.write(
+                f'{hasher.rsplit(".", 1)[-1]:<28} {options["logins"] / elapsed:7.1f} connexions/s  '
+                f'{len(context.captured_queries) / options["logins"]:.1f} requête(s) SQL/connexion'
+            )
@@ -0,0 +1,89 @@
+import statistics
+import time
+
+from django.core.mail import get_connection, send_mail
+from django.core.management.base import BaseCommand
+from django.test import Client as WSGIClient
+from django.test.utils import override_settings
+
+from app import mailspool
+from app.models import OutboundMail, User
+from app.smtpsink import SMTPSink
+
+BENCH_PREFIX = 'benchmail'
+
+
+class Command(BaseCommand):
+    help = ("Mesure la latence de forgot-password (e-mail en file) face à un envoi SMTP "
+            "dans la requête, et le débit du worker (connexion réutilisée ou non)")
+
+    def add_arguments(self, parser):
+        parser.add_argument('--messages', type=int, default=200, help='Messages envoyés par mesure')
+        parser.add_argument('--connect-latency', type=float, default=0.3,
+                            help='Latence de connexion du serveur SMTP simulé (TLS, authentification)')
+        parser.add_argument('--message-latency', type=float, default=0.01,
+                            help='Latence par message du serveur SMTP simulé')
+
+    def handle(self, *args, **options):
+        count = options['messages']
+        sink = SMTPSink(connect_latency=options['connect_latency'],
+                        message_latency=options['message_latency']).start()
+        smtp = override_settings(
+            EMAIL_BACKEND='django.core.mail.backends.smtp.EmailBackend',
+            EMAIL_HOST=sink.host, EMAIL_PORT=sink.port,
+        )
+        emails = [f'{BENCH_PREFIX}{i}@digitaratasy.mg' for i in range(min(count, 50))]
+        for i, email in enumerate(emails):
+            User.objects.get_or_create(email=email, defaults={'username': f'{BENCH_PREFIX}{i}'})
+        try:
+            with smtp:
+                self.endpoint(count, emails)
+                self.worker(count, sink)
+        finally:
+            sink.stop()
+            OutboundMail.objects.filter(to__startswith=BENCH_PREFIX).delete()
+            User.objects.filter(email__in=emails).delete()
+
+    def endpoint(self, count, emails):
+        client = WSGIClient()
+        spooled, inline = [], []
+        for i in range(count):
+            started = time.perf_counter()
+            client.post('/api/forgot-password/', {'email': emails[i % len(emails)]},
+                        content_type='application/json')
+            spooled.append(time.perf_counter() - started)
+        # Ce que coûtait l'envoi dans la requête : une connexion par e-mail
+        for i in range(min(count, 20)):
+            started = time.perf_counter()
+            send_mail('PIN', 'Code', None, [emails[i % len(emails)]])
+            inline.append(time.perf_counter() - started)
+        for label, timings in (('en file', spooled), ('envoi dans la requête (SMTP seul)', inline)):
+            timings.sort()
+            self.stdout.write(
+                f"forgot-password, {label} : médiane {statistics.median(timings) * 1000:.1f} ms, "
+                f"p95 {timings[int(len(timings) * 0.95) - 1] * 1000:.1f} ms"
+            )
+
+    def worker(self, count, sink):
+        OutboundMail.objects.filter(to__startswith=BENCH_PREFIX).delete()
+        for label, limit, connection in (
+            ('connexion par message', 1, None),
+            ('connexion réutilisée, lots de 100', 100, get_connection()),
+        ):
+            for i in range(count):
+                mailspool.spool(f'{BENCH_PREFIX}{i}@digitaratasy.mg', 'PIN', f'Code {i}')
+            connections = sink.connections
+            started = time.perf_counter()
+            sent = 0
+            while True:
+                done, _ = mailspool.deliver(limit=limit, connection=connection)
+                if not done:
+                    break
+                sent += done
+            if connection is not None:
+                mailspool.close_quietly(connection)
+            elapsed = time.perf_counter() - started
+            self.stdout.write(
+                f"worker, {label} : {sent} message(s) en {elapsed:.2f} s "
+                f"({sent / elapsed:.0f}/s, {sink.connections - connections} connexion(s))"
+            )
@@ -0,0 +1,98 @@
+import random
+import statistics
+import time
+from datetime import date, timedelta
+
+from django.core.management.base import BaseCommand
+from django.db import connection
+
+from app.bulk import batched
+from app.models import Client, Commune
+from app.refcache import commune_region_id
+from app.search import fts_available, search_clients
+
+NOMS = ['Rakoto', 'Rabe', 'Randria', 'Razafy', 'Rasoa', 'Andriamanitra', 'Ravelo',
+        'Rajaonarison', 'Andrianarivo', 'Ratsimba', 'Rakotondrabe', 'Razanajatovo']
+PRENOMS = ['Jean', 'Hery', 'Faly', 'Voahirana', 'Tahiana', 'Miora', 'Lalaina',
+           'Fanomezantsoa', 'Nirina', 'Haingo', 'Tiana', 'Aina']
+BENCH_PREFIX = 'BENCH'
+
+
+class Command(BaseCommand):
+    help = 'Mesure la latence de la recherche de clients (p50/p95/p99)'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--populate', type=int, default=0,
+                            help='Insérer N clients synthétiques avant la mesure (ex. 1000000)')
+        parser.add_argument('--queries', type=int, default=200, help='Requêtes par scénario')
+        parser.add_argument('--cleanup', action='store_true',
+                            help='Supprimer les clients synthétiques après la mesure')
+
+    def handle(self, *args, **options):
+        communes = list(Commune.objects.values_list('pk', flat=True))
+        if options['populate']:
+            self.populate(options['populate'], communes)
+
+        total = Client.objects.count()
+        self.stdout.write(f'{total} clients, FTS5 {"actif" if fts_available() else "absent"}')
+
+        scenarios = {
+            'nom (préfixe)': lambda: {'q': random.choice(NOMS)[:4]},
+            'nom + prénom': lambda: {'q': f'{random.choice(NOMS)} {random.choice(PRENOMS)[:3]}'},
+            'CIN exact': lambda: {'cin': f'{BENCH_PREFIX}{random.randrange(max(total, 1)):09d}'},
+            'dates + nom': lambda: {
+                'q': random.choice(NOMS),
+                'born_after': date(1980, 1, 1),
+                'born_before': date(1985, 12, 31),
+            },
+        }
+        if communes:
+            scenarios['commune + dates'] = lambda: {
+                'commune': random.choice(communes),
+                'born_after': date(1990, 1, 1),
+                'born_before': date(1990, 6, 30),
+            }
+
+        for name, make_params in scenarios.items():
+            timings = []
+            for _ in range(options['queries']):
+                params = make_params()
+                start = time.perf_counter()
+                list(search_clients(**params)[:20])
+                timings.append((time.perf_counter() - start) * 1000)
+            timings.sort()
+            self.stdout.write(
+                f'{name:<18} p50={statistics.median(timings):7.2f} ms  '
+                f'p95={timings[int(len(timings) * 0.95) - 1]:7.2f} ms  '
+                f'p99={timings[int(len(timings) * 0.99) - 1]:7.2f} ms'
+            )
+
+        if options['cleanup']:
+            deleted, _ = Client.objects.filter(cin__startswith=BENCH_PREFIX).delete()
+            self.stdout.write(f'{deleted} lignes synthétiques supprimées')
+
+    def populate(self, count, communes):
+        """Insertion directe (sans comptes ni QR codes) : seule la recherche est mesurée."""
+        start = Client.objects.filter(cin__startswith=BENCH_PREFIX).count()
+
+        def rows():
+            for i in range(start, start + count):
+                client = Client(
+                    sexe=random.choice('MF'),
+                    nom=random.choice(NOMS),
+                    prenom=f'{random.choice(PRENOMS)} {random.choice(PRENOMS)}',
+                    date_naissance=date(1950, 1, 1) + timedelta(days=random.randrange(365 * 70)),
+                    lieu_naissance_id=random.choice(communes) if communes else None,
+                    adresse=f'Lot {i}',
+                    cin=f'{BENCH_PREFIX}{i:09d}',
+                )
+                client.refresh_search_name()
+                client.region_id = commune_region_id(client.lieu_naissance_id) if communes else None
+                yield client
+
+        for batch in batched(rows(), 5000):
+            Client.objects.bulk_create(batch)
+        with connection.cursor() as cursor:
+            if connection.vendor == 'sqlite':
+                cursor.execute('ANALYZE')
+        self.stdout.write(f'{count} clients synthétiques insérés')
@@ -0,0 +1,93 @@
+import csv
+import os
+import sys
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+
+from django.core.management.base import BaseCommand
+from django.db.models import Count
+
+from app.bulk import batched
+from app.duplicates import (
+    DEFAULT_THRESHOLD, MAX_BLOCK_SIZE, index_clients, score_blocks,
+)
+from app.models import Client, ClientBlockKey
+
+
+class Command(BaseCommand):
+    help = 'Recherche les doublons probables parmi tous les clients (par blocs, en parallèle)'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--threshold', type=float, default=DEFAULT_THRESHOLD,
+                            help='Score minimal (0 à 1) pour signaler une paire')
+        parser.add_argument('--workers', type=int, default=None, help='Processus du pool')
+        parser.add_argument('--reindex', action='store_true',
+                            help="Reconstruire l'index de blocage avant l'analyse")
+        parser.add_argument('--blocks-per-task', type=int, default=200)
+        parser.add_argument('--output', help='Fichier CSV des paires (sortie standard par défaut)')
+
+    def handle(self, *args, **options):
+        if options['reindex']:
+            self.reindex()
+
+        output = open(options['output'], 'w', newline='') if options['output'] else sys.stdout
+        writer = csv.writer(output)
+        writer.writerow(['client_a', 'client_b', 'score'])
+
+        # Blocs trop grands, non analysés : une paire qui y figure est signalée
+        # dans un autre bloc commun (voir duplicates.owns_pair)
+        skipped = frozenset(self.block_sizes().filter(n__gt=MAX_BLOCK_SIZE).values_list('key', flat=True))
+        if skipped:
+            self.stderr.write(f'{len(skipped)} blocs de plus de {MAX_BLOCK_SIZE} clients ignorés')
+
+        found = 0
+        workers = options['workers'] or os.cpu_count() or 1
+        with ProcessPoolExecutor(max_workers=workers) as pool:
+            # Fenêtre glissante de tâches : les blocs sont lus au rythme du pool
+            pending = deque()
+            window = workers * 2
+            for blocks in batched(self.blocks(), options['blocks_per_task']):
+                pending.append(pool.submit(score_blocks, blocks, options['threshold'], skipped))
+                if len(pending) >= window:
+                    found += self.write_pairs(pending.popleft().result(), writer)
+            while pending:
+                found += self.write_pairs(pending.popleft().result(), writer)
+
+        if output is not sys.stdout:
+            output.close()
+        self.stderr.write(self.style.SUCCESS(f'{found} paires de doublons probables'))
+
+    def write_pairs(self, pairs, writer):
+        # Chaque paire n'est signalée que par un seul bloc : pas de dédoublonnage
+        writer.writerows(pairs)
+        return len(pairs)
+
+    def reindex(self):
+        ClientBlockKey.objects.all().delete()
+        clients = Client.objects.only('nom', 'prenom', 'date_naissance', 'lieu_naissance').iterator(chunk_size=5000)
+        total = 0
+        for batch in batched(clients, 5000):
+            index_clients(batch, replace=False)
+            total += len(batch)
+        self.stderr.write(f'{total} clients indexés')
+
+    def block_sizes(self):
+        return ClientBlockKey.objects.values('key').annotate(n=Count('id'))
+
+    def blocks(self):
+        """Génère les blocs de plus d'un client : ``(clé, fiches)``."""
+        keys = (
+            self.block_sizes()
+            .filter(n__gt=1, n__lte=MAX_BLOCK_SIZE)
+            .values_list('key', flat=True)
+        )
+        for key_batch in batched(keys.iterator(chunk_size=2000), 500):
+            members = {}
+            rows = (
+                ClientBlockKey.objects.filter(key__in=key_batch)
+                .values_list('key', 'client_id', 'client__nom', 'client__prenom',
+                             'client__date_naissance', 'client__lieu_naissance_id')
+            )
+            for key, *record in rows:
+                members.setdefault(key, []).append(tuple(record))
+            yield from members.items()
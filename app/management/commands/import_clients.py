@@ -0,0 +1,55 @@
+import os
+
+from django.core.management.base import BaseCommand, CommandError
+
+from app.bulk import DEFAULT_BATCH_SIZE
+from app.imports import FORMATS, Checkpoint, ImportReport, detect_format, import_clients
+
+
+class Command(BaseCommand):
+    help = 'Importe un registre communal de clients (CSV ou NDJSON) en flux, par lots'
+
+    def add_arguments(self, parser):
+        parser.add_argument('path', help='Fichier CSV ou NDJSON à importer')
+        parser.add_argument('--format', choices=FORMATS, help="Format du fichier (déduit de l'extension par défaut)")
+        parser.add_argument('--batch-size', type=int, default=DEFAULT_BATCH_SIZE)
+        parser.add_argument('--checkpoint', help='Clé du point de contrôle (par défaut <chemin absolu>.checkpoint)')
+        parser.add_argument('--restart', action='store_true', help='Ignorer le point de contrôle existant')
+        parser.add_argument('--rejects', help='Fichier NDJSON recevant les lignes rejetées')
+
+    def handle(self, *args, **options):
+        path = options['path']
+        fmt = options['format'] or detect_format(path)
+        checkpoint = Checkpoint(options['checkpoint'] or f'{os.path.abspath(path)}.checkpoint')
+        if options['restart']:
+            checkpoint.save(position=0, created=0, rejected=0, done=False)
+        elif checkpoint.position:
+            self.stdout.write(f'Reprise à la ligne {checkpoint.position}')
+
+        rejects_file = open(options['rejects'], 'a') if options['rejects'] else None
+        report = ImportReport(
+            rejects_file=rejects_file,
+            created=checkpoint.state['created'],
+            rejected=checkpoint.state['rejected'],
+        )
+
+        def progress(report):
+            self.stdout.write(
+                f'{checkpoint.position} lignes lues, {report.created} créées, '
+                f'{report.rejected} rejetées ({report.rows_per_second:.0f} lignes/s)'
+            )
+
+        try:
+            with open(path, 'rb') as stream:
+                import_clients(stream, fmt, batch_size=options['batch_size'],
+                               checkpoint=checkpoint, report=report, on_batch=progress)
+        except FileNotFoundError:
+            raise CommandError(f'Fichier introuvable : {path}')
+        finally:
+            if rejects_file:
+                rejects_file.close()
+
+        self.stdout.write(self.style.SUCCESS(
+            f'Import terminé : {report.created} clients créés, {report.rejected} rejets, '
+            f'{report.rows_per_second:.0f} lignes/s'
+        ))
@@ -0,0 +1,32 @@
+from django.core.management.base import BaseCommand
+
+from app.bulk import batched
+from app.jobs import enqueue_many
+from app.models import Client
+from app.photos import PROCESSED
+from app.tasks import process_client_photo
+
+
+class Command(BaseCommand):
+    help = "Traite les photos de clients pas encore normalisées (envois antérieurs au pipeline)"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--now', action='store_true',
+                            help="Traiter dans ce processus au lieu d'enfiler des tâches")
+
+    def handle(self, *args, **options):
+        pending = (
+            Client.objects.exclude(image='').exclude(image__isnull=True)
+            .exclude(image__startswith=PROCESSED)
+            .values_list('pk', flat=True)
+        )
+        total = 0
+        for ids in batched(pending.iterator(), 1000):
+            if options['now']:
+                for pk in ids:
+                    process_client_photo(pk)
+            else:
+                enqueue_many([('client.process_photo', {'client_id': pk}) for pk in ids])
+            total += len(ids)
+        action = 'traitée(s)' if options['now'] else 'enfilée(s)'
+        self.stdout.write(self.style.SUCCESS(f'{total} photo(s) {action}'))
@@ -0,0 +1,22 @@
+from django.core.management.base import BaseCommand
+
+from app.tokens import prune_expired, table_sizes
+
+
+class Command(BaseCommand):
+    help = ('Supprime par lots les jetons de rafraîchissement expirés '
+            '(tables token_blacklist) ; à planifier, par exemple chaque nuit')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch', type=int, default=5000, help='Jetons supprimés par requête')
+
+    def handle(self, *args, **options):
+        before = table_sizes()
+        self.stdout.write(self.format_sizes('Avant', before))
+        deleted = prune_expired(batch_size=options['batch'])
+        self.stdout.write(self.format_sizes('Après', table_sizes()))
+        self.stdout.write(self.style.SUCCESS(f'{deleted} jeton(s) expiré(s) supprimé(s)'))
+
+    def format_sizes(self, label, sizes):
+        return (f"{label} : {sizes['outstanding']} émis ({sizes['outstanding_expired']} expirés), "
+                f"{sizes['blacklisted']} en liste noire ({sizes['blacklisted_expired']} expirés)")
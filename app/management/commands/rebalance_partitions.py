@@ -0,0 +1,42 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from app.models import Client, DemandeActe
+from app.partitions import REBALANCE_CHUNK_SIZE, misplaced, rebalance
+
+MODELS = {'clients': Client, 'demandes': DemandeActe}
+
+
+class Command(BaseCommand):
+    help = ("Réaffecte à leur partition (région) les clients et demandes mal placés, "
+            "par tranches d'identifiants")
+
+    def add_arguments(self, parser):
+        parser.add_argument('--model', choices=MODELS, action='append',
+                            help='Table à traiter (par défaut : toutes)')
+        parser.add_argument('--commune', type=int, help='Limiter à une commune')
+        parser.add_argument('--chunk', type=int, default=REBALANCE_CHUNK_SIZE,
+                            help="Identifiants par tranche (une transaction chacune)")
+        parser.add_argument('--dry-run', action='store_true',
+                            help='Compter les lignes mal placées sans les déplacer')
+
+    def handle(self, *args, **options):
+        for name in options['model'] or MODELS:
+            model = MODELS[name]
+            if options['dry_run']:
+                rows = misplaced(model)
+                if options['commune']:
+                    rows = rows.filter(**{'lieu_naissance' if model is Client else 'commune': options['commune']})
+                self.stdout.write(f'{name} : {rows.count()} ligne(s) mal placée(s)')
+                continue
+
+            start = time.perf_counter()
+            total = 0
+            for last_id, moved in rebalance(model, commune=options['commune'], chunk_size=options['chunk']):
+                total += moved
+                if moved:
+                    self.stdout.write(f'  {name} jusqu’à #{last_id} : {moved} déplacée(s)')
+            self.stdout.write(self.style.SUCCESS(
+                f'{name} : {total} ligne(s) réaffectée(s) en {time.perf_counter() - start:.1f} s'
+            ))
@@ -0,0 +1,11 @@
+from django.core.management.base import BaseCommand
+
+from app import stats
+
+
+class Command(BaseCommand):
+    help = 'Recalcule la table des compteurs statistiques à partir des données'
+
+    def handle(self, *args, **options):
+        stats.rebuild()
+        self.stdout.write(self.style.SUCCESS('Compteurs statistiques reconstruits'))
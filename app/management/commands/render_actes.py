@@ -0,0 +1,52 @@
+import os
+import time
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.utils import timezone
+
+from app.actes import printable_demandes, stream_zip
+from app.models import Commune, DemandeActe
+
+
+class Command(BaseCommand):
+    help = "Rend les actes des demandes traitées d'une commune dans une archive ZIP"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--commune', required=True, help='Identifiant ou nom de la commune')
+        parser.add_argument('--reimpression', action='store_true',
+                            help='Inclure les demandes déjà délivrées')
+        parser.add_argument('--workers', type=int, default=os.cpu_count() or 1,
+                            help='Processus de rendu')
+        parser.add_argument('--batch', type=int, default=500, help='Actes rendus par lot')
+        parser.add_argument('--output', help='Archive à écrire (par défaut sous var/actes/)')
+
+    def handle(self, *args, **options):
+        commune = self.get_commune(options['commune'])
+        demandes = printable_demandes().filter(commune=commune).order_by('date_demande', 'id')
+        if not options['reimpression']:
+            demandes = demandes.filter(statut=DemandeActe.Statut.TRAITEE)
+
+        output = options['output'] or os.path.join(
+            settings.BASE_DIR, 'var', 'actes',
+            f"{commune.pk}-{timezone.localdate().isoformat()}.zip",
+        )
+        os.makedirs(os.path.dirname(os.path.abspath(output)), exist_ok=True)
+
+        total = demandes.count()
+        start = time.perf_counter()
+        with open(output, 'wb') as f:
+            for chunk in stream_zip(demandes, batch_size=options['batch'],
+                                    workers=options['workers']):
+                f.write(chunk)
+        elapsed = time.perf_counter() - start
+        self.stdout.write(self.style.SUCCESS(
+            f'{total} acte(s) de {commune.nom} écrits dans {output} en {elapsed:.1f} s'
+        ))
+
+    def get_commune(self, value):
+        queryset = Commune.objects.filter(pk=value) if value.isdigit() else Commune.objects.filter(nom__iexact=value)
+        communes = list(queryset[:2])
+        if len(communes) != 1:
+            raise CommandError(f"Commune '{value}' introuvable ou ambiguë.")
+        return communes[0]
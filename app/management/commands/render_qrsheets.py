@@ -0,0 +1,55 @@
+import os
+import time
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.utils import timezone
+
+from app.models import Commune, Region
+from app.sheets import CARDS_PER_PAGE, FORMATS, sheet_clients, stream_sheets
+
+
+class Command(BaseCommand):
+    help = "Rend les planches de cartes QR des clients d'une commune ou d'une région"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--commune', help='Identifiant ou nom de la commune de naissance')
+        parser.add_argument('--region', help='Identifiant ou nom de la région')
+        parser.add_argument('--format', choices=FORMATS, default='pdf',
+                            help='pdf (un seul fichier) ou png (archive ZIP, une image par page)')
+        parser.add_argument('--workers', type=int, default=os.cpu_count() or 1,
+                            help='Processus de rendu')
+        parser.add_argument('--output', help='Fichier à écrire (par défaut sous var/planches/)')
+
+    def handle(self, *args, **options):
+        commune = self.get_object(Commune, options['commune']) if options['commune'] else None
+        region = self.get_object(Region, options['region']) if options['region'] else None
+        if commune is None and region is None:
+            raise CommandError("Indiquez --commune ou --region.")
+        clients = sheet_clients(commune=commune, region=region)
+
+        name = commune.pk if commune else f"region-{region.pk}"
+        extension = 'pdf' if options['format'] == 'pdf' else 'zip'
+        output = options['output'] or os.path.join(
+            settings.BASE_DIR, 'var', 'planches',
+            f"{name}-{timezone.localdate().isoformat()}.{extension}",
+        )
+        os.makedirs(os.path.dirname(os.path.abspath(output)), exist_ok=True)
+
+        total = clients.count()
+        start = time.perf_counter()
+        with open(output, 'wb') as f:
+            for chunk in stream_sheets(clients, format=options['format'], workers=options['workers']):
+                f.write(chunk)
+        elapsed = time.perf_counter() - start
+        pages = -(-total // CARDS_PER_PAGE)
+        self.stdout.write(self.style.SUCCESS(
+            f'{total} carte(s) sur {pages} page(s) écrites dans {output} en {elapsed:.1f} s'
+        ))
+
+    def get_object(self, model, value):
+        queryset = model.objects.filter(pk=value) if value.isdigit() else model.objects.filter(nom__iexact=value)
+        objects = list(queryset[:2])
+        if len(objects) != 1:
+            raise CommandError(f"{model._meta.verbose_name.capitalize()} '{value}' introuvable ou ambiguë.")
+        return objects[0]
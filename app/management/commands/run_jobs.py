@@ -0,0 +1,44 @@
+import time
+from datetime import timedelta
+
+from django.core.management.base import BaseCommand
+
+from app import jobs
+
+# Fréquence du nettoyage des tâches terminées (secondes)
+PRUNE_EVERY = 3600
+
+
+class Command(BaseCommand):
+    help = 'Exécute les tâches de fond en attente (comptes clients, QR codes...)'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--workers', type=int, default=4, help='Nombre de threads du worker')
+        parser.add_argument('--batch', type=int, default=100, help='Tâches réservées par tour')
+        parser.add_argument('--poll-interval', type=float, default=1.0,
+                            help='Attente (en secondes) quand la file est vide')
+        parser.add_argument('--once', action='store_true', help='Vider la file puis quitter')
+        parser.add_argument('--keep-days', type=float, default=None,
+                            help='Conservation des tâches terminées (défaut : JOBS_RETENTION)')
+
+    def handle(self, *args, **options):
+        older_than = timedelta(days=options['keep_days']) if options['keep_days'] is not None else None
+        total = 0
+        last_prune = None
+        while True:
+            done = jobs.run_pending(limit=options['batch'], workers=options['workers'])
+            total += done
+            if done:
+                self.stdout.write(f'{done} tâche(s) exécutée(s)')
+                continue
+            # File vide : nettoyage des tâches terminées, au plus une fois par heure
+            if last_prune is None or time.monotonic() - last_prune >= PRUNE_EVERY:
+                pruned = jobs.prune(older_than)
+                last_prune = time.monotonic()
+                if pruned:
+                    self.stdout.write(f'{pruned} tâche(s) terminée(s) supprimée(s)')
+            if options['once']:
+                break
+            time.sleep(options['poll_interval'])
+
+        self.stdout.write(self.style.SUCCESS(f'{total} tâche(s) exécutée(s) au total'))
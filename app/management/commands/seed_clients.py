@@ -73,5 +73,5 @@ class Command(BaseCommand):
 
         self.stdout.write(self.style.SUCCESS('Relations familiales créées avec succès'))
 
-        # 3. Les utilisateurs sont créés automatiquement via le signal post_save
+        # 3. Les utilisateurs sont créés par le worker de tâches (manage.py run_jobs)
         self.stdout.write(self.style.SUCCESS(f'{User.objects.filter(is_client=True).count()} utilisateurs clients créés automatiquement'))
\ No newline at end of file
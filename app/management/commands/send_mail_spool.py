@@ -0,0 +1,41 @@
+import time
+
+from django.core.mail import get_connection
+from django.core.management.base import BaseCommand
+
+from app import mailspool
+
+
+class Command(BaseCommand):
+    help = "Envoie les e-mails en file (PIN de réinitialisation...) sur une connexion SMTP réutilisée"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch', type=int, default=100, help='Messages réservés par lot')
+        parser.add_argument('--poll-interval', type=float, default=1.0,
+                            help='Attente (en secondes) quand la file est vide')
+        parser.add_argument('--once', action='store_true', help='Vider la file puis quitter')
+
+    def handle(self, *args, **options):
+        # Une seule connexion, gardée ouverte tant qu'il reste des messages
+        connection = get_connection()
+        total_sent = total_failed = 0
+        try:
+            while True:
+                sent, failed = mailspool.deliver(limit=options['batch'], connection=connection)
+                total_sent += sent
+                total_failed += failed
+                if sent or failed:
+                    self.stdout.write(f'{sent} message(s) envoyé(s), {failed} à retenter')
+                    if sent:
+                        continue
+                # File vide (ou serveur en panne) : la connexion inactive est fermée
+                mailspool.close_quietly(connection)
+                if options['once']:
+                    break
+                time.sleep(options['poll_interval'])
+        finally:
+            mailspool.close_quietly(connection)
+
+        self.stdout.write(self.style.SUCCESS(
+            f'{total_sent} message(s) envoyé(s), {total_failed} échec(s) au total'
+        ))
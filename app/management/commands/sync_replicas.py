@@ -0,0 +1,38 @@
+import sqlite3
+import time
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from django.db import connections
+
+
+class Command(BaseCommand):
+    help = ("Copie la base SQLite principale vers les réplicas SQLite déclarés "
+            "(essais locaux du routage ; PostgreSQL se réplique lui-même)")
+
+    def handle(self, *args, **options):
+        primary = connections['default']
+        aliases = [alias for usage in settings.DATABASE_REPLICAS.values() for alias in usage]
+        if not aliases:
+            self.stdout.write("Aucun réplica déclaré (DATABASE_READ_REPLICAS, DATABASE_ANALYTICS_REPLICAS).")
+            return
+        if primary.vendor != 'sqlite':
+            self.stdout.write(f"Base {primary.vendor} : les réplicas sont alimentés par le serveur.")
+            return
+
+        source = sqlite3.connect(primary.settings_dict['NAME'])
+        try:
+            for alias in aliases:
+                start = time.perf_counter()
+                connections[alias].close()
+                target = sqlite3.connect(connections[alias].settings_dict['NAME'])
+                try:
+                    # Copie cohérente, même si la base principale est en cours d'écriture
+                    source.backup(target)
+                finally:
+                    target.close()
+                self.stdout.write(self.style.SUCCESS(
+                    f'{alias} : copie terminée en {time.perf_counter() - start:.2f} s'
+                ))
+        finally:
+            source.close()
@@ -0,0 +1,17 @@
+# Generated by Django 5.2 on 2026-10-18 14:54
+
+from django.db import migrations
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('app', '0006_client_conjoint_client_enfants'),
+    ]
+
+    operations = [
+        migrations.RemoveField(
+            model_name='client',
+            name='qrcode',
+        ),
+    ]
@@ -0,0 +1,45 @@
+# Generated by Django 5.2 on 2026-10-18 15:28
+
+from django.db import migrations, models
+
+from app.text import normalize
+
+
+def fill_search_name(apps, schema_editor):
+    Client = apps.get_model('app', 'Client')
+    batch = []
+    for client in Client.objects.only('nom', 'prenom').iterator(chunk_size=2000):
+        client.search_name = normalize(f"{client.nom} {client.prenom}")[:201]
+        batch.append(client)
+        if len(batch) == 2000:
+            Client.objects.bulk_update(batch, ['search_name'])
+            batch = []
+    Client.objects.bulk_update(batch, ['search_name'])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('app', '0009_statisticcounter'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='client',
+            name='search_name',
+            field=models.CharField(blank=True, editable=False, max_length=201),
+        ),
+        migrations.AddIndex(
+            model_name='client',
+            index=models.Index(fields=['search_name'], name='client_search_name_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='client',
+            index=models.Index(fields=['date_naissance'], name='client_naissance_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='client',
+            index=models.Index(fields=['lieu_naissance', 'date_naissance'], name='client_lieu_naissance_idx'),
+        ),
+        migrations.RunPython(fill_search_name, migrations.RunPython.noop),
+    ]
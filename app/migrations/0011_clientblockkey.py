@@ -0,0 +1,76 @@
+# Generated by Django 5.2 on 2026-10-18 15:40
+
+import unicodedata
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+CHUNK_SIZE = 5000
+
+
+# Copie figée des clés de blocage d'app/duplicates.py à la création de l'index
+
+def normalize(text):
+    text = unicodedata.normalize('NFKD', text or '')
+    text = ''.join(c for c in text if not unicodedata.combining(c))
+    return ' '.join(text.lower().split())
+
+
+def skeleton(name, length=4):
+    letters = []
+    for char in normalize(name).replace(' ', ''):
+        if char in 'aeiouy' or not char.isalpha():
+            continue
+        if not letters or letters[-1] != char:
+            letters.append(char)
+        if len(letters) == length:
+            break
+    return ''.join(letters)
+
+
+def block_keys(nom, prenom, date_naissance, lieu_naissance_id):
+    year = date_naissance.year if date_naissance else ''
+    keys = {
+        f'n:{year}:{skeleton(nom)}:{skeleton(prenom, 2)}',
+        f'p:{year}:{skeleton(prenom)}:{skeleton(nom, 2)}',
+    }
+    if date_naissance and lieu_naissance_id:
+        keys.add(f'd:{date_naissance.isoformat()}:{lieu_naissance_id}')
+    return keys
+
+
+def fill_block_keys(apps, schema_editor):
+    Client = apps.get_model('app', 'Client')
+    ClientBlockKey = apps.get_model('app', 'ClientBlockKey')
+    clients = Client.objects.order_by('pk').values_list(
+        'pk', 'nom', 'prenom', 'date_naissance', 'lieu_naissance_id',
+    )
+    last = 0
+    while chunk := list(clients.filter(pk__gt=last)[:CHUNK_SIZE]):
+        ClientBlockKey.objects.bulk_create(
+            ClientBlockKey(client_id=pk, key=key)
+            for pk, *record in chunk for key in block_keys(*record)
+        )
+        last = chunk[-1][0]
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('app', '0010_client_search'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ClientBlockKey',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('key', models.CharField(max_length=120)),
+                ('client', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='block_keys', to='app.client')),
+            ],
+            options={
+                'indexes': [models.Index(fields=['key', 'client'], name='client_block_key_idx')],
+            },
+        ),
+        migrations.RunPython(fill_block_keys, migrations.RunPython.noop),
+    ]
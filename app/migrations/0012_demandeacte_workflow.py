@@ -0,0 +1,63 @@
+# Generated by Django 5.2 on 2026-10-18 15:54
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+from django.db.models import OuterRef, Subquery
+
+from app.text import normalize
+
+STATUTS = {'en attente', 'en cours', 'traitee', 'delivree', 'rejetee'}
+
+
+def fill_workflow(apps, schema_editor):
+    DemandeActe = apps.get_model('app', 'DemandeActe')
+    Client = apps.get_model('app', 'Client')
+    DemandeActe.objects.filter(commune__isnull=True).update(commune=Subquery(
+        Client.objects.filter(pk=OuterRef('client_id')).values('lieu_naissance_id')[:1]
+    ))
+    # Statuts saisis librement : ramenés aux valeurs de la machine à états
+    # quand ils n'en diffèrent que par les accents ou la casse
+    for statut in DemandeActe.objects.values_list('statut', flat=True).distinct():
+        normalized = normalize(statut)
+        if normalized != statut and normalized in STATUTS:
+            DemandeActe.objects.filter(statut=statut).update(statut=normalized)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('app', '0011_clientblockkey'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='demandeacte',
+            name='agent',
+            field=models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='demandes_traitees', to=settings.AUTH_USER_MODEL),
+        ),
+        migrations.AddField(
+            model_name='demandeacte',
+            name='commune',
+            field=models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='demandes', to='app.commune'),
+        ),
+        migrations.AddField(
+            model_name='demandeacte',
+            name='date_prise_en_charge',
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+        migrations.AlterField(
+            model_name='demandeacte',
+            name='statut',
+            field=models.CharField(choices=[('en attente', 'En attente'), ('en cours', 'En cours de traitement'), ('traitee', 'Traitée'), ('delivree', 'Délivrée'), ('rejetee', 'Rejetée')], default='en attente', max_length=50),
+        ),
+        migrations.AddIndex(
+            model_name='demandeacte',
+            index=models.Index(fields=['statut', 'type_acte', 'date_demande'], name='demande_statut_type_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='demandeacte',
+            index=models.Index(fields=['commune', 'statut', 'date_demande'], name='demande_commune_queue_idx'),
+        ),
+        migrations.RunPython(fill_workflow, migrations.RunPython.noop),
+    ]
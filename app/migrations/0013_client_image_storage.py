@@ -0,0 +1,19 @@
+# Generated by Django 5.2 on 2026-10-18 15:58
+
+import app.photos
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('app', '0012_demandeacte_workflow'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='client',
+            name='image',
+            field=models.ImageField(blank=True, null=True, storage=app.photos.photo_storage, upload_to='client_images/'),
+        ),
+    ]
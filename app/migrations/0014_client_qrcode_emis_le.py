@@ -0,0 +1,25 @@
+# Generated by Django 5.2 on 2026-10-18 15:59
+
+from django.db import migrations, models
+from django.utils import timezone
+
+
+def fill_qrcode_emis_le(apps, schema_editor):
+    Client = apps.get_model('app', 'Client')
+    Client.objects.filter(qrcode_emis_le__isnull=True).update(qrcode_emis_le=timezone.now())
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('app', '0013_client_image_storage'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='client',
+            name='qrcode_emis_le',
+            field=models.DateTimeField(blank=True, editable=False, null=True),
+        ),
+        migrations.RunPython(fill_qrcode_emis_le, migrations.RunPython.noop),
+    ]
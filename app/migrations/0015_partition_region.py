@@ -0,0 +1,49 @@
+# Generated by Django 5.2 on 2026-10-18 16:06
+
+import django.db.models.deletion
+from django.db import migrations, models
+from django.db.models import Max, OuterRef, Subquery
+
+CHUNK_SIZE = 10000
+
+
+def fill_regions(apps, schema_editor):
+    Commune = apps.get_model('app', 'Commune')
+    for model_name, commune_field in (('Client', 'lieu_naissance'), ('DemandeActe', 'commune')):
+        model = apps.get_model('app', model_name)
+        region = Subquery(Commune.objects.filter(pk=OuterRef(commune_field)).values('region')[:1])
+        last = model.objects.aggregate(last=Max('pk'))['last'] or 0
+        # Par tranches d'identifiants : des transactions courtes sur les grosses tables
+        for start in range(0, last + 1, CHUNK_SIZE):
+            model.objects.filter(pk__gte=start, pk__lt=start + CHUNK_SIZE).update(region=region)
+
+
+class Migration(migrations.Migration):
+    # Chaque tranche de fill_regions est validée seule, pas tout le remplissage d'un coup
+    atomic = False
+
+    dependencies = [
+        ('app', '0014_client_qrcode_emis_le'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='client',
+            name='region',
+            field=models.ForeignKey(blank=True, db_index=False, editable=False, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='+', to='app.region'),
+        ),
+        migrations.AddField(
+            model_name='demandeacte',
+            name='region',
+            field=models.ForeignKey(blank=True, db_index=False, editable=False, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='+', to='app.region'),
+        ),
+        migrations.AddIndex(
+            model_name='client',
+            index=models.Index(fields=['region', 'search_name'], name='client_region_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='demandeacte',
+            index=models.Index(fields=['region', 'statut', 'date_demande'], name='demande_region_idx'),
+        ),
+        migrations.RunPython(fill_regions, migrations.RunPython.noop),
+    ]
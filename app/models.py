@@ -1,12 +1,10 @@
 from datetime import timedelta
 import random
-from django.db import models
+from django.db import IntegrityError, models, transaction
+from django.utils import timezone
+from .text import normalize
+from .photos import is_processed, photo_storage
 from django.contrib.auth.models import AbstractUser
-from django.db.models.signals import post_save, pre_save, m2m_changed
-from django.dispatch import receiver
-import qrcode
-import base64
-from io import BytesIO
 from django.core.exceptions import ValidationError
 # Create your models here.
 
@@ -30,13 +28,29 @@ class User(AbstractUser):
         """Génère un PIN à 6 chiffres, définit une expiration et réinitialise les tentatives."""
         self.reset_pin = str(random.randint(100000, 999999))  # Génère un PIN aléatoire
         self.pin_attempts = 0  # Réinitialiser le compteur de tentatives
-        self.pin_expires_at = pow() + timedelta(minutes=10)  # Expiration dans 10 minutes
-        self.save()
+        self.pin_expires_at = timezone.now() + timedelta(minutes=10)  # Expiration dans 10 minutes
+        self.save(update_fields=['reset_pin', 'pin_attempts', 'pin_expires_at'])
     USERNAME_FIELD = 'email'
     REQUIRED_FIELDS = ['username']
     
     
 
+class LoadedValuesMixin:
+    """Conserve les valeurs lues en base pour connaître l'état précédent d'une ligne."""
+
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        instance = super().from_db(db, field_names, values)
+        instance._loaded_values = dict(zip(field_names, values))
+        return instance
+
+    def _snapshot(self):
+        self._loaded_values = {
+            field.attname: getattr(self, field.attname)
+            for field in self._meta.concrete_fields
+        }
+
+
 class Region(models.Model):
     nom = models.CharField(max_length=100)
 
@@ -56,10 +70,15 @@ class Commune(models.Model):
     )
 
     def __str__(self):
-        return f"{self.nom} ({self.region.nom})"
+        from .refcache import region_name
+        return f"{self.nom} ({region_name(self.region_id) or self.region.nom})"
+
+
+# Colonnes encodées dans le QR code signé du client
+QRCODE_FIELDS = {'cin', 'date_naissance', 'lieu_naissance_id'}
 
 
-class Client(models.Model):
+class Client(LoadedValuesMixin, models.Model):
     SEXE_CHOICES = [
         ('M', 'Masculin'),
         ('F', 'Féminin')
@@ -72,9 +91,16 @@ class Client(models.Model):
     lieu_naissance = models.ForeignKey(Commune, on_delete=models.SET_NULL, null=True, blank=True)
     adresse = models.CharField(max_length=255)
     cin = models.CharField(max_length=20, unique=True)
-    image = models.ImageField(upload_to='client_images/', null=True, blank=True)
+    image = models.ImageField(upload_to='client_images/', storage=photo_storage, null=True, blank=True)
     conjoint = models.CharField( max_length=233, null=True, blank=True)
     enfants = models.CharField( max_length=233, null=True, blank=True)
+    # "nom prenom" sans accents ni majuscules, pour la recherche (app/search.py)
+    search_name = models.CharField(max_length=201, blank=True, editable=False)
+    # Émission du QR code signé, renouvelée quand les données encodées changent
+    qrcode_emis_le = models.DateTimeField(null=True, blank=True, editable=False)
+    # Clé de partition : région de la commune de naissance (app/partitions.py)
+    region = models.ForeignKey(Region, on_delete=models.SET_NULL, null=True, blank=True,
+                               editable=False, db_index=False, related_name='+')
     
     # conjoint = models.OneToOneField(
     #     'self', 
@@ -89,79 +115,106 @@ class Client(models.Model):
     #     related_name='parents', 
     #     blank=True
     # )
-    qrcode = models.TextField(blank=True)
+    class Meta:
+        indexes = [
+            models.Index(fields=['search_name'], name='client_search_name_idx'),
+            models.Index(fields=['date_naissance'], name='client_naissance_idx'),
+            models.Index(fields=['lieu_naissance', 'date_naissance'], name='client_lieu_naissance_idx'),
+            models.Index(fields=['region', 'search_name'], name='client_region_idx'),
+        ]
 
     def __str__(self):
         return f"{self.nom} {self.prenom}"
 
-    def generate_qrcode(self):
-        data = {
-            "nom": self.nom,
-            "prenom": self.prenom,
-            "date_naissance": str(self.date_naissance),
-            "lieu_naissance": self.lieu_naissance.nom if self.lieu_naissance else None,
-            # "conjoint": f"{self.conjoint.nom} {self.conjoint.prenom}" if self.conjoint else None,
-            # "enfants": [f"{enfant.nom} {enfant.prenom}" for enfant in self.enfants.all()]
-        }
-        
-        qr = qrcode.QRCode(
-            version=1,
-            error_correction=qrcode.constants.ERROR_CORRECT_L,
-            box_size=10,
-            border=4,
-        )
-        qr.add_data(data)
-        qr.make(fit=True)
-        
-        img = qr.make_image(fill_color="black", back_color="white")
-        buffered = BytesIO()
-        img.save(buffered)
-        return base64.b64encode(buffered.getvalue()).decode()
+    def refresh_search_name(self):
+        self.search_name = normalize(f"{self.nom} {self.prenom}")[:201]
+
+    def qrcode_payload(self):
+        """Code signé encodé dans le QR code du client (voir app/qrverify.py)."""
+        from .qrcodes import sign_client
+        return sign_client(self)
+
+    def changed_fields(self):
+        """Colonnes (attnames) modifiées depuis le chargement de la ligne."""
+        loaded = getattr(self, '_loaded_values', None)
+        if loaded is None:
+            return {field.attname for field in self._meta.concrete_fields}
+        changed = set()
+        for field in self._meta.concrete_fields:
+            if field.attname in loaded:
+                if getattr(self, field.attname) != loaded[field.attname]:
+                    changed.add(field.attname)
+            elif field.attname in self.__dict__:
+                changed.add(field.attname)  # Colonne différée puis modifiée
+        return changed
 
     def save(self, *args, **kwargs):
-        self.full_clean()
-        
-        # Premier enregistrement pour obtenir l'ID
-        is_new = not self.pk
-        if is_new:
-            super().save(*args, **kwargs)
-
-        # Génération du QR code après avoir l'ID
-        if is_new or self.has_changed():
-            self.qrcode = self.generate_qrcode()
-            if is_new:
-                # Mise à jour directe pour éviter la récursion
-                Client.objects.filter(pk=self.pk).update(qrcode=self.qrcode)
-            else:
-                super().save(*args, **kwargs)
+        from .duplicates import update_block_keys
+        from .jobs import enqueue_many
+        from .refcache import commune_region_id
+
+        created = self._state.adding
+        self.refresh_search_name()
+        changed = self.changed_fields()
+        if created or 'lieu_naissance_id' in changed:
+            region_id = commune_region_id(self.lieu_naissance_id) if self.lieu_naissance_id else None
+            if created or region_id != self.region_id:
+                self.region_id = region_id
+                changed.add('region_id')
+        if created or changed & QRCODE_FIELDS:
+            # Nouveau QR code : les codes émis avant deviennent « remplacés »
+            self.qrcode_emis_le = timezone.now()
+            changed.add('qrcode_emis_le')
+        update_fields = kwargs.get('update_fields')
+        if not created and update_fields is None:
+            # Rien à écrire ; des update_fields explicites sont toujours écrits
+            if not changed:
+                return
+            kwargs['update_fields'] = [
+                field.name for field in self._meta.concrete_fields
+                if field.attname in changed and not field.primary_key
+            ]
+        elif update_fields is not None:
+            # Les colonnes calculées ci-dessus sont écrites avec les colonnes demandées
+            kwargs['update_fields'] = {*update_fields, *(
+                field.name for field in self._meta.concrete_fields
+                if field.attname in changed and not field.editable and not field.primary_key
+            )}
 
-        # Enregistrement final pour les instances existantes
-        if not is_new:
-            super().save(*args, **kwargs)
-
-        # Modification de la génération d'email pour inclure un identifiant unique
-        email = f'client_{self.cin}@digitaratasy.mg'  # Nouveau format d'email
-
-        # Création utilisateur avec vérification d'unicité
-        User.objects.update_or_create(
-            client_linked=self,
-            defaults={
-                'username': self.cin,
-                'email': email,  # Utilisation du nouvel email
-                'is_client': True,
-                'first_name': self.prenom,
-                'last_name': self.nom
-            }
+        # Validation des seules colonnes modifiées (les colonnes calculées,
+        # non éditables, ne le sont pas). L'unicité du CIN est laissée à la
+        # contrainte de la base plutôt qu'à une requête préalable.
+        self.full_clean(
+            exclude=[f.name for f in self._meta.concrete_fields
+                     if f.attname not in changed or not f.editable],
+            validate_unique=False,
         )
 
-    def has_changed(self):
-        if self.pk:
-            original = Client.objects.get(pk=self.pk)
-            return any(
-                getattr(self, field) != getattr(original, field)
-                for field in ['nom', 'prenom', 'date_naissance', 'lieu_naissance']
-            ) or self.enfants.exclude(pk__in=original.enfants.all()).exists()
-        return True
+        # Seules les tâches concernées par les colonnes modifiées sont enfilées
+        jobs = []
+        if created or changed & {'cin', 'nom', 'prenom'}:
+            jobs.append('client.provision_account')
+        if created or changed & QRCODE_FIELDS:
+            jobs.append('client.render_qrcode')
+        if 'image' in changed and self.image and not is_processed(self.image.name):
+            jobs.append('client.process_photo')
+
+        # Le QR code n'est plus rendu ici : il est généré à la demande
+        # (voir app/qrcodes.py et la route clients/{id}/qrcode.png/)
+        try:
+            with transaction.atomic():
+                super().save(*args, **kwargs)
+                update_block_keys(self, created)
+                # Compte utilisateur et QR code sont traités par le worker de tâches
+                if jobs:
+                    enqueue_many([(kind, {'client_id': self.pk}) for kind in jobs])
+        except IntegrityError:
+            if created:
+                self.pk = None
+            if Client.objects.filter(cin=self.cin).exclude(pk=self.pk).exists():
+                raise ValidationError({'cin': ["Un client avec ce CIN existe déjà."]})
+            raise
+        self._snapshot()
 
     # def clean(self):
     #     super().clean()
@@ -169,6 +222,20 @@ class Client(models.Model):
     #         raise ValidationError("Les conjoints doivent être de sexe différent")
 
 
+class ClientBlockKey(models.Model):
+    """Clé de blocage pour la détection des doublons (voir app/duplicates.py)."""
+    client = models.ForeignKey(Client, on_delete=models.CASCADE, related_name='block_keys')
+    key = models.CharField(max_length=120)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['key', 'client'], name='client_block_key_idx'),
+        ]
+
+    def __str__(self):
+        return self.key
+
+
 class TypeActe(models.TextChoices):
     ACTE_NAISSANCE = 'naissance', "Acte de naissance"
     COPIE_ACTE = 'copie', "Copie d'acte"
@@ -179,31 +246,145 @@ class TypeActe(models.TextChoices):
     ACTE_DE_DECES = 'decès', "Acte de decès"
 
 
-class DemandeActe(models.Model):
+class DemandeActe(LoadedValuesMixin, models.Model):
+    """Demande d'acte ; le statut suit la machine à états de app/workflow.py."""
+
+    class Statut(models.TextChoices):
+        EN_ATTENTE = 'en attente', "En attente"
+        EN_COURS = 'en cours', "En cours de traitement"
+        TRAITEE = 'traitee', "Traitée"
+        DELIVREE = 'delivree', "Délivrée"
+        REJETEE = 'rejetee', "Rejetée"
+
     client = models.ForeignKey(Client, on_delete=models.CASCADE, related_name='demandes')
     type_acte = models.CharField(max_length=20, choices=TypeActe.choices)
     date_demande = models.DateTimeField(auto_now_add=True)
-    statut = models.CharField(max_length=50, default='en attente')
+    statut = models.CharField(max_length=50, choices=Statut.choices, default=Statut.EN_ATTENTE)
+    # File de travail : commune qui traite la demande (par défaut, celle de
+    # naissance du client) et agent qui l'a prise en charge
+    commune = models.ForeignKey(
+        Commune, on_delete=models.SET_NULL, null=True, blank=True, related_name='demandes'
+    )
+    agent = models.ForeignKey(
+        User, on_delete=models.SET_NULL, null=True, blank=True, related_name='demandes_traitees'
+    )
+    date_prise_en_charge = models.DateTimeField(null=True, blank=True)
+    # Clé de partition : région de la commune de traitement (app/partitions.py)
+    region = models.ForeignKey(Region, on_delete=models.SET_NULL, null=True, blank=True,
+                               editable=False, db_index=False, related_name='+')
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['statut', 'type_acte', 'date_demande'],
+                         name='demande_statut_type_idx'),
+            models.Index(fields=['commune', 'statut', 'date_demande'],
+                         name='demande_commune_queue_idx'),
+            models.Index(fields=['region', 'statut', 'date_demande'],
+                         name='demande_region_idx'),
+        ]
 
     def __str__(self):
         return f"{self.client.nom} - {self.get_type_acte_display()}"
 
+    def save(self, *args, **kwargs):
+        if self._state.adding and self.commune_id is None and self.client_id:
+            if DemandeActe.client.is_cached(self):
+                self.commune_id = self.client.lieu_naissance_id
+            else:
+                self.commune_id = Client.objects.filter(pk=self.client_id).values_list(
+                    'lieu_naissance_id', flat=True
+                ).first()
+        if self.commune_id:
+            from .refcache import commune_region_id
+            self.region_id = commune_region_id(self.commune_id)
+        else:
+            self.region_id = None
+        update_fields = kwargs.get('update_fields')
+        if update_fields is not None and 'commune' in update_fields:
+            kwargs['update_fields'] = {*update_fields, 'region'}
+        super().save(*args, **kwargs)
+        self._snapshot()
+
+
+class StatisticCounter(models.Model):
+    """Compteur matérialisé des statistiques (voir app/stats.py)."""
+    key = models.CharField(max_length=100, unique=True)
+    value = models.BigIntegerField(default=0)
+
+    def __str__(self):
+        return f"{self.key} = {self.value}"
+
+
+class Job(models.Model):
+    """Tâche de fond persistée en base, exécutée par ``manage.py run_jobs``."""
+
+    class Statut(models.TextChoices):
+        EN_ATTENTE = 'pending', "En attente"
+        EN_COURS = 'running', "En cours"
+        TERMINE = 'done', "Terminée"
+        ECHEC = 'failed', "Échec"
+
+    kind = models.CharField(max_length=100)
+    payload = models.JSONField(default=dict)
+    idempotency_key = models.CharField(max_length=200, unique=True)
+    status = models.CharField(max_length=20, choices=Statut.choices, default=Statut.EN_ATTENTE)
+    attempts = models.PositiveIntegerField(default=0)
+    max_attempts = models.PositiveIntegerField(default=5)
+    run_after = models.DateTimeField(default=timezone.now)
+    last_error = models.TextField(blank=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['status', 'run_after'], name='job_status_run_after_idx'),
+        ]
+
+    def __str__(self):
+        return f"{self.kind} [{self.status}]"
+
+
+class ImportCheckpoint(models.Model):
+    """Point de contrôle d'un import de registre, écrit avec chaque lot (app/imports.py)."""
+    key = models.CharField(max_length=255, unique=True)
+    state = models.JSONField(default=dict)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    def __str__(self):
+        return self.key
+
+
+class OutboundMail(models.Model):
+    """E-mail en file d'envoi, remis par ``manage.py send_mail_spool`` (app/mailspool.py)."""
+
+    class Statut(models.TextChoices):
+        EN_ATTENTE = 'pending', "En attente"
+        EN_COURS = 'sending', "En cours d'envoi"
+        ENVOYE = 'sent', "Envoyé"
+        ECHEC = 'failed', "Échec"
+
+    to = models.EmailField()
+    subject = models.CharField(max_length=200)
+    body = models.TextField()
+    status = models.CharField(max_length=20, choices=Statut.choices, default=Statut.EN_ATTENTE)
+    attempts = models.PositiveIntegerField(default=0)
+    max_attempts = models.PositiveIntegerField(default=8)
+    # Prochaine tentative ; pendant un envoi, fin de la réservation du worker
+    send_after = models.DateTimeField(default=timezone.now)
+    last_error = models.TextField(blank=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+    sent_at = models.DateTimeField(null=True, blank=True)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['status', 'send_after'], name='mail_status_send_after_idx'),
+        ]
+
+    def __str__(self):
+        return f"{self.to} : {self.subject} [{self.status}]"
+
 
 # @receiver(m2m_changed, sender=Client.enfants.through)
 # def update_qrcode_on_enfant_change(sender, instance, action, **kwargs):
 #     if action in ['post_add', 'post_remove', 'post_clear']:
 #         instance.save()  # regenration du QR code
-
-
-@receiver(post_save, sender=Client)
-def create_client_user(sender, instance, created, **kwargs):
-    if created:
-        User.objects.create_user(
-            username=instance.cin,
-            email=f'{instance.cin}@client.digitaratasy',
-            password=instance.cin,  # Mot de passe par défaut = CIN
-            is_client=True,
-            first_name=instance.prenom,
-            last_name=instance.nom
-        )
-
@@ -0,0 +1,24 @@
+from rest_framework.pagination import CursorPagination, PageNumberPagination
+
+
+class IdCursorPagination(CursorPagination):
+    """Pagination par curseur sur la clé primaire (index), en O(page).
+
+    Une vue peut choisir son ordre avec l'attribut ``cursor_ordering``
+    (par exemple ``'-id'`` pour les plus récents d'abord).
+    """
+    ordering = 'id'
+    page_size = 50
+    page_size_query_param = 'page_size'
+    max_page_size = 500
+
+    def get_ordering(self, request, queryset, view):
+        ordering = getattr(view, 'cursor_ordering', self.ordering)
+        return (ordering,) if isinstance(ordering, str) else tuple(ordering)
+
+
+class SearchPagination(PageNumberPagination):
+    """Pages numérotées pour les résultats classés par pertinence."""
+    page_size = 20
+    page_size_query_param = 'page_size'
+    max_page_size = 100
@@ -0,0 +1,157 @@
+"""Partitionnement par région des clients et des demandes d'acte.
+
+La clé de partition est la colonne ``region`` de ``Client`` (région de la
+commune de naissance) et de ``DemandeActe`` (région de la commune de
+traitement), renseignée par leur ``save``. Les index ``client_region_idx`` et
+``demande_region_idx`` commencent par cette colonne : une requête limitée à
+une commune ou à une région ne parcourt que la tranche d'index de sa
+région, sans jointure vers ``Commune``.
+
+- ``scope`` ajoute la clé de partition aux filtres par commune ou par région
+  (vues : ``PartitionScopeMixin``) ;
+- ``partition_totals`` agrège partition par partition, pour les statistiques
+  nationales ;
+- ``rebalance`` réaffecte par tranches d'identifiants les lignes dont la
+  région ne correspond plus à leur commune (commune rattachée à une autre
+  région, lignes insérées sans passer par ``save``).
+
+Quand une commune change de région, ses lignes restent dans l'ancienne
+partition jusqu'au passage de la tâche ``partitions.rebalance_commune`` :
+pendant ce temps, ``scope`` filtre cette commune sans la clé de partition.
+L'ensemble des communes en cours de réaffectation est gardé dans le cache
+de référence : ``scope`` ne fait aucune requête supplémentaire. Les lignes
+sans clé de partition restent visibles dans la région de leur commune.
+"""
+from django.db.models import Count, F, Max, OuterRef, Q, Subquery
+from django.db.models.signals import post_save, pre_save
+from django.dispatch import receiver
+
+from .models import Client, Commune, DemandeActe, Job
+from .refcache import commune_region_id, per_generation
+
+# Colonne de la commune qui détermine la partition de chaque modèle
+COMMUNE_FIELDS = {
+    Client: 'lieu_naissance',
+    DemandeActe: 'commune',
+}
+REBALANCE_CHUNK_SIZE = 10000
+REBALANCE_KIND = 'partitions.rebalance_commune'
+
+
+def rebalance_key(commune_id):
+    return f'{REBALANCE_KIND}:{commune_id}'
+
+
+def rebalancing_communes():
+    """Communes dont la tâche de réaffectation n'est pas terminée.
+
+    Relu une fois par génération du cache de référence : le changement de
+    région d'une commune et la fin de sa réaffectation font changer la
+    génération, ce qui recharge cet ensemble avec la table des communes. Un
+    processus qui le relit juste avant que la tâche soit marquée terminée
+    garde la commune jusqu'à ``REFDATA_MAX_AGE`` : ses requêtes restent
+    justes, simplement sans la clé de partition.
+    """
+    return per_generation('partitions.rebalancing', lambda: {
+        payload['commune_id']
+        for payload in Job.objects.filter(kind=REBALANCE_KIND)
+        .exclude(status=Job.Statut.TERMINE).values_list('payload', flat=True)
+    })
+
+
+def rebalancing(commune_id):
+    """Vrai si les lignes de la commune peuvent être hors de la partition de sa région."""
+    return int(commune_id) in rebalancing_communes()
+
+
+def scope(queryset, commune=None, region=None):
+    """Limite ``queryset`` à une commune ou à une région, clé de partition comprise."""
+    commune_field = COMMUNE_FIELDS[queryset.model]
+    if commune is not None:
+        commune_id = int(getattr(commune, 'pk', commune))
+        region_id = commune_region_id(commune_id)
+        queryset = queryset.filter(**{commune_field: commune_id})
+        if region_id is not None and not rebalancing(commune_id):
+            queryset = queryset.filter(Q(region=region_id) | Q(region__isnull=True))
+    if region is not None:
+        # Les lignes sans clé de partition (pas encore réaffectées) restent
+        # visibles dans la région de leur commune
+        region_id = getattr(region, 'pk', region)
+        queryset = queryset.filter(
+            Q(region=region_id)
+            | Q(region__isnull=True, **{f'{commune_field}__region': region_id})
+        )
+    return queryset
+
+
+def partition_totals(queryset):
+    """Nombre de lignes de ``queryset`` par partition ``{region_id: n}``.
+
+    Un seul GROUP BY sur la clé de partition : chaque groupe est compté dans
+    sa tranche de l'index, puis les totaux sont assemblés ici.
+    """
+    return dict(
+        queryset.order_by().filter(region__isnull=False)
+        .values_list('region').annotate(n=Count('id'))
+    )
+
+
+def misplaced(model):
+    """Lignes dont la clé de partition ne correspond pas à leur commune."""
+    commune_field = COMMUNE_FIELDS[model]
+    expected = Subquery(Commune.objects.filter(pk=OuterRef(commune_field)).values('region')[:1])
+    return model.objects.annotate(expected_region=expected).filter(
+        Q(region__isnull=True, expected_region__isnull=False)
+        | Q(region__isnull=False, expected_region__isnull=True)
+        | (Q(region__isnull=False, expected_region__isnull=False) & ~Q(region=F('expected_region')))
+    )
+
+
+def rebalance(model, commune=None, chunk_size=REBALANCE_CHUNK_SIZE):
+    """Réaffecte les lignes mal placées de ``model`` par tranches d'identifiants.
+
+    Chaque tranche est un UPDATE indépendant (transaction courte) ; génère
+    ``(dernier id traité, lignes déplacées dans la tranche)``.
+    """
+    commune_field = COMMUNE_FIELDS[model]
+    rows = model.objects.all()
+    if commune is not None:
+        rows = rows.filter(**{commune_field: commune})
+    last = rows.aggregate(last=Max('pk'))['last'] or 0
+    expected = Subquery(Commune.objects.filter(pk=OuterRef(commune_field)).values('region')[:1])
+    for start in range(0, last + 1, chunk_size):
+        chunk = misplaced(model).filter(pk__gte=start, pk__lt=start + chunk_size)
+        if commune is not None:
+            chunk = chunk.filter(**{commune_field: commune})
+        moved = model.objects.filter(pk__in=chunk.values('pk')).update(region=expected)
+        yield min(start + chunk_size - 1, last), moved
+
+
+class PartitionScopeMixin:
+    """Vue dont ``?commune=`` et ``?region=`` passent par ``scope``."""
+
+    def get_queryset(self):
+        commune, region = (self.request.query_params.get(name) for name in ('commune', 'region'))
+        return scope(
+            super().get_queryset(),
+            commune=int(commune) if commune and commune.isdigit() else None,
+            region=int(region) if region and region.isdigit() else None,
+        )
+
+
+@receiver(pre_save, sender=Commune)
+def remember_region(sender, instance, raw=False, **kwargs):
+    if instance.pk is not None and not raw:
+        instance._previous_region_id = (
+            Commune.objects.filter(pk=instance.pk).values_list('region_id', flat=True).first()
+        )
+
+
+@receiver(post_save, sender=Commune)
+def rebalance_commune(sender, instance, created, raw=False, **kwargs):
+    """Une commune rattachée à une autre région : ses lignes changent de partition."""
+    if created or raw or getattr(instance, '_previous_region_id', None) == instance.region_id:
+        return
+    from .jobs import enqueue
+    enqueue(REBALANCE_KIND, {'commune_id': instance.pk},
+            key=rebalance_key(instance.pk))
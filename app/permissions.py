@@ -0,0 +1,11 @@
+"""Permissions de l'API."""
+from rest_framework.permissions import BasePermission
+
+
+class IsAgent(BasePermission):
+    """Utilisateur authentifié qui n'est pas un client (agent, administrateur)."""
+    message = "Action réservée aux agents."
+
+    def has_permission(self, request, view):
+        user = request.user
+        return bool(user and user.is_authenticated and not user.is_client)
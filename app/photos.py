@@ -0,0 +1,125 @@
+"""Photos des clients : stockage adressé par contenu et traitement différé.
+
+Un envoi est enregistré tel quel sous ``client_images/o/`` avec le SHA-256 de
+son contenu pour nom : la même photo envoyée plusieurs fois n'est stockée
+qu'une fois. Le traitement lourd (Pillow) n'a pas lieu pendant la requête :
+``Client.save`` enfile la tâche ``client.process_photo``, qui
+
+- redresse l'image selon son orientation EXIF et la réduit à
+  ``PHOTO_MAX_SIZE`` pixels au plus ;
+- l'enregistre en JPEG sous ``client_images/p/<hash>.jpg`` (hash du résultat) ;
+- produit les vignettes ``client_images/p/<hash>-<variante>.jpg``.
+
+Le nom des vignettes se déduit de celui de la photo traitée : les sérialiseurs
+donnent leurs URL sans accès au disque.
+"""
+import hashlib
+import os
+import uuid
+from io import BytesIO
+
+from django.conf import settings
+from django.core.files.base import ContentFile
+from django.core.files.storage import FileSystemStorage
+from PIL import Image, ImageOps
+
+ORIGINALS = 'client_images/o/'
+PROCESSED = 'client_images/p/'
+JPEG_QUALITY = 85
+
+
+def max_size():
+    return getattr(settings, 'PHOTO_MAX_SIZE', 1600)
+
+
+def thumbnail_sizes():
+    return getattr(settings, 'PHOTO_THUMBNAILS', {'petite': 96, 'moyenne': 320})
+
+
+def content_name(directory, content, extension):
+    digest = hashlib.sha256()
+    for chunk in content.chunks():
+        digest.update(chunk)
+    key = digest.hexdigest()
+    return f'{directory}{key[:2]}/{key}{extension}'
+
+
+class ContentAddressedStorage(FileSystemStorage):
+    """Stockage dont les noms de fichier sont le hash de leur contenu.
+
+    Un fichier déjà présent n'est pas réécrit : les doublons partagent un blob.
+    """
+
+    def save(self, name, content, max_length=None):
+        if not name.startswith((ORIGINALS, PROCESSED)):
+            # Envoi : renommé d'après son contenu
+            content.seek(0)
+            name = content_name(ORIGINALS, content, os.path.splitext(name)[1].lower())
+        if self.exists(name):
+            return name
+        content.seek(0)
+        return super().save(name, content, max_length)
+
+    def get_available_name(self, name, max_length=None):
+        return name
+
+    def _save(self, name, content):
+        # Écrit sous un nom temporaire puis publie par lien : si un envoi
+        # concurrent a publié le même hash entre-temps, son fichier (même
+        # contenu) est gardé au lieu de chercher un autre nom.
+        staging = super()._save(f'{name}.{uuid.uuid4().hex}.tmp', content)
+        try:
+            os.link(self.path(staging), self.path(name))
+        except FileExistsError:
+            pass
+        finally:
+            os.remove(self.path(staging))
+        return name
+
+
+def photo_storage():
+    return ContentAddressedStorage()
+
+
+def is_processed(name):
+    return bool(name) and name.startswith(PROCESSED)
+
+
+def thumbnail_name(name, variant):
+    return f'{os.path.splitext(name)[0]}-{variant}.jpg'
+
+
+def thumbnail_urls(image):
+    """URL des vignettes d'une photo traitée, None si elle ne l'est pas encore."""
+    if not is_processed(image.name):
+        return None
+    return {variant: image.storage.url(thumbnail_name(image.name, variant))
+            for variant in thumbnail_sizes()}
+
+
+def _jpeg(image):
+    buffered = BytesIO()
+    image.save(buffered, format='JPEG', quality=JPEG_QUALITY, optimize=True)
+    return ContentFile(buffered.getvalue())
+
+
+def process_photo(storage, name):
+    """Normalise la photo ``name`` et crée ses vignettes ; retourne le nom traité."""
+    if is_processed(name):
+        return name
+    with storage.open(name, 'rb') as f:
+        image = Image.open(f)
+        image = ImageOps.exif_transpose(image).convert('RGB')
+    image.thumbnail((max_size(), max_size()))
+
+    content = _jpeg(image)
+    processed = content_name(PROCESSED, content, '.jpg')
+    if not storage.exists(processed):
+        storage.save(processed, content)
+    for variant, size in thumbnail_sizes().items():
+        thumb_name = thumbnail_name(processed, variant)
+        if not storage.exists(thumb_name):
+            thumb = image.copy()
+            thumb.thumbnail((size, size))
+            storage.save(thumb_name, _jpeg(thumb))
+    return processed
@@ -0,0 +1,257 @@
+"""Stockage des QR codes des clients.
+
+Les PNG ne sont plus rendus dans ``Client.save`` : ils sont générés à la
+première demande puis conservés dans un magasin adressé par contenu. La clé
+d'un QR code est le SHA-256 des données encodées, donc deux clients qui
+encodent la même chose partagent le même fichier et un client modifié obtient
+automatiquement une nouvelle clé.
+
+Deux niveaux de cache :
+- un LRU en mémoire (par processus) pour les QR codes les plus demandés ;
+- un répertoire sur disque (``QRCODE_CACHE['DIR']``) borné en nombre de
+  fichiers, les plus anciens étant supprimés en premier.
+
+``ContentStore`` porte ces deux niveaux et sert aussi aux actes PDF.
+"""
+import hashlib
+import hmac
+import os
+import threading
+import time
+from collections import OrderedDict
+from io import BytesIO
+
+import qrcode
+from django.conf import settings
+
+from . import qrverify
+
+
+def signing_keys():
+    """Clés de signature des QR codes ``{identifiant: clé}`` et identifiant courant.
+
+    Par défaut, une clé unique dérivée de ``SECRET_KEY``. ``QRCODE_SIGNING``
+    permet d'en déclarer plusieurs (rotation) : les codes signés par une
+    ancienne clé restent vérifiables tant qu'elle est listée.
+    """
+    config = getattr(settings, 'QRCODE_SIGNING', None)
+    if not config:
+        key = hmac.new(settings.SECRET_KEY.encode(), b'app.qrcodes.signing', hashlib.sha256).digest()
+        return {0: key}, 0
+    keys = {int(key_id): secret.encode() for key_id, secret in config['KEYS'].items()}
+    return keys, int(config.get('CURRENT', max(keys)))
+
+
+def sign_client(client):
+    keys, current = signing_keys()
+    issued_at = int(client.qrcode_emis_le.timestamp()) if client.qrcode_emis_le else 0
+    data = qrverify.QRCodeData(
+        client_id=client.pk,
+        cin=client.cin,
+        date_naissance=client.date_naissance,
+        commune_id=client.lieu_naissance_id or 0,
+        issued_at=issued_at,
+    )
+    return qrverify.encode(data, keys[current], current)
+
+
+def verify_codes(codes, max_age=None):
+    """Vérifie des codes scannés ; retourne un résultat par code, dans l'ordre.
+
+    La signature se vérifie sans la base. Une seule requête signale ensuite
+    les codes remplacés par une émission plus récente (CIN, date ou lieu de
+    naissance corrigés) ou dont le client n'existe plus.
+    """
+    from .models import Client
+    keys, _ = signing_keys()
+    now = int(time.time())
+    checked = qrverify.verify_many(codes, keys, now=now, max_age=max_age)
+    ids = {data.client_id for data, error in checked if data}
+    issued = dict(
+        Client.objects.filter(pk__in=ids).values_list('pk', 'qrcode_emis_le')
+    ) if ids else {}
+
+    results = []
+    for code, (data, error) in zip(codes, checked):
+        if data is None:
+            results.append({'code': code, 'valide': False, 'erreur': error})
+            continue
+        result = {
+            'code': code,
+            'valide': True,
+            'client': data.client_id,
+            'cin': data.cin,
+            'date_naissance': data.date_naissance,
+            'commune': data.commune_id or None,
+            'emis_le': data.issued_at,
+        }
+        if data.client_id not in issued:
+            result.update(valide=False, erreur='Client inconnu')
+        elif issued[data.client_id] and int(issued[data.client_id].timestamp()) != data.issued_at:
+            result.update(valide=False, erreur='Code remplacé')
+        results.append(result)
+    return results
+
+
+def render_qrcode(payload):
+    """Rend ``payload`` en PNG et retourne les octets de l'image.
+
+    La version (taille) du QR code est la plus petite qui contient ``payload`` ;
+    un code signé (majuscules et chiffres) est encodé en mode alphanumérique.
+    """
+    qr = qrcode.QRCode(
+        version=None,
+        error_correction=qrcode.constants.ERROR_CORRECT_M,
+        box_size=10,
+        border=4,
+    )
+    qr.add_data(payload)
+    qr.make(fit=True)
+
+    img = qr.make_image(fill_color="black", back_color="white")
+    buffered = BytesIO()
+    img.save(buffered)
+    return buffered.getvalue()
+
+
+class ContentStore:
+    """Magasin de fichiers adressé par clé (hash du contenu source).
+
+    Sert aux QR codes (``QRCodeStore``) et aux actes PDF (app/actes.py).
+    """
+
+    def __init__(self, directory, memory_entries=256, disk_entries=10000, extension='png'):
+        self.directory = str(directory)
+        self.memory_entries = memory_entries
+        self.disk_entries = disk_entries
+        self.extension = extension
+        self._memory = OrderedDict()
+        self._lock = threading.Lock()
+        self._disk_count = None
+
+    def path_for(self, key):
+        return os.path.join(self.directory, key[:2], f"{key}.{self.extension}")
+
+    def load(self, key):
+        """Contenu associé à ``key`` (mémoire puis disque), ou None."""
+        content = self._memory_get(key)
+        if content is None:
+            content = self._disk_get(key)
+            if content is not None:
+                self._memory_put(key, content)
+        return content
+
+    def contains(self, key):
+        return self._memory_get(key) is not None or os.path.exists(self.path_for(key))
+
+    def store(self, key, content):
+        self._disk_put(key, content)
+        self._memory_put(key, content)
+
+    def clear(self):
+        with self._lock:
+            self._memory.clear()
+
+    # Cache mémoire
+
+    def _memory_get(self, key):
+        with self._lock:
+            png = self._memory.get(key)
+            if png is not None:
+                self._memory.move_to_end(key)
+            return png
+
+    def _memory_put(self, key, png):
+        with self._lock:
+            self._memory[key] = png
+            self._memory.move_to_end(key)
+            while len(self._memory) > self.memory_entries:
+                self._memory.popitem(last=False)
+
+    # Cache disque
+
+    def _disk_get(self, key):
+        path = self.path_for(key)
+        try:
+            with open(path, 'rb') as f:
+                content = f.read()
+            # Date de dernier usage, pour l'éviction LRU
+            os.utime(path)
+        except FileNotFoundError:
+            return None
+        return content
+
+    def _disk_put(self, key, png):
+        path = self.path_for(key)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+
+        # Écriture atomique : un lecteur concurrent ne voit jamais un PNG tronqué
+        tmp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+        with open(tmp_path, 'wb') as f:
+            f.write(png)
+        existed = os.path.exists(path)
+        os.replace(tmp_path, path)
+
+        with self._lock:
+            if self._disk_count is None:
+                self._disk_count = len(self._disk_files())
+            elif not existed:
+                self._disk_count += 1
+            over_limit = self._disk_count > self.disk_entries
+
+        if over_limit:
+            self._evict_disk()
+
+    def _disk_files(self):
+        files = []
+        if not os.path.isdir(self.directory):
+            return files
+        for entry in os.scandir(self.directory):
+            if entry.is_dir():
+                files.extend(
+                    f for f in os.scandir(entry.path)
+                    if f.is_file() and f.name.endswith(f'.{self.extension}')
+                )
+        return files
+
+    def _evict_disk(self):
+        """Supprime les fichiers les moins récemment utilisés pour revenir à 90 % de la limite."""
+        files = sorted(self._disk_files(), key=lambda f: f.stat().st_mtime)
+        target = int(self.disk_entries * 0.9)
+        excess = max(len(files) - target, 0)
+        for entry in files[:excess]:
+            try:
+                os.remove(entry.path)
+            except FileNotFoundError:
+                pass
+        with self._lock:
+            self._disk_count = len(files) - excess
+
+
+class QRCodeStore(ContentStore):
+    """Magasin de PNG adressé par le hash des données encodées."""
+
+    @staticmethod
+    def key_for(payload):
+        return hashlib.sha256(payload.encode()).hexdigest()
+
+    def get(self, payload):
+        """Retourne ``(clé, png)`` en générant le QR code si nécessaire."""
+        key = self.key_for(payload)
+        png = self.load(key)
+        if png is None:
+            png = render_qrcode(payload)
+            self.store(key, png)
+        return key, png
+
+
+def _build_store():
+    config = getattr(settings, 'QRCODE_CACHE', {})
+    return QRCodeStore(
+        directory=config.get('DIR', os.path.join(settings.MEDIA_ROOT, 'qrcodes')),
+        memory_entries=config.get('MEMORY_ENTRIES', 256),
+        disk_entries=config.get('DISK_ENTRIES', 10000),
+    )
+
+
+qrcode_store = _build_store()
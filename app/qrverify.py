@@ -0,0 +1,150 @@
+"""Codes QR signés des clients : format compact et vérification hors ligne.
+
+Ce module n'utilise que la bibliothèque standard : il peut être copié tel
+quel sur un poste de contrôle, avec les clés de signature, pour vérifier les
+codes sans appeler l'API.
+
+Contenu binaire (big-endian), avant signature :
+
+    octet 0       version (4 bits hauts) et identifiant de clé (4 bits bas)
+    4 octets      identifiant du client
+    1 octet       CIN : longueur, bit 0x80 levé si le CIN n'est pas numérique
+    6 ou n octets CIN : entier sur 6 octets, sinon texte UTF-8
+    2 octets      date de naissance, en jours depuis le 1er janvier 1900
+                  (version 2 : entier signé sur 4 octets, pour les dates hors
+                  de 1900-2079)
+    4 octets      commune de naissance (0 si inconnue)
+    4 octets      émission, en secondes depuis l'epoch
+    16 octets     HMAC-SHA256 tronqué de tout ce qui précède
+
+Le tout est encodé en base32 sans remplissage, préfixé par ``DR:`` : ces
+caractères relèvent du mode alphanumérique des QR codes, et un CIN de
+12 chiffres (64 caractères) tient dans un QR code de version 4
+(correction M).
+"""
+import base64
+import hmac
+import struct
+from dataclasses import dataclass
+from datetime import date, timedelta
+from hashlib import sha256
+
+PREFIX = 'DR:'
+VERSION = 1
+# Date de naissance hors de la plage d'un entier sur 2 octets
+WIDE_DATE_VERSION = 2
+DATE_FORMATS = {VERSION: '>H', WIDE_DATE_VERSION: '>i'}
+SIGNATURE_SIZE = 16
+EPOCH = date(1900, 1, 1)
+NUMERIC_CIN_SIZE = 6
+MAX_NUMERIC_CIN_LENGTH = 14
+
+
+class InvalidCode(ValueError):
+    """Code illisible, signé par une clé inconnue ou falsifié."""
+
+
+@dataclass(frozen=True)
+class QRCodeData:
+    client_id: int
+    cin: str
+    date_naissance: date
+    commune_id: int
+    issued_at: int
+
+
+def _pack_cin(cin):
+    if cin.isascii() and cin.isdigit() and len(cin) <= MAX_NUMERIC_CIN_LENGTH:
+        return bytes([len(cin)]) + int(cin).to_bytes(NUMERIC_CIN_SIZE, 'big')
+    raw = cin.encode()
+    if len(raw) > 0x7F:
+        raise ValueError('CIN trop long')
+    return bytes([0x80 | len(raw)]) + raw
+
+
+def encode(data, key, key_id=0):
+    """Code signé (texte) pour ``data`` (un ``QRCodeData``)."""
+    if not 0 <= key_id <= 0x0F:
+        raise ValueError('Identifiant de clé hors de [0, 15]')
+    days = (data.date_naissance - EPOCH).days
+    version = VERSION if 0 <= days <= 0xFFFF else WIDE_DATE_VERSION
+    try:
+        body = (
+            bytes([version << 4 | key_id])
+            + struct.pack('>I', data.client_id)
+            + _pack_cin(data.cin)
+            + struct.pack(DATE_FORMATS[version], days)
+            + struct.pack('>II', data.commune_id or 0, data.issued_at)
+        )
+    except struct.error as exc:
+        raise ValueError(f'Valeur hors limites : {exc}') from exc
+    signature = hmac.new(key, body, sha256).digest()[:SIGNATURE_SIZE]
+    return PREFIX + base64.b32encode(body + signature).decode().rstrip('=')
+
+
+def decode(code):
+    """Sépare ``(clé, contenu, signature, données)`` sans vérifier la signature."""
+    if not code.startswith(PREFIX):
+        raise InvalidCode('Préfixe inconnu')
+    text = code[len(PREFIX):].strip().upper()
+    try:
+        raw = base64.b32decode(text + '=' * (-len(text) % 8))
+    except ValueError:
+        raise InvalidCode('Encodage invalide')
+    if len(raw) < 1 + 4 + 1 + 10 + SIGNATURE_SIZE:
+        raise InvalidCode('Code tronqué')
+    body, signature = raw[:-SIGNATURE_SIZE], raw[-SIGNATURE_SIZE:]
+    date_format = DATE_FORMATS.get(body[0] >> 4)
+    if date_format is None:
+        raise InvalidCode('Version inconnue')
+
+    client_id, = struct.unpack_from('>I', body, 1)
+    cin_header = body[5]
+    offset = 6
+    if cin_header & 0x80:
+        length = cin_header & 0x7F
+        cin = body[offset:offset + length].decode(errors='replace')
+    else:
+        length = NUMERIC_CIN_SIZE
+        cin = str(int.from_bytes(body[offset:offset + length], 'big')).zfill(cin_header)
+    offset += length
+    date_size = struct.calcsize(date_format)
+    if len(body) != offset + date_size + 8:
+        raise InvalidCode('Longueur incohérente')
+    days, = struct.unpack_from(date_format, body, offset)
+    commune_id, issued_at = struct.unpack_from('>II', body, offset + date_size)
+    try:
+        born = EPOCH + timedelta(days=days)
+    except OverflowError:
+        # Contenu non encore authentifié : date hors de la plage de ``date``
+        raise InvalidCode('Code invalide')
+    data = QRCodeData(client_id, cin, born, commune_id, issued_at)
+    return body[0] & 0x0F, body, signature, data
+
+
+def verify(code, keys, now=None, max_age=None):
+    """Vérifie ``code`` avec ``keys`` ({identifiant: clé}) ; retourne ses données.
+
+    Lève ``InvalidCode`` si la signature ne correspond pas ou si le code a
+    plus de ``max_age`` secondes.
+    """
+    key_id, body, signature, data = decode(code)
+    key = keys.get(key_id)
+    if key is None:
+        raise InvalidCode('Clé de signature inconnue')
+    if not hmac.compare_digest(hmac.new(key, body, sha256).digest()[:SIGNATURE_SIZE], signature):
+        raise InvalidCode('Signature invalide')
+    if max_age is not None and now is not None and now - data.issued_at > max_age:
+        raise InvalidCode('Code expiré')
+    return data
+
+
+def verify_many(codes, keys, now=None, max_age=None):
+    """Vérifie une liste de codes ; retourne ``[(données ou None, erreur ou None)]``."""
+    results = []
+    for code in codes:
+        try:
+            results.append((verify(code, keys, now=now, max_age=max_age), None))
+        except InvalidCode as e:
+            results.append((None, str(e)))
+    return results
@@ -0,0 +1,213 @@
+"""Cache des données de référence (régions et communes).
+
+Ces tables changent rarement mais sont lues partout. Un numéro de génération,
+stocké dans le cache Django pour être partagé entre processus quand le cache
+l'est, est incrémenté à chaque écriture sur Region ou Commune (signaux). Tout
+ce qui est mis en cache dans un processus est associé à une génération et
+abandonné dès qu'elle change :
+
+- les réponses sérialisées de RegionViewSet et CommuneViewSet, servies avec
+  un ETag fort et ``304 Not Modified`` (voir ``ReferenceDataCacheMixin``) ;
+- les tables ``id -> nom`` utilisées par ``commune_name``/``region_name`` ;
+- les valeurs dérivées enregistrées par ``per_generation`` (communes en cours
+  de réaffectation, app/partitions.py).
+
+La génération est relue au plus toutes les ``REFDATA_CHECK_INTERVAL``
+secondes : une modification faite dans un autre processus y est vue après
+ce délai, si le cache Django est partagé (``CACHES``, voir settings). Quel
+que soit le cache, l'état local est reconstruit au bout de
+``REFDATA_MAX_AGE`` secondes.
+"""
+import hashlib
+import json
+import threading
+import time
+
+from django.conf import settings
+from django.core.cache import cache
+from django.core.serializers.json import DjangoJSONEncoder
+from django.db import transaction
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+from rest_framework import status
+from rest_framework.response import Response
+
+from .models import Commune, Region, User
+
+GENERATION_KEY = 'refdata:generation'
+MAX_RESPONSES = 512
+
+_lock = threading.Lock()
+_state = {
+    'generation': None, 'checked_at': 0.0, 'loaded_at': 0.0,
+    'responses': {}, 'communes': None, 'regions': None, 'values': {},
+}
+
+
+def generation():
+    value = cache.get(GENERATION_KEY)
+    if value is None:
+        cache.add(GENERATION_KEY, 1, timeout=None)
+        value = cache.get(GENERATION_KEY, 1)
+    return value
+
+
+def bump_generation():
+    try:
+        cache.incr(GENERATION_KEY)
+    except ValueError:
+        cache.set(GENERATION_KEY, 2, timeout=None)
+
+
+def _forget():
+    with _lock:
+        _state['generation'] = None
+
+
+def _current():
+    """État local de la génération courante (réinitialisé si elle a changé)."""
+    now = time.monotonic()
+    known = _state['generation']
+    if known is not None and now - _state['checked_at'] < getattr(settings, 'REFDATA_CHECK_INTERVAL', 2):
+        return known
+    current = generation()
+    with _lock:
+        expired = now - _state['loaded_at'] >= getattr(settings, 'REFDATA_MAX_AGE', 300)
+        if _state['generation'] != current or expired:
+            _state.update(generation=current, loaded_at=now, responses={}, communes=None, regions=None,
+                          values={})
+        _state['checked_at'] = now
+        return current
+
+
+@receiver(post_save, sender=Region)
+@receiver(post_delete, sender=Region)
+@receiver(post_save, sender=Commune)
+@receiver(post_delete, sender=Commune)
+def invalidate_reference_data(sender, **kwargs):
+    invalidate()
+
+
+@receiver(post_save, sender=User)
+def invalidate_commune_admins(sender, instance, **kwargs):
+    # Les communes embarquent leur administrateur dans leur représentation
+    if instance.is_admin_commune:
+        invalidate()
+
+
+def invalidate():
+    """Change de génération : le processus courant oublie tout de suite, les
+    autres à la validation de la transaction courante."""
+    _forget()
+    transaction.on_commit(bump_generation)
+
+
+# Recherches O(1)
+
+def _communes():
+    _current()
+    if _state['communes'] is None:
+        _state['communes'] = {
+            pk: (nom, region_id)
+            for pk, nom, region_id in Commune.objects.values_list('pk', 'nom', 'region_id')
+        }
+    return _state['communes']
+
+
+def _regions():
+    _current()
+    if _state['regions'] is None:
+        _state['regions'] = dict(Region.objects.values_list('pk', 'nom'))
+    return _state['regions']
+
+
+def communes():
+    """Toutes les communes : ``{id: (nom, region_id)}`` (ne pas modifier)."""
+    return _communes()
+
+
+def regions():
+    """Toutes les régions : ``{id: nom}`` (ne pas modifier)."""
+    return _regions()
+
+
+def _commune(commune_id):
+    """``(nom, region_id)`` de la commune, relu en base si la table ne la connaît pas.
+
+    Une commune créée ou modifiée dans un autre processus peut manquer à la
+    table locale jusqu'à la relecture de la génération : elle est alors lue
+    en base et la table locale est reconstruite au prochain accès.
+    """
+    entry = _communes().get(commune_id)
+    if entry is None and commune_id is not None:
+        entry = Commune.objects.filter(pk=commune_id).values_list('nom', 'region_id').first()
+        if entry is not None:
+            with _lock:
+                _state['communes'] = None
+    return entry
+
+
+def commune_name(commune_id):
+    entry = _commune(commune_id)
+    return entry[0] if entry else None
+
+
+def commune_region_id(commune_id):
+    entry = _commune(commune_id)
+    return entry[1] if entry else None
+
+
+def region_name(region_id):
+    return _regions().get(region_id)
+
+
+def per_generation(name, build):
+    """``build()``, calculé une fois par génération et par processus."""
+    _current()
+    values = _state['values']
+    if name not in values:
+        values[name] = build()
+    return values[name]
+
+
+# Réponses HTTP
+
+def cached_response(request, build):
+    """Sert la réponse de ``build()`` depuis le cache, avec ETag et 304."""
+    key = (request.build_absolute_uri(), request.accepted_renderer.format)
+    current = _current()
+    entry = _state['responses'].get(key)
+    if entry is None:
+        response = build()
+        if response.status_code != status.HTTP_200_OK:
+            return response
+        body = json.dumps(response.data, cls=DjangoJSONEncoder, sort_keys=True)
+        digest = hashlib.sha256(body.encode()).hexdigest()[:32]
+        entry = (response.data, f'"{current}-{digest}"')
+        with _lock:
+            if _state['generation'] == current and len(_state['responses']) < MAX_RESPONSES:
+                _state['responses'][key] = entry
+
+    data, etag = entry
+    if etag in _if_none_match(request):
+        return Response(status=status.HTTP_304_NOT_MODIFIED, headers={'ETag': etag})
+    return Response(data, headers={'ETag': etag, 'Cache-Control': 'no-cache'})
+
+
+def _if_none_match(request):
+    header = request.headers.get('If-None-Match', '')
+    return {tag.strip() for tag in header.split(',') if tag.strip()}
+
+
+class ReferenceDataCacheMixin:
+    """Lectures (list/retrieve) d'un ModelViewSet servies par ``cached_response``."""
+
+    def list(self, request, *args, **kwargs):
+        return cached_response(request, lambda: super(ReferenceDataCacheMixin, self).list(
+            request, *args, **kwargs
+        ))
+
+    def retrieve(self, request, *args, **kwargs):
+        return cached_response(request, lambda: super(ReferenceDataCacheMixin, self).retrieve(
+            request, *args, **kwargs
+        ))
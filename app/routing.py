@@ -0,0 +1,167 @@
+"""Routage des lectures vers des réplicas, avec lecture de ses propres écritures.
+
+Les écritures vont toujours sur ``default``. Les lectures y vont aussi, sauf
+dans un bloc ``reading(usage)`` : elles sont alors envoyées à l'un des
+réplicas déclarés pour cet usage dans ``DATABASE_REPLICAS`` :
+
+- ``reads`` : actions en lecture seule des vues (``ReplicaReadMixin``) ;
+- ``analytics`` : statistiques (à défaut, les réplicas ``reads``).
+
+Un réplica peut avoir du retard. Après une écriture, ``ReplicaRoutingMiddleware``
+marque l'utilisateur (ou, s'il est anonyme, son adresse) pendant
+``DATABASE_STICKY_SECONDS`` : ses lectures restent sur ``default`` et il relit
+ce qu'il vient d'écrire. La marque est gardée dans le cache Django, qui doit
+être partagé entre processus (Redis, Memcached) pour valoir entre eux.
+
+Sans réplica déclaré, tout reste sur ``default``.
+"""
+import contextvars
+import random
+from contextlib import contextmanager
+
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction
+
+from django.conf import settings
+from django.core.cache import cache
+
+DEFAULT = 'default'
+SAFE_METHODS = ('GET', 'HEAD', 'OPTIONS')
+
+_read_alias = contextvars.ContextVar('read_alias', default=None)
+_request_state = contextvars.ContextVar('request_state', default=None)
+
+
+def replicas(usage):
+    configured = getattr(settings, 'DATABASE_REPLICAS', {})
+    aliases = configured.get(usage) or []
+    if not aliases and usage != 'reads':
+        aliases = configured.get('reads') or []
+    return aliases
+
+
+def has_replicas():
+    return any(getattr(settings, 'DATABASE_REPLICAS', {}).values())
+
+
+def sticky_seconds():
+    return getattr(settings, 'DATABASE_STICKY_SECONDS', 10)
+
+
+def identity(request):
+    user = getattr(request, 'user', None)
+    if user is not None and user.is_authenticated:
+        return f'user:{user.pk}'
+    return f"addr:{request.META.get('REMOTE_ADDR', '')}"
+
+
+def sticky_key(who):
+    return f'db:sticky:{who}'
+
+
+def is_sticky(who):
+    return cache.get(sticky_key(who)) is not None
+
+
+def mark_sticky(who):
+    cache.set(sticky_key(who), 1, timeout=sticky_seconds())
+
+
+def read_alias(usage, who=None):
+    """Base à lire pour ``usage`` : un réplica, ou ``default`` juste après une écriture."""
+    aliases = replicas(usage)
+    if not aliases or (who is not None and is_sticky(who)):
+        return DEFAULT
+    return random.choice(aliases)
+
+
+@contextmanager
+def reading(usage, who=None):
+    """Envoie les lectures du bloc vers un réplica ``usage`` (voir ``read_alias``)."""
+    token = _read_alias.set(read_alias(usage, who))
+    try:
+        yield
+    finally:
+        _read_alias.reset(token)
+
+
+class ReplicaRouter:
+    def db_for_read(self, model, **hints):
+        return _read_alias.get() or DEFAULT
+
+    def db_for_write(self, model, **hints):
+        state = _request_state.get()
+        if state is not None:
+            state['wrote'] = True
+        return DEFAULT
+
+    def allow_relation(self, obj1, obj2, **hints):
+        # Réplicas et base principale contiennent les mêmes lignes
+        return True
+
+    def allow_migrate(self, db, app_label, model_name=None, **hints):
+        # Les réplicas reçoivent le schéma par réplication (voir sync_replicas)
+        return db == DEFAULT
+
+
+class ReplicaRoutingMiddleware:
+    """Marque l'auteur d'une écriture pour qu'il relise ``default`` un moment.
+
+    Synchrone ou asynchrone selon la chaîne : sous ASGI, les vues ``async``
+    (app/async_views.py) ne repassent pas par un thread pour ce middleware.
+    """
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        if iscoroutinefunction(get_response):
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+        state = {'wrote': False}
+        token = _request_state.set(state)
+        try:
+            response = self.get_response(request)
+        finally:
+            _request_state.reset(token)
+        self._mark(request, state)
+        return response
+
+    async def __acall__(self, request):
+        state = {'wrote': False}
+        token = _request_state.set(state)
+        try:
+            response = await self.get_response(request)
+        finally:
+            _request_state.reset(token)
+        self._mark(request, state)
+        return response
+
+    @staticmethod
+    def _mark(request, state):
+        # ``request.user`` est renseigné par l'authentification DRF (JWT)
+        if state['wrote'] and has_replicas():
+            mark_sticky(identity(request))
+
+
+class ReplicaReadMixin:
+    """Vue dont les requêtes GET/HEAD/OPTIONS lisent un réplica ``replica_usage``.
+
+    La décision est prise après l'authentification, pour tenir compte de
+    l'utilisateur marqué par une écriture récente.
+    """
+    replica_usage = 'reads'
+
+    def initial(self, request, *args, **kwargs):
+        super().initial(request, *args, **kwargs)
+        if request.method in SAFE_METHODS:
+            self._replica_token = _read_alias.set(read_alias(self.replica_usage, identity(request)))
+
+    def finalize_response(self, request, response, *args, **kwargs):
+        token = getattr(self, '_replica_token', None)
+        if token is not None:
+            _read_alias.reset(token)
+            self._replica_token = None
+        return super().finalize_response(request, response, *args, **kwargs)
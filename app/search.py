@@ -0,0 +1,162 @@
+"""Recherche de clients par nom, CIN, date de naissance et commune.
+
+Les noms sont comparés sur ``Client.search_name`` ("nom prenom" sans accents
+ni majuscules). Sous SQLite, un index plein texte FTS5 (``app_client_fts``)
+est tenu à jour par des triggers sur ``app_client`` : chaque mot saisi est
+cherché comme préfixe et les résultats sont classés par pertinence (bm25).
+Sous PostgreSQL, la même recherche passe par ``to_tsvector('simple', ...)``,
+avec un index GIN sur l'expression (``client_search_tsv_idx``). Sur les autres
+moteurs, ou si FTS5 est absent, elle se rabat sur l'index B-tree de
+``search_name``.
+"""
+from django.db import OperationalError, connections
+from django.db.models import BooleanField, FloatField, Q
+from django.db.models.expressions import RawSQL
+from django.db.models.signals import post_migrate
+from django.dispatch import receiver
+
+from .models import Client
+from .partitions import scope
+from .text import normalize
+
+FTS_TABLE = 'app_client_fts'
+
+FTS_SCHEMA = [
+    f"""CREATE VIRTUAL TABLE IF NOT EXISTS {FTS_TABLE} USING fts5(
+        search_name, content='app_client', content_rowid='id',
+        tokenize='unicode61 remove_diacritics 2'
+    )""",
+    f"""CREATE TRIGGER IF NOT EXISTS {FTS_TABLE}_ai AFTER INSERT ON app_client BEGIN
+        INSERT INTO {FTS_TABLE}(rowid, search_name) VALUES (new.id, new.search_name);
+    END""",
+    f"""CREATE TRIGGER IF NOT EXISTS {FTS_TABLE}_ad AFTER DELETE ON app_client BEGIN
+        INSERT INTO {FTS_TABLE}({FTS_TABLE}, rowid, search_name)
+        VALUES ('delete', old.id, old.search_name);
+    END""",
+    f"""CREATE TRIGGER IF NOT EXISTS {FTS_TABLE}_au AFTER UPDATE OF search_name ON app_client BEGIN
+        INSERT INTO {FTS_TABLE}({FTS_TABLE}, rowid, search_name)
+        VALUES ('delete', old.id, old.search_name);
+        INSERT INTO {FTS_TABLE}(rowid, search_name) VALUES (new.id, new.search_name);
+    END""",
+]
+
+_fts_available = {}
+
+
+def install_fts(using_connection):
+    """Crée l'index FTS5 et ses triggers s'ils manquent ; retourne True si actif.
+
+    Les triggers disparaissent quand une migration reconstruit ``app_client``
+    (ce que fait SQLite pour beaucoup d'ALTER) : ils sont donc recréés après
+    chaque ``migrate``, et l'index est alors reconstruit.
+    """
+    if using_connection.vendor != 'sqlite':
+        return False
+    with using_connection.cursor() as cursor:
+        cursor.execute(
+            "SELECT count(*) FROM sqlite_master WHERE type = 'trigger' AND name LIKE %s",
+            [f'{FTS_TABLE}_a_'],
+        )
+        complete = cursor.fetchone()[0] == 3
+        try:
+            for statement in FTS_SCHEMA:
+                cursor.execute(statement)
+        except OperationalError:
+            # SQLite compilé sans FTS5
+            return False
+        if not complete:
+            cursor.execute(f"INSERT INTO {FTS_TABLE}({FTS_TABLE}) VALUES ('rebuild')")
+    return True
+
+
+PG_DOCUMENT = "to_tsvector('simple', app_client.search_name)"
+PG_INDEX = (
+    "CREATE INDEX IF NOT EXISTS client_search_tsv_idx ON app_client "
+    "USING gin (to_tsvector('simple', search_name))"
+)
+
+
+@receiver(post_migrate)
+def setup_fts(sender, app_config, using='default', **kwargs):
+    if app_config.label == 'app':
+        _fts_available[using] = install_fts(connections[using])
+        if connections[using].vendor == 'postgresql':
+            with connections[using].cursor() as cursor:
+                cursor.execute(PG_INDEX)
+
+
+def fts_available(using='default'):
+    """Vrai si la base ``using`` (celle qui exécutera la recherche) a l'index FTS5."""
+    if using not in _fts_available:
+        connection = connections[using]
+        if connection.vendor != 'sqlite':
+            _fts_available[using] = False
+        else:
+            with connection.cursor() as cursor:
+                cursor.execute(
+                    "SELECT count(*) FROM sqlite_master WHERE name = %s", [FTS_TABLE]
+                )
+                _fts_available[using] = cursor.fetchone()[0] == 1
+    return _fts_available[using]
+
+
+def fts_query(tokens):
+    """Requête FTS5 : chaque mot est un préfixe, entre guillemets pour l'échapper."""
+    return ' '.join('"{}"*'.format(token.replace('"', '""')) for token in tokens)
+
+
+def tsquery(tokens):
+    """Requête ``to_tsquery`` : chaque mot est un préfixe, entre apostrophes."""
+    return ' & '.join(
+        "'{}':*".format(token.replace('\\', '').replace("'", "''")) for token in tokens
+    )
+
+
+def search_clients(q=None, cin=None, born_after=None, born_before=None,
+                   commune=None, region=None):
+    """Retourne un queryset de clients filtré et classé par pertinence."""
+    queryset = Client.objects.all()
+    if cin:
+        queryset = queryset.filter(cin=cin)
+    if born_after:
+        queryset = queryset.filter(date_naissance__gte=born_after)
+    if born_before:
+        queryset = queryset.filter(date_naissance__lte=born_before)
+    # Filtres géographiques sur la clé de partition (app/partitions.py)
+    queryset = scope(queryset, commune=commune or None, region=region or None)
+
+    tokens = normalize(q).split() if q else []
+    if not tokens:
+        return queryset.order_by('search_name', 'id')
+
+    # Base qui exécutera la requête (réplica éventuel, app/routing.py)
+    using = queryset.db
+    if fts_available(using):
+        # Les lignes trouvées sont sélectionnées par une seule recherche FTS ;
+        # le rang bm25 est ensuite lu par rowid pour ces lignes seulement
+        query = fts_query(tokens)
+        queryset = queryset.filter(
+            id__in=RawSQL(f"SELECT rowid FROM {FTS_TABLE} WHERE {FTS_TABLE} MATCH %s", [query]),
+        ).annotate(rank=RawSQL(
+            f"SELECT rank FROM {FTS_TABLE} WHERE {FTS_TABLE} MATCH %s"
+            f" AND {FTS_TABLE}.rowid = app_client.id",
+            [query], output_field=FloatField(),
+        ))
+        return queryset.order_by('rank', 'search_name', 'id')
+
+    if connections[using].vendor == 'postgresql':
+        query = tsquery(tokens)
+        queryset = queryset.alias(matched=RawSQL(
+            f"{PG_DOCUMENT} @@ to_tsquery('simple', %s)", [query], output_field=BooleanField(),
+        )).filter(matched=True).annotate(rank=RawSQL(
+            f"-ts_rank({PG_DOCUMENT}, to_tsquery('simple', %s))", [query],
+            output_field=FloatField(),
+        ))
+        return queryset.order_by('rank', 'search_name', 'id')
+
+    # Sans FTS : le premier mot est un préfixe du nom (index), les suivants
+    # doivent apparaître dans le nom complet
+    queryset = queryset.filter(search_name__startswith=tokens[0])
+    for token in tokens[1:]:
+        queryset = queryset.filter(Q(search_name__contains=f' {token}'))
+    return queryset.order_by('search_name', 'id')
@@ -1,4 +1,5 @@
-from rest_framework import serializers
+from rest_framework import mixins, serializers
+from django.urls import reverse
 from .models import *
 from rest_framework_simplejwt.serializers import TokenObtainPairSerializer
 from rest_framework_simplejwt.tokens import RefreshToken
@@ -8,7 +9,92 @@ from django.contrib.auth.password_validation import validate_password
 from django.contrib.auth import get_user_model
 from django.core.mail import send_mail
 from django.core.exceptions import ObjectDoesNotExist
-class UserSerializer(serializers.ModelSerializer):
+
+from .accounts import activate
+from .authentication import database_user
+from .mailspool import issue_reset_pin
+from .photos import thumbnail_urls
+
+class EagerLoadingMixin:
+    """Plan de chargement des relations lues par le sérialiseur.
+
+    Les vues appliquent ``setup_eager_loading`` à leur queryset (voir
+    ``EagerLoadingViewMixin``), ce qui évite une requête par ligne et par relation.
+    """
+    select_related_fields = ()
+    prefetch_related_fields = ()
+
+    @classmethod
+    def setup_eager_loading(cls, queryset, columns=None):
+        """Applique le plan ; avec ``columns``, ne charge que ces colonnes."""
+        select_related = cls.select_related_fields
+        prefetch_related = cls.prefetch_related_fields
+        if columns is not None:
+            select_related = [path for path in select_related if path.split('__')[0] in columns]
+            prefetch_related = [path for path in prefetch_related if path.split('__')[0] in columns]
+            queryset = queryset.only(*columns)
+        if select_related:
+            queryset = queryset.select_related(*select_related)
+        if prefetch_related:
+            queryset = queryset.prefetch_related(*prefetch_related)
+        return queryset
+
+class SparseFieldsetsMixin:
+    """Sélection des champs renvoyés via ``?fields=a,b`` ou ``?omit=c``.
+
+    Les colonnes des champs écartés ne sont pas lues en base (``.only()``).
+    Un champ calculé (``source='*'``) doit déclarer dans ``sparse_field_columns``
+    les colonnes dont il a besoin, sinon toutes les colonnes sont chargées.
+    Les champs de ``list_omit_fields`` ne sont renvoyés par les listes que
+    s'ils sont demandés explicitement (``?fields=``).
+    """
+    sparse_field_columns = {}
+    list_omit_fields = ()
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self._sparse = False
+        request = self.context.get('request')
+        if request is None or request.method != 'GET':
+            return
+
+        fields = self._split_param(request.query_params.get('fields'))
+        omit = self._split_param(request.query_params.get('omit'))
+        unknown = (fields | omit) - set(self.fields)
+        if unknown:
+            raise serializers.ValidationError(
+                {'fields': [f"Champs inconnus : {', '.join(sorted(unknown))}"]}
+            )
+        view = self.context.get('view')
+        if isinstance(view, mixins.ListModelMixin) and getattr(view, 'action', 'list') == 'list':
+            omit |= set(self.list_omit_fields) - fields
+        for name in list(self.fields):
+            if (fields and name not in fields) or name in omit:
+                self.fields.pop(name)
+                self._sparse = True
+
+    @staticmethod
+    def _split_param(value):
+        return {name.strip() for name in value.split(',') if name.strip()} if value else set()
+
+    def get_sparse_columns(self):
+        """Colonnes nécessaires aux champs retenus, ou ``None`` pour tout charger."""
+        if not self._sparse:
+            return None
+        opts = self.Meta.model._meta
+        concrete = {field.name for field in opts.concrete_fields}
+        columns = {opts.pk.name}
+        for name, field in self.fields.items():
+            if name in self.sparse_field_columns:
+                columns.update(self.sparse_field_columns[name])
+                continue
+            root = field.source.split('.')[0]
+            if root not in concrete:
+                return None
+            columns.add(root)
+        return columns
+
+class UserSerializer(SparseFieldsetsMixin, EagerLoadingMixin, serializers.ModelSerializer):
     is_admin_commune = serializers.BooleanField()
 
     class Meta:
@@ -16,12 +102,14 @@ class UserSerializer(serializers.ModelSerializer):
         fields = ['id', 'email', 'username', 'is_superuser', 'is_staff', 
                  'is_admin_commune', 'reset_pin', 'pin_attempts', 'pin_expires_at']
 
-class RegionSerializer(serializers.ModelSerializer):
+class RegionSerializer(SparseFieldsetsMixin, EagerLoadingMixin, serializers.ModelSerializer):
     class Meta:
         model = Region
         fields = '__all__'
 
-class CommuneSerializer(serializers.ModelSerializer):
+class CommuneSerializer(SparseFieldsetsMixin, EagerLoadingMixin, serializers.ModelSerializer):
+    select_related_fields = ('region', 'admin_commune')
+
     region = serializers.PrimaryKeyRelatedField(queryset=Region.objects.all())
     admin_commune = serializers.PrimaryKeyRelatedField(
         queryset=User.objects.filter(is_admin_commune=True),
@@ -35,36 +123,124 @@ class CommuneSerializer(serializers.ModelSerializer):
 
     def to_representation(self, instance):
         representation = super().to_representation(instance)
-        representation['region'] = RegionSerializer(instance.region).data
-        if instance.admin_commune:
+        if 'region' in self.fields:
+            representation['region'] = RegionSerializer(instance.region).data
+        if 'admin_commune' in self.fields and instance.admin_commune:
             representation['admin_commune'] = UserSerializer(instance.admin_commune).data
         return representation
 
 class ClientBulkSerializer(serializers.ListSerializer):
     def create(self, validated_data):
-        clients = [Client(**item) for item in validated_data]
-        return Client.objects.bulk_create(clients)
+        from .bulk import create_clients
+
+        return create_clients([Client(**item) for item in validated_data])
 
     class Meta:
         model = Client
         fields = '__all__'
 
-class ClientSerializer(serializers.ModelSerializer):
-    qrcode = serializers.CharField(read_only=True)
+class ClientSerializer(SparseFieldsetsMixin, EagerLoadingMixin, serializers.ModelSerializer):
+    sparse_field_columns = {'qrcode_url': (), 'thumbnails': ('image',)}
+    # Les listes renvoient les vignettes, pas la photo pleine taille
+    list_omit_fields = ('image',)
+
+    qrcode_url = serializers.SerializerMethodField()
     image = serializers.ImageField(required=False, allow_null=True)
+    thumbnails = serializers.SerializerMethodField()
 
     class Meta:
         model = Client
-        fields = '__all__'
+        exclude = ['search_name']
         list_serializer_class = ClientBulkSerializer
         extra_kwargs = {
             'lieu_naissance': {'required': False}
         }
 
-class DemandeActeSerializer(serializers.ModelSerializer):
+    def get_qrcode_url(self, obj):
+        url = reverse('client-qrcode', kwargs={'pk': obj.pk})
+        request = self.context.get('request')
+        return request.build_absolute_uri(url) if request else url
+
+    def get_thumbnails(self, obj):
+        """Vignettes de la photo ; None tant qu'elle n'a pas été traitée."""
+        urls = thumbnail_urls(obj.image) if obj.image else None
+        request = self.context.get('request')
+        if urls and request:
+            urls = {variant: request.build_absolute_uri(url) for variant, url in urls.items()}
+        return urls
+
+class DuplicateCandidateSerializer(serializers.Serializer):
+    id = serializers.IntegerField(source='client.pk')
+    nom = serializers.CharField(source='client.nom')
+    prenom = serializers.CharField(source='client.prenom')
+    date_naissance = serializers.DateField(source='client.date_naissance')
+    lieu_naissance = serializers.IntegerField(source='client.lieu_naissance_id', allow_null=True)
+    score = serializers.FloatField()
+
+class ClientSearchQuerySerializer(serializers.Serializer):
+    q = serializers.CharField(required=False, allow_blank=True, max_length=200)
+    cin = serializers.CharField(required=False, max_length=20)
+    born_after = serializers.DateField(required=False)
+    born_before = serializers.DateField(required=False)
+    commune = serializers.IntegerField(required=False)
+    region = serializers.IntegerField(required=False)
+
+class ClientRowSerializer(serializers.ModelSerializer):
+    """Validation d'une ligne d'import en masse, sans requête par ligne.
+
+    L'unicité du CIN et l'existence de la commune sont vérifiées par lot dans
+    app/bulk.py, d'où les champs déclarés sans validateur ni queryset.
+    """
+    cin = serializers.CharField(max_length=20)
+    lieu_naissance = serializers.IntegerField(required=False, allow_null=True)
+
+    class Meta:
+        model = Client
+        fields = ['sexe', 'nom', 'prenom', 'date_naissance', 'lieu_naissance',
+                  'adresse', 'cin', 'conjoint', 'enfants']
+
+class DemandeActeSerializer(SparseFieldsetsMixin, EagerLoadingMixin, serializers.ModelSerializer):
+    select_related_fields = ('client',)
+
     class Meta:
         model = DemandeActe
         fields = '__all__'
+        # Le statut ne change que par les transitions (app/workflow.py)
+        read_only_fields = ['statut', 'agent', 'date_prise_en_charge']
+
+class DemandeClaimSerializer(serializers.Serializer):
+    limit = serializers.IntegerField(min_value=1, max_value=100, default=1)
+    commune = serializers.IntegerField(required=False)
+    type_acte = serializers.ChoiceField(choices=TypeActe.choices, required=False)
+
+class DemandeTransitionSerializer(serializers.Serializer):
+    statut = serializers.ChoiceField(choices=DemandeActe.Statut.choices)
+
+class QRCodeVerifySerializer(serializers.Serializer):
+    code = serializers.CharField(required=False)
+    codes = serializers.ListField(child=serializers.CharField(), required=False, max_length=1000)
+    max_age = serializers.IntegerField(min_value=1, required=False)
+
+    def validate(self, data):
+        if 'code' not in data and not data.get('codes'):
+            raise serializers.ValidationError("Indiquez « code » ou « codes ».")
+        return data
+
+class QRSheetQuerySerializer(serializers.Serializer):
+    commune = serializers.IntegerField(required=False)
+    region = serializers.IntegerField(required=False)
+    type = serializers.ChoiceField(choices=['pdf', 'png'], default='pdf')
+
+    def validate(self, data):
+        if 'commune' not in data and 'region' not in data:
+            raise serializers.ValidationError("Indiquez « commune » ou « region ».")
+        return data
+
+class JobSerializer(SparseFieldsetsMixin, EagerLoadingMixin, serializers.ModelSerializer):
+    class Meta:
+        model = Job
+        fields = ['id', 'kind', 'payload', 'idempotency_key', 'status', 'attempts',
+                  'max_attempts', 'run_after', 'last_error', 'created_at', 'updated_at']
 
 class AdminCommuneCreateSerializer(serializers.ModelSerializer):
     password = serializers.CharField(write_only=True)
@@ -89,6 +265,10 @@ class CommuneStatSerializer(serializers.Serializer):
     commune = serializers.CharField()
     count = serializers.IntegerField()
 
+class RegionStatSerializer(serializers.Serializer):
+    region = serializers.CharField()
+    count = serializers.IntegerField()
+
 class StatisticsSerializer(serializers.Serializer):
     users = serializers.IntegerField()
     regions = serializers.IntegerField()
@@ -98,6 +278,18 @@ class StatisticsSerializer(serializers.Serializer):
     demandes_acte = serializers.IntegerField()
     types_acte = serializers.DictField(child=serializers.IntegerField())
     clients_par_commune = CommuneStatSerializer(many=True)
+    clients_par_region = RegionStatSerializer(many=True)
+
+class DemandeStatisticsQuerySerializer(serializers.Serializer):
+    start = serializers.DateTimeField(required=False)
+    end = serializers.DateTimeField(required=False)
+    period = serializers.ChoiceField(choices=['day', 'week', 'month'], default='day')
+
+class DemandeStatSerializer(serializers.Serializer):
+    periode = serializers.DateTimeField()
+    type_acte = serializers.CharField()
+    region = serializers.CharField(allow_null=True)
+    count = serializers.IntegerField()
     
     
 class MytokenObtainPairView(TokenObtainPairSerializer):
@@ -122,25 +314,14 @@ class ForgotPasswordSerializer(serializers.Serializer):
 
     def validate_email(self, value):
         try:
-            user = User.objects.get(email=value)
-            user.generate_reset_pin()  # Générer et enregistrer le PIN
-            
-            # # Envoyer le PIN par email
-            # send_mail(
-            #     subject="Réinitialisation du mot de passe",
-            #     message=f"Votre code de réinitialisation est : {user.reset_pin}\n\nIl est valide pendant 10 minutes.",
-            #     from_email="andriatahianaarnaud@gmail.com",
-            #     recipient_list=[user.email],
-            #     fail_silently=False
-            # )
-
+            user = User.objects.only('pk', 'email').get(email=value)
         except ObjectDoesNotExist:
             raise serializers.ValidationError("Aucun compte trouvé avec cet email.")
 
+        # PIN et e-mail dans la même transaction ; envoi par manage.py send_mail_spool
+        issue_reset_pin(user)
         return value
-        
-        
-        
+
 
 class ResetPasswordSerializer(serializers.Serializer):
     email = serializers.EmailField()
@@ -180,12 +361,24 @@ class ResetPasswordSerializer(serializers.Serializer):
         
         
         
+class ActivateAccountSerializer(serializers.Serializer):
+    cin = serializers.CharField()
+    activation_code = serializers.CharField(max_length=16)
+    new_password = serializers.CharField(write_only=True)
+
+    def validate(self, data):
+        user = User.objects.filter(client_linked__cin=data["cin"]).first()
+        if user is None or not activate(user, data["activation_code"], data["new_password"]):
+            raise serializers.ValidationError("CIN ou code d'activation invalide.")
+        return data
+
+
 class ChangePasswordSerializer(serializers.Serializer):
     old_password = serializers.CharField(write_only=True)
     new_password = serializers.CharField(write_only=True)
 
     def validate(self, data):
-        user = self.context["request"].user  # Récupérer l'utilisateur connecté
+        user = database_user(self.context["request"].user)  # Récupérer l'utilisateur connecté
         if not user.check_password(data["old_password"]):
             raise serializers.ValidationError("Ancien mot de passe incorrect.")
         
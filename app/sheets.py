@@ -0,0 +1,219 @@
+"""Planches de cartes QR à imprimer (plusieurs cartes par page A4).
+
+Une commune imprime les cartes de tout un village d'un coup : les clients
+filtrés sont lus par paquets, leurs codes signés calculés dans ce processus,
+puis chaque page est rendue par un processus du pool. Le QR code est dessiné
+à partir de sa matrice (une image de quelques dizaines de pixels agrandie),
+sans passer par le PNG de ``render_qrcode``.
+
+Le résultat est produit page par page :
+
+- en PDF, par un petit écrivain PDF qui émet chaque page dès qu'elle est
+  rendue et n'écrit la table des objets qu'à la fin ;
+- en PNG, une image par page dans une archive ZIP.
+
+Seules ``workers * 2`` pages sont en cours à un instant donné : la mémoire
+reste bornée quel que soit le nombre de cartes.
+"""
+import zlib
+import zipfile
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from io import BytesIO
+
+import qrcode
+from PIL import Image, ImageDraw, ImageFont
+
+from .actes import ChunkWriter
+from .models import Client
+from .partitions import scope
+from .qrcodes import sign_client
+from .refcache import commune_name
+
+FORMATS = ('pdf', 'png')
+
+PAGE_SIZE = (1240, 1754)  # A4 à 150 ppp
+PAGE_POINTS = (595.28, 841.89)
+MARGIN = 60
+COLUMNS, ROWS = 3, 4
+CARDS_PER_PAGE = COLUMNS * ROWS
+QR_SIZE = 280
+
+
+def sheet_clients(commune=None, region=None):
+    """Clients à imprimer, dans l'ordre alphabétique ; seules les colonnes utiles."""
+    queryset = Client.objects.only(
+        'id', 'nom', 'prenom', 'cin', 'date_naissance', 'lieu_naissance_id', 'qrcode_emis_le',
+    )
+    return scope(queryset, commune=commune, region=region).order_by('search_name', 'id')
+
+
+def card_data(client):
+    """Ce qui est imprimé sur la carte d'un client (sans accès au disque)."""
+    return {
+        'nom': f"{client.nom} {client.prenom}",
+        'cin': client.cin,
+        'commune': commune_name(client.lieu_naissance_id) if client.lieu_naissance_id else '',
+        'qrcode': sign_client(client),
+    }
+
+
+def qr_image(payload, size):
+    """QR code de ``payload`` en niveaux de gris, ``size`` pixels de côté au plus."""
+    qr = qrcode.QRCode(version=None, error_correction=qrcode.constants.ERROR_CORRECT_M, border=4)
+    qr.add_data(payload)
+    qr.make(fit=True)
+    matrix = qr.get_matrix()
+    modules = len(matrix)
+    pixels = bytes(0 if dark else 255 for row in matrix for dark in row)
+    scale = max(1, size // modules)
+    return Image.frombytes('L', (modules, modules), pixels).resize(
+        (modules * scale, modules * scale), Image.NEAREST,
+    )
+
+
+def render_page(cards):
+    """Rend une page de cartes ; retourne l'image (mode L). Sans base de données."""
+    page = Image.new('L', PAGE_SIZE, 255)
+    draw = ImageDraw.Draw(page)
+    name_font = ImageFont.load_default(size=24)
+    text_font = ImageFont.load_default(size=20)
+    width = (PAGE_SIZE[0] - 2 * MARGIN) // COLUMNS
+    height = (PAGE_SIZE[1] - 2 * MARGIN) // ROWS
+
+    for index, card in enumerate(cards):
+        x = MARGIN + (index % COLUMNS) * width
+        y = MARGIN + (index // COLUMNS) * height
+        # Repères de découpe
+        draw.rectangle((x, y, x + width, y + height), outline=200)
+        qr = qr_image(card['qrcode'], QR_SIZE)
+        page.paste(qr, (x + (width - qr.width) // 2, y + 10))
+        text_y = y + 20 + qr.height
+        draw.text((x + 15, text_y), card['nom'][:28], font=name_font, fill=0)
+        draw.text((x + 15, text_y + 32), f"CIN {card['cin']}", font=text_font, fill=0)
+        if card['commune']:
+            draw.text((x + 15, text_y + 58), card['commune'][:30], font=text_font, fill=0)
+    return page
+
+
+def render_pdf_page(cards):
+    """Page compressée pour ``PDFWriter`` : ``(largeur, hauteur, octets Flate)``."""
+    page = render_page(cards)
+    return page.width, page.height, zlib.compress(page.tobytes(), 6)
+
+
+def render_png_page(cards):
+    buffered = BytesIO()
+    render_page(cards).save(buffered, format='PNG', optimize=True)
+    return buffered.getvalue()
+
+
+def paged_cards(clients, chunk_size=2000):
+    """Regroupe les cartes de ``clients`` (un queryset) par page."""
+    page = []
+    for client in clients.iterator(chunk_size=chunk_size):
+        page.append(card_data(client))
+        if len(page) == CARDS_PER_PAGE:
+            yield page
+            page = []
+    if page:
+        yield page
+
+
+def bounded_map(function, items, workers=1):
+    """Comme ``map``, dans ``workers`` processus, avec au plus ``workers * 2`` tâches en vol.
+
+    ``Executor.map`` soumettrait d'un coup tous les éléments : ici ils sont
+    consommés au rythme des résultats.
+    """
+    if workers <= 1:
+        yield from map(function, items)
+        return
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        pending = deque()
+        for item in items:
+            pending.append(pool.submit(function, item))
+            if len(pending) >= workers * 2:
+                yield pending.popleft().result()
+        while pending:
+            yield pending.popleft().result()
+
+
+class PDFWriter:
+    """Écrit un PDF page par page : chaque page est une image en niveaux de gris.
+
+    Les décalages des objets sont relevés au fil de l'écriture ; l'objet
+    ``Pages`` (numéro 2, réservé) et la table ``xref`` sont écrits à la fin.
+    """
+
+    def __init__(self):
+        self.offset = 0
+        self.offsets = {}
+        self.pages = []
+        self.next_id = 3
+
+    def _emit(self, data):
+        self.offset += len(data)
+        return data
+
+    def _object(self, object_id, body, stream=None):
+        self.offsets[object_id] = self.offset
+        data = f"{object_id} 0 obj\n".encode() + body
+        if stream is not None:
+            data += b"\nstream\n" + stream + b"\nendstream"
+        return self._emit(data + b"\nendobj\n")
+
+    def start(self):
+        return self._emit(b"%PDF-1.4\n%\xe2\xe3\xcf\xd3\n") + self._object(
+            1, b"<< /Type /Catalog /Pages 2 0 R >>",
+        )
+
+    def page(self, width, height, flate):
+        image_id, content_id, page_id = self.next_id, self.next_id + 1, self.next_id + 2
+        self.next_id += 3
+        self.pages.append(page_id)
+        content = f"q {PAGE_POINTS[0]} 0 0 {PAGE_POINTS[1]} 0 0 cm /Im0 Do Q".encode()
+        return (
+            self._object(image_id, (
+                f"<< /Type /XObject /Subtype /Image /Width {width} /Height {height} "
+                f"/ColorSpace /DeviceGray /BitsPerComponent 8 /Filter /FlateDecode "
+                f"/Length {len(flate)} >>"
+            ).encode(), flate)
+            + self._object(content_id, f"<< /Length {len(content)} >>".encode(), content)
+            + self._object(page_id, (
+                f"<< /Type /Page /Parent 2 0 R /MediaBox [0 0 {PAGE_POINTS[0]} {PAGE_POINTS[1]}] "
+                f"/Resources << /XObject << /Im0 {image_id} 0 R >> >> /Contents {content_id} 0 R >>"
+            ).encode())
+        )
+
+    def finish(self):
+        kids = ' '.join(f"{page_id} 0 R" for page_id in self.pages)
+        data = self._object(2, f"<< /Type /Pages /Kids [{kids}] /Count {len(self.pages)} >>".encode())
+        xref_offset = self.offset
+        lines = [f"xref\n0 {self.next_id}\n", "0000000000 65535 f \n"]
+        lines += [f"{self.offsets[object_id]:010d} 00000 n \n" for object_id in range(1, self.next_id)]
+        lines.append(f"trailer\n<< /Size {self.next_id} /Root 1 0 R >>\nstartxref\n{xref_offset}\n%%EOF\n")
+        return data + self._emit(''.join(lines).encode())
+
+
+def stream_pdf(clients, workers=1):
+    """Génère le PDF des planches de ``clients``, page par page."""
+    writer = PDFWriter()
+    yield writer.start()
+    for width, height, flate in bounded_map(render_pdf_page, paged_cards(clients), workers):
+        yield writer.page(width, height, flate)
+    yield writer.finish()
+
+
+def stream_png_zip(clients, workers=1):
+    """Génère une archive ZIP d'images PNG (une par page), page par page."""
+    out = ChunkWriter()
+    with zipfile.ZipFile(out, 'w', compression=zipfile.ZIP_STORED) as archive:
+        for number, png in enumerate(bounded_map(render_png_page, paged_cards(clients), workers), 1):
+            archive.writestr(f"planche-{number:05d}.png", png)
+            yield out.take()
+    yield out.take()
+
+
+def stream_sheets(clients, format='pdf', workers=1):
+    return (stream_pdf if format == 'pdf' else stream_png_zip)(clients, workers=workers)
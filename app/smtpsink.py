@@ -0,0 +1,92 @@
+"""Serveur SMTP local qui accepte et garde les messages (tests, mesures).
+
+Le strict nécessaire du protocole pour ``smtplib`` et le backend SMTP de
+Django, sans TLS ni authentification. ``connect_latency`` et
+``message_latency`` simulent un serveur distant lent::
+
+    with SMTPSink(connect_latency=0.3) as sink:
+        settings.EMAIL_HOST, settings.EMAIL_PORT = sink.host, sink.port
+        ...
+        sink.messages, sink.connections
+"""
+import socketserver
+import threading
+import time
+
+
+class _Handler(socketserver.StreamRequestHandler):
+    def reply(self, line):
+        self.wfile.write(line.encode() + b'\r\n')
+
+    def handle(self):
+        sink = self.server.sink
+        with sink.lock:
+            sink.connections += 1
+        time.sleep(sink.connect_latency)
+        self.reply('220 smtpsink ESMTP')
+        envelope = {'from': None, 'to': []}
+        while True:
+            line = self.rfile.readline()
+            if not line:
+                return
+            command = line.decode('utf-8', 'replace').strip()
+            verb = command[:4].upper()
+            if verb in ('EHLO', 'HELO'):
+                self.reply('250 smtpsink')
+            elif verb == 'MAIL':
+                envelope = {'from': command.partition(':')[2].strip(' <>'), 'to': []}
+                self.reply('250 OK')
+            elif verb == 'RCPT':
+                envelope['to'].append(command.partition(':')[2].strip(' <>'))
+                self.reply('250 OK')
+            elif verb == 'DATA':
+                self.reply('354 Fin des données par <CRLF>.<CRLF>')
+                data = []
+                for data_line in iter(self.rfile.readline, b''):
+                    if data_line in (b'.\r\n', b'.\n'):
+                        break
+                    data.append(data_line[1:] if data_line.startswith(b'..') else data_line)
+                time.sleep(sink.message_latency)
+                with sink.lock:
+                    sink.messages.append({**envelope, 'data': b''.join(data).decode('utf-8', 'replace')})
+                self.reply('250 OK')
+            elif verb in ('RSET', 'NOOP'):
+                self.reply('250 OK')
+            elif verb == 'QUIT':
+                self.reply('221 Au revoir')
+                return
+            else:
+                self.reply('502 Commande non reconnue')
+
+
+class _Server(socketserver.ThreadingTCPServer):
+    daemon_threads = True
+    allow_reuse_address = True
+
+
+class SMTPSink:
+    """Serveur SMTP dans un thread ; messages reçus dans ``messages``."""
+
+    def __init__(self, host='127.0.0.1', port=0, connect_latency=0.0, message_latency=0.0):
+        self.connect_latency = connect_latency
+        self.message_latency = message_latency
+        self.messages = []
+        self.connections = 0
+        self.lock = threading.Lock()
+        self.server = _Server((host, port), _Handler)
+        self.server.sink = self
+        self.host, self.port = self.server.server_address[:2]
+
+    def start(self):
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+        return self
+
+    def stop(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc_info):
+        self.stop()
@@ -0,0 +1,337 @@
+"""Calcul des statistiques du tableau de bord.
+
+Deux sources, même format de sortie :
+
+- ``live_statistics`` : requêtes agrégées groupées, un nombre constant de
+  requêtes quel que soit le nombre de communes ou de types d'acte ;
+- ``materialized_statistics`` : lecture de la table ``StatisticCounter``,
+  tenue à jour au fil des écritures de Client, DemandeActe et User quand
+  ``STATISTICS_MATERIALIZED`` est activé (``manage.py rebuild_statistics``
+  la reconstruit à partir des agrégats).
+
+Les noms et le nombre des communes et des régions viennent du cache de
+référence (app/refcache.py) et le nombre d'utilisateurs de ses compteurs :
+la lecture matérialisée ne parcourt ni ``Commune``, ni ``Region``, ni ``User``.
+
+Un compteur par commune ou par type d'acte est décrémenté de la valeur
+enregistrée en base avant l'écriture : celle lue au chargement de la ligne
+ou, si la colonne était différée (``.only()``), relue dans ``pre_save``.
+"""
+from collections import Counter, defaultdict
+
+from django.conf import settings
+from django.db import transaction
+from django.db.models import Count, F, Q
+from django.db.models.functions import TruncDay, TruncMonth, TruncWeek
+from django.db.models.signals import post_delete, post_save, pre_delete, pre_save
+from django.dispatch import receiver
+
+from .models import Client, DemandeActe, StatisticCounter, TypeActe, User
+from .partitions import partition_totals
+from .refcache import commune_region_id, communes, region_name, regions
+
+CLIENTS = 'clients'
+DEMANDES = 'demandes_acte'
+USERS = 'users'
+ADMINS = 'administrateurs'
+TYPE_PREFIX = 'type_acte:'
+COMMUNE_PREFIX = 'commune:'
+
+PERIODS = {
+    'day': TruncDay,
+    'week': TruncWeek,
+    'month': TruncMonth,
+}
+
+
+def materialized_enabled():
+    return getattr(settings, 'STATISTICS_MATERIALIZED', False)
+
+
+def _user_counts():
+    return User.objects.aggregate(
+        users=Count('id'),
+        administrateurs=Count('id', filter=Q(is_admin_commune=True)),
+    )
+
+
+def _reference_counts(users):
+    """Compteurs des utilisateurs ``users`` et des tables de référence (cache)."""
+    return {
+        'users': users['users'],
+        'administrateurs': users['administrateurs'],
+        'regions': len(regions()),
+        'communes': len(communes()),
+    }
+
+
+def _format(reference, clients, demandes, per_type, per_commune, per_region):
+    return {
+        **reference,
+        'clients': clients,
+        'demandes_acte': demandes,
+        'types_acte': {
+            label: per_type.get(value, 0) for value, label in TypeActe.choices
+        },
+        'clients_par_commune': [
+            {'commune': nom, 'count': per_commune.get(pk, 0)}
+            for pk, (nom, region_id) in sorted(communes().items())
+        ],
+        'clients_par_region': [
+            {'region': nom, 'count': per_region.get(pk, 0)}
+            for pk, nom in sorted(regions().items())
+        ],
+    }
+
+
+def live_statistics():
+    per_type = dict(
+        DemandeActe.objects.order_by().values_list('type_acte').annotate(n=Count('id'))
+    )
+    per_commune = dict(
+        Client.objects.order_by()
+        .filter(lieu_naissance__isnull=False)
+        .values_list('lieu_naissance').annotate(n=Count('id'))
+    )
+    return _format(
+        _reference_counts(_user_counts()),
+        clients=Client.objects.count(),
+        demandes=DemandeActe.objects.count(),
+        per_type=per_type,
+        per_commune=per_commune,
+        # Agrégat national assemblé à partir des totaux de chaque partition
+        per_region=partition_totals(Client.objects.all()),
+    )
+
+
+def materialized_statistics():
+    counters = dict(StatisticCounter.objects.values_list('key', 'value'))
+    per_type = {
+        key[len(TYPE_PREFIX):]: value
+        for key, value in counters.items() if key.startswith(TYPE_PREFIX)
+    }
+    per_commune = {
+        int(key[len(COMMUNE_PREFIX):]): value
+        for key, value in counters.items() if key.startswith(COMMUNE_PREFIX)
+    }
+    return _format(
+        _reference_counts({'users': counters.get(USERS, 0), 'administrateurs': counters.get(ADMINS, 0)}),
+        clients=counters.get(CLIENTS, 0),
+        demandes=counters.get(DEMANDES, 0),
+        per_type=per_type,
+        per_commune=per_commune,
+        per_region=_regions_from_communes(per_commune),
+    )
+
+
+def _regions_from_communes(per_commune):
+    per_region = Counter()
+    for commune_id, count in per_commune.items():
+        region_id = commune_region_id(commune_id)
+        if region_id is not None:
+            per_region[region_id] += count
+    return per_region
+
+
+def statistics():
+    return materialized_statistics() if materialized_enabled() else live_statistics()
+
+
+def demandes_breakdown(start=None, end=None, period='day'):
+    """Demandes par période, type d'acte et région (clé de partition de la demande)."""
+    queryset = DemandeActe.objects.order_by()
+    if start:
+        queryset = queryset.filter(date_demande__gte=start)
+    if end:
+        queryset = queryset.filter(date_demande__lt=end)
+    rows = (
+        queryset
+        .annotate(periode=PERIODS[period]('date_demande'))
+        .values('periode', 'type_acte', 'region')
+        .annotate(count=Count('id'))
+    )
+    # Noms des régions depuis le cache de référence, sans jointure
+    rows = [{**row, 'region': region_name(row['region'])} for row in rows]
+    rows.sort(key=lambda row: (row['periode'], row['type_acte'], row['region'] or ''))
+    return rows
+
+
+# Compteurs matérialisés
+
+def bump(deltas):
+    """Ajoute ``deltas`` ({clé: variation}) aux compteurs, en une requête par clé."""
+    for key, delta in deltas.items():
+        if not delta:
+            continue
+        updated = StatisticCounter.objects.filter(key=key).update(value=F('value') + delta)
+        if not updated:
+            counter, created = StatisticCounter.objects.get_or_create(
+                key=key, defaults={'value': delta}
+            )
+            if not created:
+                StatisticCounter.objects.filter(key=key).update(value=F('value') + delta)
+
+
+def record_clients_created(clients):
+    """Mise à jour des compteurs pour des clients insérés par ``bulk_create``."""
+    if not materialized_enabled() or not clients:
+        return
+    deltas = Counter({CLIENTS: len(clients)})
+    deltas.update(
+        f'{COMMUNE_PREFIX}{client.lieu_naissance_id}'
+        for client in clients if client.lieu_naissance_id
+    )
+    bump(deltas)
+
+
+def record_users_created(users):
+    """Mise à jour des compteurs pour des utilisateurs insérés par ``bulk_create``."""
+    if not materialized_enabled() or not users:
+        return
+    bump({USERS: len(users), ADMINS: sum(1 for user in users if user.is_admin_commune)})
+
+
+def rebuild():
+    """Recalcule tous les compteurs à partir des tables."""
+    deltas = defaultdict(int)
+    deltas[CLIENTS] = Client.objects.count()
+    deltas[DEMANDES] = DemandeActe.objects.count()
+    users = _user_counts()
+    deltas[USERS], deltas[ADMINS] = users['users'], users['administrateurs']
+    for type_acte, n in DemandeActe.objects.order_by().values_list('type_acte').annotate(n=Count('id')):
+        deltas[f'{TYPE_PREFIX}{type_acte}'] = n
+    for commune_id, n in (
+        Client.objects.order_by().filter(lieu_naissance__isnull=False)
+        .values_list('lieu_naissance').annotate(n=Count('id'))
+    ):
+        deltas[f'{COMMUNE_PREFIX}{commune_id}'] = n
+
+    # Une seule transaction : les lecteurs ne voient jamais la table vide
+    with transaction.atomic():
+        StatisticCounter.objects.all().delete()
+        StatisticCounter.objects.bulk_create(
+            StatisticCounter(key=key, value=value) for key, value in deltas.items()
+        )
+
+
+# Colonne qui détermine le compteur de chaque modèle, en plus de son total
+COUNTED_FIELDS = {
+    Client: 'lieu_naissance',
+    DemandeActe: 'type_acte',
+    User: 'is_admin_commune',
+}
+
+
+def _stored(instance, field_name):
+    """Valeur en base de ``field_name`` avant l'écriture en cours."""
+    attname = instance._meta.get_field(field_name).attname
+    loaded = getattr(instance, '_loaded_values', None)
+    if loaded and attname in loaded:
+        return loaded[attname]
+    # Colonne différée : relue (l'instance peut porter une valeur non enregistrée)
+    return type(instance).objects.filter(pk=instance.pk).values_list(attname, flat=True).first()
+
+
+@receiver(pre_save, sender=Client)
+@receiver(pre_save, sender=DemandeActe)
+@receiver(pre_save, sender=User)
+def remember_counted_value(sender, instance, raw=False, update_fields=None, **kwargs):
+    field_name = COUNTED_FIELDS[sender]
+    if not materialized_enabled() or raw or instance._state.adding:
+        return
+    if update_fields is not None and field_name not in update_fields:
+        return
+    instance._counted_value = _stored(instance, field_name)
+
+
+@receiver(pre_delete, sender=Client)
+@receiver(pre_delete, sender=DemandeActe)
+@receiver(pre_delete, sender=User)
+def remember_deleted_value(sender, instance, **kwargs):
+    if materialized_enabled():
+        instance._counted_value = _stored(instance, COUNTED_FIELDS[sender])
+
+
+def _commune_key(commune_id):
+    return f'{COMMUNE_PREFIX}{commune_id}' if commune_id else None
+
+
+def _type_key(type_acte):
+    return f'{TYPE_PREFIX}{type_acte}' if type_acte else None
+
+
+def _admin_key(is_admin_commune):
+    return ADMINS if is_admin_commune else None
+
+
+def _moved(deltas, key_for, previous, current):
+    if key_for(previous):
+        deltas[key_for(previous)] -= 1
+    if key_for(current):
+        deltas[key_for(current)] += 1
+
+
+@receiver(post_save, sender=Client)
+def count_client_save(sender, instance, created, **kwargs):
+    if not materialized_enabled():
+        return
+    deltas = Counter()
+    if created:
+        deltas[CLIENTS] += 1
+        _moved(deltas, _commune_key, None, instance.lieu_naissance_id)
+    elif '_counted_value' in instance.__dict__:
+        _moved(deltas, _commune_key, instance.__dict__.pop('_counted_value'), instance.lieu_naissance_id)
+    bump(deltas)
+
+
+@receiver(post_delete, sender=Client)
+def count_client_delete(sender, instance, **kwargs):
+    if not materialized_enabled():
+        return
+    deltas = Counter({CLIENTS: -1})
+    _moved(deltas, _commune_key, instance.__dict__.pop('_counted_value', None), None)
+    bump(deltas)
+
+
+@receiver(post_save, sender=DemandeActe)
+def count_demande_save(sender, instance, created, **kwargs):
+    if not materialized_enabled():
+        return
+    deltas = Counter()
+    if created:
+        deltas[DEMANDES] += 1
+        _moved(deltas, _type_key, None, instance.type_acte)
+    elif '_counted_value' in instance.__dict__:
+        _moved(deltas, _type_key, instance.__dict__.pop('_counted_value'), instance.type_acte)
+    bump(deltas)
+
+
+@receiver(post_delete, sender=DemandeActe)
+def count_demande_delete(sender, instance, **kwargs):
+    if not materialized_enabled():
+        return
+    deltas = Counter({DEMANDES: -1})
+    _moved(deltas, _type_key, instance.__dict__.pop('_counted_value', None), None)
+    bump(deltas)
+
+
+@receiver(post_save, sender=User)
+def count_user_save(sender, instance, created, **kwargs):
+    if not materialized_enabled():
+        return
+    deltas = Counter()
+    if created:
+        deltas[USERS] += 1
+        _moved(deltas, _admin_key, None, instance.is_admin_commune)
+    elif '_counted_value' in instance.__dict__:
+        _moved(deltas, _admin_key, instance.__dict__.pop('_counted_value'), instance.is_admin_commune)
+    bump(deltas)
+
+
+@receiver(post_delete, sender=User)
+def count_user_delete(sender, instance, **kwargs):
+    if not materialized_enabled():
+        return
+    deltas = Counter({USERS: -1})
+    _moved(deltas, _admin_key, instance.__dict__.pop('_counted_value', None), None)
+    bump(deltas)
@@ -0,0 +1,72 @@
+"""Gestionnaires des tâches de fond (voir app/jobs.py)."""
+import os
+
+from django.conf import settings
+
+from .accounts import provision_accounts
+from .imports import Checkpoint, ImportReport, import_clients
+from .jobs import job
+from .models import Client
+from .partitions import COMMUNE_FIELDS, rebalance
+from .photos import is_processed, process_photo
+from .qrcodes import qrcode_store
+from .refcache import invalidate
+
+
+@job('client.provision_account')
+def provision_client_account(client_id):
+    """Crée ou met à jour le compte utilisateur lié à un client."""
+    provision_accounts(Client.objects.filter(pk=client_id))
+
+
+@job('client.render_qrcode')
+def render_client_qrcode(client_id):
+    """Pré-génère le QR code pour que le premier affichage soit immédiat."""
+    client = Client.objects.select_related('lieu_naissance').filter(pk=client_id).first()
+    if client is not None:
+        qrcode_store.get(client.qrcode_payload())
+
+
+@job('clients.render_qrcodes')
+def render_clients_qrcodes(client_ids):
+    for client in Client.objects.select_related('lieu_naissance').filter(pk__in=client_ids):
+        qrcode_store.get(client.qrcode_payload())
+
+
+@job('partitions.rebalance_commune')
+def rebalance_commune_partition(commune_id):
+    """Suit une commune rattachée à une autre région : ses lignes changent de partition."""
+    for model in COMMUNE_FIELDS:
+        for _ in rebalance(model, commune=commune_id):
+            pass
+    # Les processus rechargent la liste des communes en cours de réaffectation
+    invalidate()
+
+
+@job('client.process_photo')
+def process_client_photo(client_id):
+    """Redresse et réduit la photo envoyée, puis crée ses vignettes."""
+    client = Client.objects.filter(pk=client_id).only('image').first()
+    if client is None or not client.image or is_processed(client.image.name):
+        return
+    original = client.image.name
+    processed = process_photo(client.image.storage, original)
+    # Conditionnel : une photo envoyée entre-temps n'est pas écrasée
+    Client.objects.filter(pk=client_id, image=original).update(image=processed)
+
+
+@job('clients.import_file')
+def import_clients_file(token, format):
+    """Importe un fichier déposé via clients/import/ ; reprend au point de contrôle."""
+    path = os.path.join(settings.CLIENT_IMPORTS_DIR, token)
+    checkpoint = Checkpoint(f'{path}.checkpoint')
+    if checkpoint.state['done']:
+        return
+
+    with open(f'{path}.rejects.ndjson', 'a') as rejects_file, open(path, 'rb') as stream:
+        report = ImportReport(
+            rejects_file=rejects_file,
+            created=checkpoint.state['created'],
+            rejected=checkpoint.state['rejected'],
+        )
+        import_clients(stream, format, checkpoint=checkpoint, report=report)
@@ -1,3 +1,1401 @@
-from django.test import TestCase
+import base64
+import hashlib
+import os
+import tempfile
+import zipfile
+from concurrent.futures import ThreadPoolExecutor
+from datetime import date, timedelta
+from io import BytesIO, StringIO
+from pathlib import Path
+from unittest import mock
 
-# Create your tests here.
+from django.contrib.auth.hashers import make_password
+from django.core import mail
+from django.core.cache import cache
+from django.core.exceptions import ImproperlyConfigured, ValidationError
+from django.core.files.base import ContentFile
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.core.management import call_command
+from django.db import IntegrityError, connection
+from django.http import HttpResponse
+from django.template.loader import render_to_string
+from django.test import AsyncClient, RequestFactory, TestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
+from PIL import Image
+from rest_framework.test import APIClient
+from rest_framework_simplejwt.settings import api_settings
+from rest_framework_simplejwt.token_blacklist.models import BlacklistedToken, OutstandingToken
+
+from digitaratasy import databases
+
+from . import actes, jobs, mailspool, sheets, stats
+from .accounts import activation_code
+from .authentication import REVOKED
+from .imports import Checkpoint, ImportReport, import_clients
+from .bulk import create_clients, enrol_clients
+from .duplicates import block_keys, find_candidates
+from .models import Client, Commune, DemandeActe, Job, OutboundMail, Region, StatisticCounter, User
+from .photos import photo_storage
+from .qrcodes import ContentStore, QRCodeStore, qrcode_store, signing_keys
+from .refcache import commune_region_id
+from .routing import ReplicaRouter, ReplicaRoutingMiddleware, reading, sticky_key
+from .qrverify import InvalidCode, QRCodeData, encode, verify
+from .search import fts_available, search_clients
+from .serializer import MytokenObtainPairView
+from .smtpsink import SMTPSink
+from .stats import live_statistics
+from .tasks import process_client_photo, provision_client_account, rebalance_commune_partition
+from .tokens import BlacklistFilter, blacklist_filter, prune_expired, table_sizes
+from .workflow import TransitionError, claim_next, transition
+
+
+class QRCodeStoreMixin:
+    """Magasin des QR codes dans un répertoire temporaire, vidé à chaque test."""
+
+    def setUp(self):
+        super().setUp()
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        patcher = mock.patch.object(qrcode_store, 'directory', directory.name)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        qrcode_store.clear()
+
+
+class QueryBudgetMixin:
+    """Vérifie qu'un appel reste dans un budget de requêtes SQL.
+
+    Le budget ne doit pas dépendre du nombre de lignes renvoyées : chaque test
+    crée plusieurs lignes pour qu'un N+1 dépasse le budget.
+    """
+
+    def assertQueryBudget(self, budget, func, *args, **kwargs):
+        with CaptureQueriesContext(connection) as context:
+            result = func(*args, **kwargs)
+        executed = len(context.captured_queries)
+        self.assertLessEqual(
+            executed, budget,
+            f"{executed} requêtes exécutées pour un budget de {budget} :\n"
+            + "\n".join(query['sql'] for query in context.captured_queries),
+        )
+        return result
+
+    def assertEndpointBudget(self, url, budget, client=None):
+        response = self.assertQueryBudget(budget, (client or self.api).get, url)
+        self.assertEqual(response.status_code, 200)
+        return response
+
+
+@override_settings(PASSWORD_HASHERS=['django.contrib.auth.hashers.MD5PasswordHasher'])
+class EagerLoadingTests(QueryBudgetMixin, TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        regions = [Region.objects.create(nom=f'Région {i}') for i in range(3)]
+        for i in range(6):
+            admin_commune = User.objects.create_user(
+                username=f'admin{i}', email=f'admin{i}@digitaratasy.mg',
+                password='x', is_admin_commune=True,
+            )
+            Commune.objects.create(nom=f'Commune {i}', region=regions[i % 3],
+                                   admin_commune=admin_commune)
+        for i in range(5):
+            client = Client.objects.create(
+                sexe='M', nom='Rakoto', prenom=f'Jean{i}', date_naissance='1990-01-01',
+                adresse='Lot II', cin=f'CIN{i}',
+            )
+            DemandeActe.objects.create(client=client, type_acte='naissance')
+
+    def setUp(self):
+        self.api = APIClient()
+
+    def test_commune_list_budget(self):
+        response = self.assertEndpointBudget('/api/communes/', 1)
+        first = response.json()['results'][0]
+        self.assertEqual(first['region']['nom'], 'Région 0')
+        self.assertEqual(first['admin_commune']['email'], 'admin0@digitaratasy.mg')
+
+    def test_sparse_fieldset_defers_columns(self):
+        with CaptureQueriesContext(connection) as context:
+            response = self.api.get('/api/communes/?fields=id,nom')
+        self.assertEqual(set(response.json()['results'][0]), {'id', 'nom'})
+        self.assertNotIn('region_id', context.captured_queries[0]['sql'])
+        self.assertNotIn('JOIN', context.captured_queries[0]['sql'])
+
+        response = self.api.get('/api/clients/?omit=adresse,image&page_size=2')
+        self.assertEqual(len(response.json()['results']), 2)
+        self.assertNotIn('adresse', response.json()['results'][0])
+        self.assertIsNotNone(response.json()['next'])
+
+        response = self.api.get('/api/communes/?fields=inconnu')
+        self.assertEqual(response.status_code, 400)
+
+    def test_demande_list_budget(self):
+        self.assertEndpointBudget('/api/demandes-acte/', 1)
+
+    def test_admin_changelist_budget(self):
+        admin = User.objects.create_superuser(
+            username='root', email='root@digitaratasy.mg', password='x',
+        )
+        browser = self.client_class()
+        browser.force_login(admin)
+        # Session, utilisateur, comptages de la pagination et filtres : budget fixe
+        self.assertEndpointBudget('/admin/app/commune/', 8, client=browser)
+        self.assertEndpointBudget('/admin/app/demandeacte/', 8, client=browser)
+
+
+@override_settings(PASSWORD_HASHERS=['django.contrib.auth.hashers.MD5PasswordHasher'])
+class ClientSearchTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        region = Region.objects.create(nom='Analamanga')
+        cls.commune = Commune.objects.create(nom='Ambohidratrimo', region=region)
+        for cin, nom, prenom, naissance in [
+            ('101', 'Rakotonirina', 'Héry', '1990-05-01'),
+            ('102', 'Rakoto', 'Jean', '1985-01-01'),
+            ('103', 'Randrianarisoa', 'Hery Zo', '2001-03-12'),
+        ]:
+            Client.objects.create(
+                sexe='M', nom=nom, prenom=prenom, date_naissance=naissance,
+                lieu_naissance=cls.commune, adresse='Lot II', cin=cin,
+            )
+
+    def search(self, **params):
+        response = APIClient().get('/api/clients/search/', params)
+        self.assertEqual(response.status_code, 200)
+        return [row['cin'] for row in response.json()['results']]
+
+    def test_prefix_accent_insensitive(self):
+        self.assertEqual(self.search(q='rakoto hery'), ['101'])
+        self.assertEqual(sorted(self.search(q='HERY')), ['101', '103'])
+
+    def test_filters(self):
+        self.assertEqual(self.search(cin='102'), ['102'])
+        self.assertEqual(
+            sorted(self.search(q='rakoto', born_before='1989-12-31')), ['102']
+        )
+        self.assertEqual(len(self.search(commune=self.commune.pk)), 3)
+
+    def test_full_text_results_are_ranked(self):
+        queryset = search_clients(q='hery')
+        self.assertTrue(fts_available(queryset.db))
+        ranks = [client.rank for client in queryset]
+        self.assertEqual(len(ranks), 2)
+        self.assertEqual(ranks, sorted(ranks))
+
+    def test_index_follows_updates(self):
+        client = Client.objects.get(cin='102')
+        client.prenom = 'Faly'
+        client.save()
+        self.assertEqual(self.search(q='faly'), ['102'])
+        self.assertEqual(self.search(q='rakoto jean'), [])
+
+
+@override_settings(PASSWORD_HASHERS=['django.contrib.auth.hashers.MD5PasswordHasher'])
+class DuplicateDetectionTests(TestCase):
+    def test_typo_variant_is_reported_at_creation(self):
+        region = Region.objects.create(nom='Analamanga')
+        commune = Commune.objects.create(nom='Ambohidratrimo', region=region)
+        original = Client.objects.create(
+            sexe='F', nom='Razanamahefa', prenom='Voahirana', date_naissance='1992-07-14',
+            lieu_naissance=commune, adresse='Lot II', cin='201',
+        )
+        Client.objects.create(
+            sexe='F', nom='Rasoanaivo', prenom='Miora', date_naissance='1970-02-02',
+            adresse='Lot III', cin='202',
+        )
+        response = APIClient().post('/api/clients/', {
+            'sexe': 'F', 'nom': 'Razanamaheffa', 'prenom': 'Voahirane',
+            'date_naissance': '1992-07-14', 'lieu_naissance': commune.pk,
+            'adresse': 'Lot IV', 'cin': '203',
+        })
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual([c['id'] for c in response.json()['doublons_probables']], [original.pk])
+
+    def test_common_name_alone_does_not_share_a_block(self):
+        born = date(1990, 1, 1)
+        self.assertFalse(block_keys('Rakoto', 'Jean', born, None) & block_keys('Rakoto', 'Hery', born, None))
+        self.assertTrue(block_keys('Rakoto', 'Jean', born, None) & block_keys('Rakotoo', 'Jeanne', born, None))
+
+    def create_pair(self):
+        region = Region.objects.create(nom='Analamanga')
+        commune = Commune.objects.create(nom='Ambohidratrimo', region=region)
+        # Mêmes date, commune, nom et prénom proches : trois clés communes
+        return [Client.objects.create(
+            sexe='M', nom=nom, prenom='Hery', date_naissance='1991-04-04',
+            lieu_naissance=commune, adresse='Lot II', cin=cin,
+        ) for nom, cin in (('Rakotonirina', '211'), ('Rakotonirna', '212'))]
+
+    def test_each_pair_is_reported_once(self):
+        first, second = self.create_pair()
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        output = Path(directory.name) / 'paires.csv'
+        with mock.patch('app.management.commands.find_duplicates.ProcessPoolExecutor',
+                        side_effect=ThreadPoolExecutor):
+            call_command('find_duplicates', workers=2, output=str(output), stderr=StringIO())
+        rows = output.read_text().splitlines()
+        self.assertEqual(len(rows), 2)
+        self.assertTrue(rows[1].startswith(f'{first.pk},{second.pk},'))
+
+    def test_truncated_candidates_are_logged(self):
+        first, second = self.create_pair()
+        with self.assertLogs('app.duplicates', 'WARNING'):
+            self.assertEqual(len(find_candidates(Client(
+                nom='Rakotonirina', prenom='Hery', date_naissance=first.date_naissance,
+                lieu_naissance_id=first.lieu_naissance_id,
+            ), max_candidates=1)), 1)
+
+
+@override_settings(PASSWORD_HASHERS=['django.contrib.auth.hashers.MD5PasswordHasher'])
+class ClientSaveQueryTests(QueryBudgetMixin, TestCase):
+    """Nombre de requêtes d'un enregistrement de client (savepoints compris)."""
+
+    @classmethod
+    def setUpTestData(cls):
+        region = Region.objects.create(nom='Analamanga')
+        cls.commune = Commune.objects.create(nom='Ambohidratrimo', region=region)
+
+    def setUp(self):
+        # Table des communes déjà en mémoire, comme dans un processus servant
+        # des requêtes (app/refcache.py)
+        commune_region_id(self.commune.pk)
+
+    def new_client(self, **fields):
+        return Client(**{
+            'sexe': 'M', 'nom': 'Rakoto', 'prenom': 'Jean', 'date_naissance': '1990-01-01',
+            'lieu_naissance': self.commune, 'adresse': 'Lot II', 'cin': '301', **fields,
+        })
+
+    def test_create(self):
+        # Savepoint, commune, INSERT client, clés de blocage, tâches (insertion
+        # puis remise en attente), release
+        self.assertQueryBudget(7, self.new_client().save)
+
+    def test_update_only_writes_changed_columns(self):
+        self.new_client().save()
+        client = Client.objects.get(cin='301')
+        client.adresse = 'Lot III'
+        with CaptureQueriesContext(connection) as context:
+            client.save()
+        updates = [q['sql'] for q in context.captured_queries if q['sql'].startswith('UPDATE')]
+        self.assertEqual(len(context.captured_queries), 3)  # Savepoint, UPDATE, release
+        self.assertNotIn('"nom"', updates[0])
+        self.assertEqual(Client.objects.get(cin='301').adresse, 'Lot III')
+
+    def test_update_of_name_requeues_jobs(self):
+        self.new_client().save()
+        client = Client.objects.get(cin='301')
+        client.prenom = 'Paul'
+        # Savepoint, UPDATE, clés de blocage (suppression + ajout), tâches
+        # (insertion puis remise en attente), release
+        self.assertQueryBudget(7, client.save)
+
+    def test_unchanged_save_is_free(self):
+        self.new_client().save()
+        client = Client.objects.get(cin='301')
+        self.assertQueryBudget(0, client.save)
+
+    def test_explicit_update_fields_are_written(self):
+        self.new_client().save()
+        client = Client.objects.get(cin='301')
+        # Modifiée par une autre requête : l'instance chargée ne voit aucun changement
+        Client.objects.filter(pk=client.pk).update(adresse='Lot IX')
+        with CaptureQueriesContext(connection) as context:
+            client.save(update_fields=['adresse'])
+        self.assertTrue(any(q['sql'].startswith('UPDATE') for q in context.captured_queries))
+        self.assertEqual(Client.objects.get(cin='301').adresse, 'Lot II')
+
+    def test_explicit_update_fields_include_derived_columns(self):
+        self.new_client().save()
+        client = Client.objects.get(cin='301')
+        issued_at = client.qrcode_emis_le
+        region = Region.objects.create(nom='Vakinankaratra')
+        client.lieu_naissance = Commune.objects.create(nom='Antsirabe', region=region)
+        client.save(update_fields=['lieu_naissance'])
+        stored = Client.objects.get(cin='301')
+        self.assertEqual(stored.region_id, region.pk)
+        self.assertGreater(stored.qrcode_emis_le, issued_at)
+
+    def test_duplicate_cin_is_a_validation_error(self):
+        self.new_client().save()
+        with self.assertRaises(ValidationError):
+            self.new_client(prenom='Paul').save()
+
+
+class ReferenceDataCacheTests(QueryBudgetMixin, TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.region = Region.objects.create(nom='Analamanga')
+        cls.commune = Commune.objects.create(nom='Antananarivo', region=cls.region)
+
+    def setUp(self):
+        self.api = APIClient()
+
+    def test_etag_and_not_modified(self):
+        first = self.api.get('/api/communes/')
+        etag = first['ETag']
+        self.assertTrue(etag.startswith('"'))
+        second = self.assertEndpointBudget('/api/communes/', 0)
+        self.assertEqual(second['ETag'], etag)
+
+        response = self.api.get('/api/communes/', HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 304)
+
+    def test_write_invalidates(self):
+        etag = self.api.get(f'/api/regions/{self.region.pk}/')['ETag']
+        self.region.nom = 'Analamanga (modifiée)'
+        self.region.save()
+
+        response = self.api.get(f'/api/regions/{self.region.pk}/', HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json()['nom'], 'Analamanga (modifiée)')
+        self.assertEqual(str(self.commune), 'Antananarivo (Analamanga (modifiée))')
+
+    def test_change_in_another_process_is_seen_after_check_interval(self):
+        from . import refcache
+        self.assertEqual(refcache.commune_name(self.commune.pk), 'Antananarivo')
+        # Un autre worker renomme la commune : seule la génération partagée change
+        Commune.objects.filter(pk=self.commune.pk).update(nom='Tana')
+        refcache.bump_generation()
+        self.assertEqual(refcache.commune_name(self.commune.pk), 'Antananarivo')
+        with override_settings(REFDATA_CHECK_INTERVAL=0):
+            self.assertEqual(refcache.commune_name(self.commune.pk), 'Tana')
+
+
+@override_settings(PASSWORD_HASHERS=['django.contrib.auth.hashers.MD5PasswordHasher'])
+class ClaimsAuthenticationTests(QueryBudgetMixin, TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user(
+            username='agent', email='agent@digitaratasy.mg', password='secret', is_staff=True,
+        )
+        token = MytokenObtainPairView.get_token(self.user).access_token
+        self.api = APIClient()
+        self.api.credentials(HTTP_AUTHORIZATION=f'Bearer {token}')
+
+    def test_authenticated_request_reads_no_user_row(self):
+        self.api.get('/api/jobs/')
+        with CaptureQueriesContext(connection) as context:
+            self.api.get('/api/jobs/')
+        self.assertFalse(any('app_user' in query['sql'] for query in context.captured_queries))
+
+    def test_password_change_and_deactivation_revoke_tokens(self):
+        response = self.api.post('/api/change-password/',
+                                 {'old_password': 'secret', 'new_password': 'n0uveau-Secret'})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(self.api.get('/api/jobs/').status_code, 401)
+
+        self.user.refresh_from_db()
+        token = MytokenObtainPairView.get_token(self.user).access_token
+        self.api.credentials(HTTP_AUTHORIZATION=f'Bearer {token}')
+        self.assertEqual(self.api.get('/api/jobs/').status_code, 200)
+        self.user.is_active = False
+        self.user.save()
+        self.assertEqual(self.api.get('/api/jobs/').status_code, 401)
+
+    def test_staff_removal_revokes_tokens(self):
+        self.assertEqual(self.api.get('/api/jobs/').status_code, 200)
+        self.user.is_staff = False
+        self.user.save()
+        response = self.api.get('/api/jobs/')
+        self.assertEqual(response.status_code, 401)
+        self.assertEqual(response.json()['detail'], REVOKED['permissions_changed'])
+
+    def test_commune_admin_or_client_role_change_revokes_tokens(self):
+        self.user.is_admin_commune = True
+        self.user.save()
+        token = MytokenObtainPairView.get_token(self.user).access_token
+        self.api.credentials(HTTP_AUTHORIZATION=f'Bearer {token}')
+        self.assertEqual(self.api.get('/api/jobs/').status_code, 200)
+        self.user.is_admin_commune = False
+        self.user.save()
+        self.assertEqual(self.api.get('/api/jobs/').status_code, 401)
+
+        token = MytokenObtainPairView.get_token(self.user).access_token
+        self.api.credentials(HTTP_AUTHORIZATION=f'Bearer {token}')
+        self.user.is_client = True
+        self.user.save()
+        response = self.api.get('/api/jobs/')
+        self.assertEqual(response.status_code, 401)
+        self.assertEqual(response.json()['detail'], REVOKED['permissions_changed'])
+
+    def test_token_without_revoke_claim_is_accepted(self):
+        # Jeton émis avant l'activation de CHECK_REVOKE_TOKEN
+        token = MytokenObtainPairView.get_token(self.user).access_token
+        del token[api_settings.REVOKE_TOKEN_CLAIM]
+        self.api.credentials(HTTP_AUTHORIZATION=f'Bearer {token}')
+        self.assertEqual(self.api.get('/api/jobs/').status_code, 200)
+
+
+@override_settings(
+    PASSWORD_HASHERS=['app.hashers.PBKDF2SHA512PasswordHasher',
+                      'django.contrib.auth.hashers.MD5PasswordHasher'],
+    PASSWORD_PBKDF2_SHA512_ITERATIONS=1000,
+)
+class LoginTests(TestCase):
+    def test_login_upgrades_hash_and_tracks_last_login(self):
+        user = User.objects.create(
+            username='agent', email='agent@digitaratasy.mg',
+            password=make_password('secret', hasher='md5'),
+        )
+        response = APIClient().post('/api/token/', {'email': user.email, 'password': 'secret'})
+        self.assertEqual(response.status_code, 200)
+        self.assertIn('access', response.json())
+
+        user.refresh_from_db()
+        self.assertTrue(user.password.startswith('pbkdf2_sha512$1000$'))
+        self.assertIsNotNone(user.last_login)
+
+        response = APIClient().post('/api/token/', {'email': user.email, 'password': 'faux'})
+        self.assertEqual(response.status_code, 401)
+
+
+# Cache propre aux tests qui appellent des points d'entrée limités en débit :
+# le cache fichier par défaut garderait les compteurs d'une exécution à l'autre
+LOCAL_CACHES = {'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+                            'LOCATION': 'tests'}}
+
+
+@override_settings(PASSWORD_HASHERS=['django.contrib.auth.hashers.MD5PasswordHasher'],
+                   CACHES=LOCAL_CACHES)
+class AccountProvisioningTests(QueryBudgetMixin, TestCase):
+    def setUp(self):
+        cache.clear()
+
+    def rows(self, count):
+        return [
+            {'sexe': 'F', 'nom': 'Rasoa', 'prenom': f'Miora{i}', 'date_naissance': '1992-03-04',
+             'adresse': 'Lot III', 'cin': f'50{i}'}
+            for i in range(count)
+        ]
+
+    def test_batch_provisioning_cost_does_not_depend_on_size(self):
+        with CaptureQueriesContext(connection) as small:
+            enrol_clients(self.rows(2))
+        with CaptureQueriesContext(connection) as large:
+            enrol_clients(self.rows(20)[2:])
+        self.assertEqual(len(small.captured_queries), len(large.captured_queries))
+        self.assertFalse(User.objects.filter(is_client=True).exclude(password__startswith='!').exists())
+
+    def test_activation_code_is_single_use(self):
+        enrol_clients(self.rows(1))
+        user = User.objects.get(client_linked__cin='500')
+        code = activation_code(user)
+        self.assertEqual(len(code), 8)
+
+        api = APIClient()
+        payload = {'cin': '500', 'activation_code': 'AAAAAAAA', 'new_password': 'Mot-de-passe-1'}
+        self.assertEqual(api.post('/api/activate-account/', payload).status_code, 400)
+        payload['activation_code'] = code.lower()
+        self.assertEqual(api.post('/api/activate-account/', payload).status_code, 200)
+        self.assertEqual(api.post('/api/activate-account/', payload).status_code, 400)
+
+        user.refresh_from_db()
+        self.assertTrue(user.check_password('Mot-de-passe-1'))
+        self.assertIsNone(activation_code(user))
+
+    def test_activation_attempts_are_throttled(self):
+        api = APIClient()
+        payload = {'cin': '500', 'activation_code': 'AAAAAAAA', 'new_password': 'Mot-de-passe-1'}
+        for _ in range(10):
+            self.assertEqual(api.post('/api/activate-account/', payload).status_code, 400)
+        self.assertEqual(api.post('/api/activate-account/', payload).status_code, 429)
+
+    def test_single_client_job_follows_cin_change(self):
+        client = Client.objects.create(sexe='M', nom='Rabe', prenom='Hery',
+                                       date_naissance='1990-01-01', adresse='Lot I', cin='600')
+        provision_client_account(client.pk)
+        client.cin = '601'
+        client.save()
+        provision_client_account(client.pk)
+        user = User.objects.get(client_linked=client)
+        self.assertEqual(user.email, 'client_601@digitaratasy.mg')
+        self.assertIsNotNone(activation_code(user))
+
+
+@override_settings(PASSWORD_HASHERS=['django.contrib.auth.hashers.MD5PasswordHasher'])
+class TokenBlacklistTests(TestCase):
+    def setUp(self):
+        blacklist_filter.reset()
+        self.user = User.objects.create_user(
+            username='agent', email='agent@digitaratasy.mg', password='secret',
+        )
+        self.api = APIClient()
+
+    def refresh(self, token):
+        return self.api.post('/api/token/refresh/', {'refresh': token})
+
+    def test_rotation_skips_lookup_and_rejects_replay(self):
+        first = str(MytokenObtainPairView.get_token(self.user))
+        response = self.refresh(first)
+        self.assertEqual(response.status_code, 200)
+        second = response.json()['refresh']
+        self.assertEqual(self.refresh(second).status_code, 200)
+        self.assertEqual(blacklist_filter.stats['db_checks'], 0)
+
+        # Rejeu : refusé par le filtre, ou par la mise en liste noire s'il est en retard
+        self.assertEqual(self.refresh(first).status_code, 401)
+        blacklist_filter.reset()
+        self.assertEqual(self.refresh(first).status_code, 401)
+        self.assertEqual(blacklist_filter.stats['blacklisted'], 1)
+
+    def blacklisted(self, jti, expires_in):
+        token = OutstandingToken.objects.create(
+            user=self.user, jti=jti, token=jti, created_at=timezone.now(),
+            expires_at=timezone.now() + expires_in,
+        )
+        BlacklistedToken.objects.create(token=token)
+
+    def test_sync_reads_only_new_live_tokens(self):
+        blacklist_filter.sync(force=True)
+        self.assertIsNotNone(blacklist_filter.last_read)
+        self.blacklisted('expire', -timedelta(days=1))
+        self.blacklisted('vivant', timedelta(days=1))
+        blacklist_filter.sync(force=True)
+        # Lecture incrémentale même si la liste noire était vide
+        self.assertEqual(blacklist_filter.stats['rebuilds'], 1)
+        self.assertEqual(blacklist_filter.stats['syncs'], 2)
+        self.assertIn('vivant', blacklist_filter.bloom)
+        self.assertNotIn('expire', blacklist_filter.bloom)
+
+        # Le verrou des compteurs est libre pendant la lecture en base
+        held = []
+        original = BlacklistFilter._jtis
+
+        def jtis(queryset):
+            held.append(blacklist_filter._lock.locked())
+            return original(queryset)
+
+        with mock.patch.object(BlacklistFilter, '_jtis', staticmethod(jtis)):
+            blacklist_filter.sync(force=True)
+        self.assertEqual(held, [False])
+
+    def test_prune_expired(self):
+        token = MytokenObtainPairView.get_token(self.user)
+        self.refresh(str(token))
+        OutstandingToken.objects.update(expires_at=timezone.now() - timedelta(days=1))
+        self.assertEqual(prune_expired(batch_size=1), 2)
+        self.assertEqual(table_sizes()['blacklisted'], 0)
+
+
+class DemandeWorkflowTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        region = Region.objects.create(nom='Analamanga')
+        cls.communes = [Commune.objects.create(nom=f'Commune {i}', region=region) for i in range(2)]
+        cls.agents = [User.objects.create(username=f'agent{i}', email=f'agent{i}@digitaratasy.mg')
+                      for i in range(2)]
+        for i in range(6):
+            client = Client.objects.create(
+                sexe='F', nom='Rasoa', prenom=f'Miora{i}', date_naissance='1992-03-04',
+                lieu_naissance=cls.communes[i % 2], adresse='Lot III', cin=f'70{i}',
+            )
+            DemandeActe.objects.create(client=client, type_acte='naissance')
+
+    def test_claims_are_disjoint_and_follow_the_commune_queue(self):
+        commune = self.communes[0]
+        first = claim_next(self.agents[0], limit=2, commune=commune)
+        second = claim_next(self.agents[1], limit=2, commune=commune)
+        self.assertEqual(len(first), 2)
+        self.assertEqual(len(second), 1)
+        self.assertFalse(set(first) & set(second))
+        self.assertEqual(
+            DemandeActe.objects.filter(pk__in=first + second, commune=commune,
+                                       statut=DemandeActe.Statut.EN_COURS).count(), 3
+        )
+
+    def test_transitions(self):
+        demande = DemandeActe.objects.get(pk=claim_next(self.agents[0])[0])
+        with self.assertRaises(TransitionError):
+            transition(demande, DemandeActe.Statut.DELIVREE)
+        transition(demande, DemandeActe.Statut.TRAITEE)
+
+        stale = DemandeActe.objects.get(pk=demande.pk)
+        transition(demande, DemandeActe.Statut.DELIVREE)
+        stale.statut = DemandeActe.Statut.EN_COURS
+        with self.assertRaises(TransitionError):
+            transition(stale, DemandeActe.Statut.REJETEE)
+
+    def test_api(self):
+        api = APIClient()
+        api.force_authenticate(self.agents[0])
+        response = api.post('/api/demandes-acte/claim/', {'limit': 2, 'commune': self.communes[1].pk})
+        self.assertEqual([d['statut'] for d in response.json()], ['en cours', 'en cours'])
+        url = f"/api/demandes-acte/{response.json()[0]['id']}/transition/"
+        self.assertEqual(api.post(url, {'statut': 'delivree'}).status_code, 409)
+        self.assertEqual(api.post(url, {'statut': 'traitee'}).json()['statut'], 'traitee')
+        self.assertEqual(len(api.get('/api/demandes-acte/?statut=en attente').json()['results']), 4)
+
+    def test_clients_and_other_agents_cannot_move_a_demande(self):
+        ids = claim_next(self.agents[0], limit=1)
+        url = f"/api/demandes-acte/{ids[0]}/transition/"
+        api = APIClient()
+        api.force_authenticate(User.objects.create(username='citoyen', email='citoyen@digitaratasy.mg',
+                                                   is_client=True))
+        self.assertEqual(api.post('/api/demandes-acte/claim/', {'limit': 1}).status_code, 403)
+        self.assertEqual(api.post(url, {'statut': 'traitee'}).status_code, 403)
+
+        api.force_authenticate(self.agents[1])
+        for statut in ('traitee', 'en attente', 'rejetee'):
+            self.assertEqual(api.post(url, {'statut': statut}).status_code, 409)
+        self.assertEqual(DemandeActe.objects.get(pk=ids[0]).statut, DemandeActe.Statut.EN_COURS)
+
+
+class ActeRenderingTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        region = Region.objects.create(nom='Analamanga')
+        commune = cls.commune = Commune.objects.create(nom='Antsirabe', region=region)
+        for i in range(3):
+            client = Client.objects.create(
+                sexe='M', nom='Rabe', prenom=f'Faly{i}', date_naissance='1985-07-01',
+                lieu_naissance=commune, adresse='Lot IV', cin=f'80{i}',
+            )
+            DemandeActe.objects.create(client=client, type_acte='naissance',
+                                       statut=DemandeActe.Statut.TRAITEE)
+
+    def setUp(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        patcher = mock.patch.object(actes.acte_store, 'directory', directory.name)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        actes.acte_store.clear()
+
+    def test_reprint_of_unchanged_data_is_cached(self):
+        demandes = list(actes.printable_demandes())
+        with mock.patch('app.actes.render_acte', wraps=actes.render_acte) as render:
+            entries = actes.render_demandes(demandes)
+            actes.render_demandes(demandes)
+        self.assertEqual(render.call_count, 3)
+        self.assertTrue(actes.acte_store.load(entries[0][1]).startswith(b'%PDF'))
+
+        demandes[0].client.adresse = 'Lot V'
+        self.assertNotEqual(actes.acte_key(actes.acte_data(demandes[0])), entries[0][1])
+
+    def test_zip_download_is_streamed(self):
+        api = APIClient()
+        api.force_authenticate(User.objects.create(username='agent', email='agent@digitaratasy.mg'))
+        self.assertEqual(api.get('/api/demandes-acte/actes.zip/').status_code, 400)
+        response = api.get('/api/demandes-acte/actes.zip/', {'commune': self.commune.pk})
+        self.assertTrue(response.streaming)
+        archive = zipfile.ZipFile(BytesIO(b''.join(response.streaming_content)))
+        self.assertEqual(len(archive.namelist()), 3)
+        self.assertTrue(archive.read(archive.namelist()[0]).startswith(b'%PDF'))
+
+        api.force_authenticate(User.objects.create(username='citoyen', email='citoyen@digitaratasy.mg',
+                                                   is_client=True))
+        response = api.get('/api/demandes-acte/actes.zip/', {'commune': self.commune.pk})
+        self.assertEqual(response.status_code, 403)
+
+    def test_zip_batches_share_one_pool(self):
+        with mock.patch('app.actes.ProcessPoolExecutor', side_effect=ThreadPoolExecutor) as pools:
+            chunks = list(actes.stream_zip(actes.printable_demandes(), batch_size=2, workers=2))
+        self.assertEqual(pools.call_count, 1)
+        self.assertEqual(len(zipfile.ZipFile(BytesIO(b''.join(chunks))).namelist()), 3)
+
+
+class ClientPhotoTests(TestCase):
+    def setUp(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        override = override_settings(MEDIA_ROOT=directory.name)
+        override.enable()
+        self.addCleanup(override.disable)
+
+    def upload(self, cin):
+        buffered = BytesIO()
+        Image.new('RGB', (2400, 1200), 'red').save(buffered, format='JPEG')
+        client = Client(sexe='F', nom='Rasoa', prenom='Voahirana', date_naissance='1995-05-05',
+                        adresse='Lot VI', cin=cin)
+        client.image = SimpleUploadedFile('photo.jpg', buffered.getvalue())
+        client.save()
+        return client
+
+    def test_duplicate_uploads_share_a_blob_and_get_thumbnails(self):
+        first, second = self.upload('901'), self.upload('902')
+        self.assertEqual(first.image.name, second.image.name)
+        self.assertTrue(first.image.name.startswith('client_images/o/'))
+
+        process_client_photo(first.pk)
+        first.refresh_from_db()
+        with Image.open(first.image.path) as image:
+            self.assertEqual(image.size, (1600, 800))
+
+        response = APIClient().get('/api/clients/')
+        row = next(r for r in response.json()['results'] if r['id'] == first.pk)
+        self.assertNotIn('image', row)
+        self.assertTrue(row['thumbnails']['petite'].endswith('-petite.jpg'))
+        other = next(r for r in response.json()['results'] if r['id'] == second.pk)
+        self.assertIsNone(other['thumbnails'])
+        self.assertIn('image', APIClient().get(f'/api/clients/{first.pk}/').json())
+
+
+    def test_concurrent_upload_of_the_same_blob_keeps_the_existing_file(self):
+        storage = photo_storage()
+        name = 'client_images/o/ab/abcd.jpg'
+        storage.save(name, ContentFile(b'photo'))
+        # Même hash publié entre le contrôle d'existence et l'écriture
+        self.assertEqual(storage._save(name, ContentFile(b'photo')), name)
+        self.assertEqual(sorted(os.listdir(os.path.dirname(storage.path(name)))), ['abcd.jpg'])
+
+class QRCodeVerificationTests(QRCodeStoreMixin, TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        region = Region.objects.create(nom='Atsinanana')
+        commune = Commune.objects.create(nom='Toamasina', region=region)
+        cls.client_obj = Client.objects.create(
+            sexe='M', nom='Rabe', prenom='Hery', date_naissance='1988-03-14',
+            lieu_naissance=commune, adresse='Lot VII', cin='501012345678',
+        )
+
+    def test_signed_payload_round_trip_and_tampering(self):
+        code = self.client_obj.qrcode_payload()
+        self.assertLessEqual(len(code), 90)  # Version 4, correction M
+        keys, _ = signing_keys()
+        data = verify(code, keys)
+        self.assertEqual((data.client_id, data.cin), (self.client_obj.pk, '501012345678'))
+        self.assertEqual(str(data.date_naissance), '1988-03-14')
+
+        tampered = code[:8] + ('A' if code[8] != 'A' else 'B') + code[9:]
+        with self.assertRaises(InvalidCode):
+            verify(tampered, keys)
+
+    def test_dates_outside_the_packed_range_and_non_ascii_digits(self):
+        keys, _ = signing_keys()
+        for born in (date(1899, 12, 31), date(2080, 1, 1)):
+            data = QRCodeData(7, '١٢٣', born, 0, 0)
+            decoded = verify(encode(data, keys[0]), keys)
+            self.assertEqual(decoded, data)
+
+    def test_batch_endpoint_flags_superseded_codes(self):
+        issued = self.client_obj.qrcode_emis_le - timedelta(days=1)
+        Client.objects.filter(pk=self.client_obj.pk).update(qrcode_emis_le=issued)
+        client = Client.objects.get(pk=self.client_obj.pk)
+        old = client.qrcode_payload()
+        client.cin = '501012345679'
+        client.save()
+        new = client.qrcode_payload()
+
+        response = APIClient().post('/api/qrcodes/verify/', {'codes': [new, old, 'DR:XYZ']}, format='json')
+        results = response.json()['resultats']
+        self.assertEqual([r['valide'] for r in results], [True, False, False])
+        self.assertEqual(results[1]['erreur'], 'Code remplacé')
+        single = APIClient().post('/api/qrcodes/verify/', {'code': new}, format='json').json()
+        self.assertEqual(single['cin'], '501012345679')
+
+
+    def test_forged_code_with_an_out_of_range_date_is_invalid(self):
+        body = (bytes([2 << 4]) + (1).to_bytes(4, 'big') + bytes([1]) + (5).to_bytes(6, 'big')
+                + (2 ** 31 - 1).to_bytes(4, 'big') + bytes(8))
+        forged = 'DR:' + base64.b32encode(body + bytes(16)).decode().rstrip('=')
+        response = APIClient().post('/api/qrcodes/verify/', {'codes': [forged]}, format='json')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual([r['valide'] for r in response.json()['resultats']], [False])
+
+class QRSheetTests(QRCodeStoreMixin, TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        region = Region.objects.create(nom='Vakinankaratra')
+        cls.commune = Commune.objects.create(nom='Antsirabe', region=region)
+        Client.objects.bulk_create(
+            Client(sexe='F', nom=f'Rasoa{i:02d}', prenom='Lalao', date_naissance='2001-01-01',
+                   lieu_naissance=cls.commune, region=region, adresse='Lot VIII', cin=f'70{i:04d}')
+            for i in range(13)
+        )
+
+    def setUp(self):
+        super().setUp()
+        self.api = APIClient()
+        self.api.force_authenticate(User.objects.create(username='agent', email='agent@digitaratasy.mg'))
+
+    def test_pdf_sheets_are_streamed_page_by_page(self):
+        response = self.api.get('/api/clients/planches-qr/', {'commune': self.commune.pk})
+        self.assertEqual(response['Content-Type'], 'application/pdf')
+        pdf = b''.join(response.streaming_content)
+        self.assertTrue(pdf.startswith(b'%PDF-1.4'))
+        self.assertIn(b'/Type /Pages /Kids [5 0 R 8 0 R] /Count 2', pdf)
+        self.assertTrue(pdf.endswith(b'%%EOF\n'))
+
+    def test_png_sheets(self):
+        response = self.api.get('/api/clients/planches-qr/', {'commune': self.commune.pk, 'type': 'png'})
+        archive = zipfile.ZipFile(BytesIO(b''.join(response.streaming_content)))
+        self.assertEqual(archive.namelist(), ['planche-00001.png', 'planche-00002.png'])
+        with Image.open(BytesIO(archive.read('planche-00001.png'))) as page:
+            self.assertEqual(page.size, sheets.PAGE_SIZE)
+
+
+    def test_clients_cannot_generate_sheets(self):
+        self.api.force_authenticate(User.objects.create(username='citoyen', email='citoyen@digitaratasy.mg',
+                                                        is_client=True))
+        self.assertEqual(self.api.get('/api/clients/planches-qr/').status_code, 403)
+
+@override_settings(DATABASE_REPLICAS={'reads': ['reads_replica_1'], 'analytics': []})
+class ReplicaRoutingTests(TestCase):
+    def test_reads_use_replicas_until_the_author_writes(self):
+        router = ReplicaRouter()
+        with reading('analytics', who='addr:127.0.0.1'):
+            self.assertEqual(router.db_for_read(Client), 'reads_replica_1')
+            self.assertEqual(router.db_for_write(Client), 'default')
+        self.assertEqual(router.db_for_read(Client), 'default')
+
+        def write(request):
+            router.db_for_write(Client)
+            return HttpResponse()
+
+        self.addCleanup(cache.delete, sticky_key('addr:127.0.0.1'))
+        ReplicaRoutingMiddleware(write)(RequestFactory().post('/api/clients/'))
+        with reading('reads', who='addr:127.0.0.1'):
+            self.assertEqual(router.db_for_read(Client), 'default')
+        with reading('reads', who='addr:10.0.0.2'):
+            self.assertEqual(router.db_for_read(Client), 'reads_replica_1')
+
+
+class PartitionTests(QRCodeStoreMixin, TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.north = Region.objects.create(nom='Diana')
+        cls.south = Region.objects.create(nom='Atsimo-Andrefana')
+        cls.commune = Commune.objects.create(nom='Ambilobe', region=cls.north)
+        cls.client_obj = Client.objects.create(
+            sexe='F', nom='Soa', prenom='Fara', date_naissance='1999-09-09',
+            lieu_naissance=cls.commune, adresse='Lot IX', cin='801',
+        )
+        cls.demande = DemandeActe.objects.create(client=cls.client_obj, type_acte='naissance')
+
+    def test_commune_queries_are_scoped_to_the_region_partition(self):
+        self.assertEqual(self.client_obj.region_id, self.north.pk)
+        self.assertEqual(self.demande.region_id, self.north.pk)
+        with CaptureQueriesContext(connection) as context:
+            response = APIClient().get('/api/clients/', {'commune': self.commune.pk})
+        self.assertEqual([row['id'] for row in response.json()['results']], [self.client_obj.pk])
+        listing = next(q['sql'] for q in context.captured_queries if 'FROM "app_client"' in q['sql'])
+        self.assertIn('"app_client"."region_id" = ', listing)
+        with CaptureQueriesContext(connection) as context:
+            APIClient().get('/api/clients/', {'commune': self.commune.pk})
+        self.assertFalse(any('"app_job"' in q['sql'] for q in context.captured_queries))
+
+    def test_moved_commune_is_rebalanced_and_counted_nationally(self):
+        self.commune.region = self.south
+        self.commune.save()
+        rebalance_commune_partition(self.commune.pk)
+        self.assertEqual(Client.objects.get(pk=self.client_obj.pk).region_id, self.south.pk)
+        self.assertEqual(DemandeActe.objects.get(pk=self.demande.pk).region_id, self.south.pk)
+        per_region = {row['region']: row['count'] for row in live_statistics()['clients_par_region']}
+        self.assertEqual(per_region, {'Diana': 0, 'Atsimo-Andrefana': 1})
+
+    def test_moved_commune_is_listed_before_the_rebalance(self):
+        self.commune.region = self.south
+        self.commune.save()
+        job = Job.objects.get(kind='partitions.rebalance_commune')
+        api = APIClient()
+        with CaptureQueriesContext(connection) as context:
+            response = api.get('/api/clients/', {'commune': self.commune.pk})
+        self.assertEqual([row['id'] for row in response.json()['results']], [self.client_obj.pk])
+        listing = next(q['sql'] for q in context.captured_queries if 'FROM "app_client"' in q['sql'])
+        self.assertNotIn('"app_client"."region_id" = ', listing)
+
+        with self.captureOnCommitCallbacks(execute=True):
+            jobs.run_pending()
+        self.assertEqual(Job.objects.get(pk=job.pk).status, Job.Statut.TERMINE)
+        with CaptureQueriesContext(connection) as context:
+            response = api.get('/api/clients/', {'commune': self.commune.pk})
+        self.assertEqual([row['id'] for row in response.json()['results']], [self.client_obj.pk])
+        listing = next(q['sql'] for q in context.captured_queries if 'FROM "app_client"' in q['sql'])
+        self.assertIn('"app_client"."region_id" = ', listing)
+
+    def test_commune_missing_from_the_reference_cache_is_read_from_the_database(self):
+        commune_region_id(self.commune.pk)  # Table des communes chargée sans la nouvelle
+        commune = Commune.objects.create(nom='Ambanja', region=self.north)
+        client = Client.objects.create(
+            sexe='M', nom='Rabe', prenom='Koto', date_naissance='1990-01-01',
+            lieu_naissance=commune, adresse='Lot X', cin='802',
+        )
+        self.assertEqual(client.region_id, self.north.pk)
+        response = APIClient().get('/api/clients/', {'commune': commune.pk})
+        self.assertEqual([row['id'] for row in response.json()['results']], [client.pk])
+
+    def test_rows_without_partition_key_stay_in_their_region(self):
+        Client.objects.filter(pk=self.client_obj.pk).update(region=None)
+        api = APIClient()
+        for params in ({'region': self.north.pk}, {'commune': self.commune.pk}):
+            response = api.get('/api/clients/', params)
+            self.assertEqual([row['id'] for row in response.json()['results']], [self.client_obj.pk])
+        response = api.get('/api/clients/', {'region': self.south.pk})
+        self.assertEqual(response.json()['results'], [])
+
+    def test_rename_does_not_rebalance(self):
+        self.commune.nom = 'Ambilobe-Ville'
+        self.commune.save()
+        self.assertFalse(Job.objects.filter(kind='partitions.rebalance_commune').exists())
+
+
+@override_settings(CACHES=LOCAL_CACHES)
+class AsyncViewTests(QRCodeStoreMixin, TestCase):
+    def setUp(self):
+        super().setUp()
+        cache.clear()
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.client_obj = Client.objects.create(
+            sexe='M', nom='Rado', prenom='Tiana', date_naissance='1993-03-03',
+            adresse='Lot X', cin='901',
+        )
+        User.objects.create(username='rado', email='rado@digitaratasy.mg')
+
+    async def test_async_routes_match_the_synchronous_ones(self):
+        client = AsyncClient()
+        response = await client.get(f'/api/async/clients/{self.client_obj.pk}/')
+        self.assertEqual(response.json()['cin'], '901')
+        self.assertEqual((await client.get('/api/async/clients/0/')).status_code, 404)
+
+        response = await client.get(f'/api/async/clients/{self.client_obj.pk}/qrcode.png')
+        self.assertEqual(response['Content-Type'], 'image/png')
+        revalidated = await client.get(f'/api/async/clients/{self.client_obj.pk}/qrcode.png',
+                                       headers={'If-None-Match': response['ETag']})
+        self.assertEqual(revalidated.status_code, 304)
+
+        response = await client.post('/api/async/forgot-password/', {'email': 'rado@digitaratasy.mg'},
+                                     content_type='application/json')
+        self.assertEqual(response.status_code, 200)
+        user = await User.objects.aget(email='rado@digitaratasy.mg')
+        queued = await OutboundMail.objects.aget(to='rado@digitaratasy.mg')
+        self.assertIn(user.reset_pin, queued.body)
+
+
+    async def test_forgot_password_rejects_non_string_emails(self):
+        client = AsyncClient()
+        for email in (5, ['a'], {'a': 1}, None):
+            response = await client.post('/api/async/forgot-password/', {'email': email},
+                                         content_type='application/json')
+            self.assertEqual(response.status_code, 400)
+
+    async def test_forgot_password_is_throttled(self):
+        client = AsyncClient()
+        for _ in range(5):
+            response = await client.post('/api/async/forgot-password/', {'email': 'x@digitaratasy.mg'},
+                                         content_type='application/json')
+            self.assertEqual(response.status_code, 400)
+        response = await client.post('/api/async/forgot-password/', {'email': 'x@digitaratasy.mg'},
+                                     content_type='application/json')
+        self.assertEqual(response.status_code, 429)
+        self.assertIn('Retry-After', response)
+
+@override_settings(CACHES=LOCAL_CACHES)
+class MailSpoolTests(TestCase):
+    def setUp(self):
+        cache.clear()
+
+    def smtp(self, sink):
+        return override_settings(
+            EMAIL_BACKEND='django.core.mail.backends.smtp.EmailBackend',
+            EMAIL_HOST=sink.host, EMAIL_PORT=sink.port,
+        )
+
+    def test_forgot_password_queues_the_pin_without_sending(self):
+        User.objects.create(username='agent', email='agent@digitaratasy.mg')
+        response = APIClient().post('/api/forgot-password/', {'email': 'agent@digitaratasy.mg'}, format='json')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(mail.outbox, [])
+        user = User.objects.get(email='agent@digitaratasy.mg')
+        self.assertGreater(user.pin_expires_at, timezone.now())
+        queued = OutboundMail.objects.get()
+        self.assertEqual((queued.to, queued.status), (user.email, OutboundMail.Statut.EN_ATTENTE))
+        self.assertIn(user.reset_pin, queued.body)
+
+    def test_batch_is_sent_over_one_connection(self):
+        for number in range(3):
+            mailspool.spool(f'client{number}@digitaratasy.mg', 'PIN', f'Code {number}')
+        with SMTPSink() as sink, self.smtp(sink):
+            self.assertEqual(mailspool.deliver(), (3, 0))
+        self.assertEqual(sink.connections, 1)
+        self.assertEqual([message['to'] for message in sink.messages],
+                         [[f'client{number}@digitaratasy.mg'] for number in range(3)])
+        self.assertFalse(OutboundMail.objects.exclude(status=OutboundMail.Statut.ENVOYE).exists())
+        self.assertFalse(OutboundMail.objects.exclude(body='').exists())
+
+    def test_unreachable_server_is_retried_with_backoff(self):
+        queued = mailspool.spool('client@digitaratasy.mg', 'PIN', 'Code')
+        with SMTPSink() as sink:
+            pass
+        # Port libéré : connexion refusée
+        with self.smtp(sink):
+            self.assertEqual(mailspool.deliver(), (0, 1))
+            queued.refresh_from_db()
+            self.assertEqual((queued.status, queued.attempts), (OutboundMail.Statut.EN_ATTENTE, 1))
+            self.assertGreater(queued.send_after, timezone.now())
+            self.assertEqual(mailspool.deliver(), (0, 0))
+
+            OutboundMail.objects.filter(pk=queued.pk).update(send_after=timezone.now(), attempts=7)
+            mailspool.deliver()
+        queued.refresh_from_db()
+        self.assertEqual((queued.status, queued.body), (OutboundMail.Statut.ECHEC, ''))
+
+
+class JobQueueTests(TestCase):
+    def setUp(self):
+        self.calls = []
+        jobs.handlers['test.record'] = lambda **payload: self.calls.append(payload)
+        jobs.handlers['test.fail'] = self.fail_handler
+        self.addCleanup(jobs.handlers.pop, 'test.record')
+        self.addCleanup(jobs.handlers.pop, 'test.fail')
+
+    @staticmethod
+    def fail_handler(**payload):
+        raise RuntimeError('panne')
+
+    def test_same_key_is_requeued_not_duplicated(self):
+        jobs.enqueue('test.record', {'n': 1})
+        self.assertEqual(jobs.run_pending(), 1)
+        jobs.enqueue('test.record', {'n': 1})
+        job = Job.objects.get()
+        self.assertEqual((job.status, job.attempts), (Job.Statut.EN_ATTENTE, 0))
+        jobs.run_pending()
+        self.assertEqual(self.calls, [{'n': 1}, {'n': 1}])
+
+    def test_running_job_is_not_requeued(self):
+        job = jobs.enqueue('test.record', {'n': 1}, key='record')
+        jobs.claim()
+        self.assertEqual(jobs.enqueue('test.record', {'n': 2}, key='record').pk, job.pk)
+        job.refresh_from_db()
+        self.assertEqual((job.status, job.attempts, job.payload), (Job.Statut.EN_COURS, 1, {'n': 1}))
+        self.assertEqual(jobs.claim(), [])
+
+        Job.objects.filter(pk=job.pk).update(status=Job.Statut.TERMINE)
+        jobs.enqueue_many([('test.record', {'n': 3}, 'record'), ('test.record', {'n': 4})])
+        job.refresh_from_db()
+        self.assertEqual((job.status, job.attempts, job.payload), (Job.Statut.EN_ATTENTE, 0, {'n': 3}))
+        self.assertEqual(Job.objects.count(), 2)
+
+    def test_failure_is_retried_with_backoff_then_abandoned(self):
+        job = jobs.enqueue('test.fail', {}, max_attempts=2)
+        self.assertEqual(jobs.run_pending(), 1)
+        job.refresh_from_db()
+        self.assertEqual((job.status, job.attempts), (Job.Statut.EN_ATTENTE, 1))
+        self.assertIn('panne', job.last_error)
+        self.assertGreater(job.run_after, timezone.now())
+        self.assertEqual(jobs.run_pending(), 0)
+
+        Job.objects.filter(pk=job.pk).update(run_after=timezone.now())
+        jobs.run_pending()
+        job.refresh_from_db()
+        self.assertEqual((job.status, job.attempts), (Job.Statut.ECHEC, 2))
+
+    def test_expired_lease_is_claimed_again(self):
+        job = jobs.enqueue('test.record', {'n': 2})
+        self.assertEqual(jobs.claim(), [job.pk])
+        # Worker arrêté : la tâche reste réservée jusqu'à la fin du bail
+        self.assertEqual(jobs.claim(), [])
+        Job.objects.filter(pk=job.pk).update(run_after=timezone.now() - timedelta(seconds=1))
+        self.assertEqual(jobs.claim(), [job.pk])
+        self.assertEqual(Job.objects.get().attempts, 2)
+
+    def test_heartbeat_extends_the_lease_of_a_running_job(self):
+        job = jobs.enqueue('test.record', {'n': 3})
+        jobs.claim()
+        Job.objects.filter(pk=job.pk).update(run_after=timezone.now() + timedelta(seconds=1))
+        self.assertEqual(jobs.Heartbeat(job.pk).beat(), 1)
+        self.assertGreater(Job.objects.get().run_after, timezone.now() + timedelta(minutes=10))
+        self.assertEqual(jobs.claim(), [])
+
+    def test_prune_keeps_recent_and_failed_jobs(self):
+        old, recent, failed = (jobs.enqueue('test.record', {'n': n}) for n in range(3))
+        Job.objects.filter(pk__in=[old.pk, recent.pk]).update(status=Job.Statut.TERMINE)
+        Job.objects.filter(pk=failed.pk).update(status=Job.Statut.ECHEC)
+        Job.objects.filter(pk__in=[old.pk, failed.pk]).update(updated_at=timezone.now() - timedelta(days=30))
+        self.assertEqual(jobs.prune(timedelta(days=7)), 1)
+        self.assertCountEqual(Job.objects.values_list('pk', flat=True), [recent.pk, failed.pk])
+
+    def test_job_list_is_staff_only(self):
+        api = APIClient()
+        self.assertEqual(api.get('/api/jobs/').status_code, 401)
+        api.force_authenticate(User.objects.create(username='agent', email='agent@digitaratasy.mg'))
+        self.assertEqual(api.get('/api/jobs/').status_code, 403)
+        api.force_authenticate(User.objects.create(username='admin', email='admin@digitaratasy.mg', is_staff=True))
+        self.assertEqual(api.get('/api/jobs/').status_code, 200)
+
+
+@override_settings(STATISTICS_MATERIALIZED=True)
+class StatisticCounterTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.region = Region.objects.create(nom='Vakinankaratra')
+        cls.other_region = Region.objects.create(nom='Amoron\'i Mania')
+        cls.commune = Commune.objects.create(nom='Antsirabe', region=cls.region)
+        cls.other = Commune.objects.create(nom='Ambositra', region=cls.other_region)
+
+    def counters(self):
+        return {key: value for key, value in StatisticCounter.objects.values_list('key', 'value') if value}
+
+    def assertMatchesLive(self):
+        self.assertEqual(stats.materialized_statistics(), live_statistics())
+
+    def test_counters_follow_creates_updates_and_deletes(self):
+        client = Client.objects.create(
+            sexe='M', nom='Be', prenom='Noro', date_naissance='1980-08-08',
+            lieu_naissance=self.commune, adresse='Lot VIII', cin='701',
+        )
+        demande = DemandeActe.objects.create(client=client, type_acte='naissance')
+        self.assertEqual(self.counters(), {
+            'clients': 1, f'commune:{self.commune.pk}': 1, 'demandes_acte': 1, 'type_acte:naissance': 1,
+        })
+
+        demande.type_acte = 'copie'
+        demande.save()
+        client.lieu_naissance = self.other
+        client.save()
+        self.assertEqual(self.counters(), {
+            'clients': 1, f'commune:{self.other.pk}': 1, 'demandes_acte': 1, 'type_acte:copie': 1,
+        })
+        self.assertMatchesLive()
+
+        client.delete()
+        self.assertEqual(self.counters(), {})
+        self.assertMatchesLive()
+
+    def test_deferred_type_is_compared_with_the_stored_value(self):
+        client = Client.objects.create(
+            sexe='F', nom='Be', prenom='Lova', date_naissance='1981-08-08',
+            lieu_naissance=self.commune, adresse='Lot VIII', cin='702',
+        )
+        DemandeActe.objects.create(client=client, type_acte='naissance')
+
+        demande = DemandeActe.objects.only('id', 'statut').get()
+        demande.statut = DemandeActe.Statut.EN_COURS
+        demande.save()
+        demande = DemandeActe.objects.only('id').get()
+        demande.type_acte = 'cin'
+        demande.save()
+        self.assertEqual(self.counters()['type_acte:cin'], 1)
+        self.assertNotIn('type_acte:naissance', self.counters())
+        self.assertMatchesLive()
+
+        DemandeActe.objects.only('id').get().delete()
+        self.assertNotIn('type_acte:cin', self.counters())
+        self.assertEqual(self.counters().get('demandes_acte'), None)
+
+    def test_user_counters_are_materialized(self):
+        admin = User.objects.create(username='admin', email='admin@digitaratasy.mg')
+        Client.objects.create(
+            sexe='F', nom='Be', prenom='Soa', date_naissance='1983-08-08',
+            lieu_naissance=self.commune, adresse='Lot VIII', cin='704',
+        )
+        provision_client_account(Client.objects.get().pk)
+        admin.is_admin_commune = True
+        admin.save()
+        self.assertEqual((self.counters()['users'], self.counters()['administrateurs']), (2, 1))
+        with CaptureQueriesContext(connection) as context:
+            stats.materialized_statistics()
+        self.assertFalse(any('"app_user"' in q['sql'] for q in context.captured_queries))
+        self.assertMatchesLive()
+
+        admin.delete()
+        self.assertEqual(self.counters()['users'], 1)
+        self.assertNotIn('administrateurs', self.counters())
+        self.assertMatchesLive()
+
+    def test_breakdown_groups_by_the_demande_region(self):
+        client = Client.objects.create(
+            sexe='M', nom='Be', prenom='Hery', date_naissance='1982-08-08',
+            lieu_naissance=self.commune, adresse='Lot VIII', cin='703',
+        )
+        DemandeActe.objects.create(client=client, type_acte='cin', commune=self.other)
+        rows = stats.demandes_breakdown(period='month')
+        self.assertEqual([(row['type_acte'], row['region'], row['count']) for row in rows],
+                         [('cin', "Amoron'i Mania", 1)])
+
+
+class DatabaseProfileTests(TestCase):
+    base_dir = Path('/srv/digitaratasy')
+
+    def test_sqlite_keeps_the_journal_mode_unless_asked(self):
+        default = databases.database(self.base_dir, env={})
+        self.assertEqual(default['NAME'], self.base_dir / 'db.sqlite3')
+        self.assertEqual(default['OPTIONS']['transaction_mode'], 'IMMEDIATE')
+        self.assertNotIn('journal_mode', default['OPTIONS']['init_command'])
+
+        wal = databases.database(self.base_dir, env={'SQLITE_JOURNAL_MODE': 'wal'})
+        self.assertTrue(wal['OPTIONS']['init_command'].startswith('PRAGMA journal_mode=WAL'))
+        self.assertIn('synchronous=NORMAL', wal['OPTIONS']['init_command'])
+        with self.assertRaises(ImproperlyConfigured):
+            databases.database(self.base_dir, env={'SQLITE_JOURNAL_MODE': 'memoire'})
+
+    def test_postgresql_pool_or_persistent_connections(self):
+        env = {'DATABASE_PROFILE': 'postgresql', 'POSTGRES_HOST': 'db'}
+        persistent = databases.database(self.base_dir, env=env)
+        self.assertEqual((persistent['HOST'], persistent['CONN_MAX_AGE']), ('db', 600))
+        self.assertTrue(persistent['CONN_HEALTH_CHECKS'])
+        self.assertNotIn('pool', persistent['OPTIONS'])
+
+        pooled = databases.database(self.base_dir, env={**env, 'POSTGRES_POOL_SIZE': '20'})
+        self.assertEqual(pooled['CONN_MAX_AGE'], 0)
+        self.assertEqual(pooled['OPTIONS']['pool'], {'min_size': 5, 'max_size': 20, 'timeout': 10})
+
+    def test_unknown_profile_is_rejected(self):
+        with self.assertRaises(ImproperlyConfigured):
+            databases.database(self.base_dir, env={'DATABASE_PROFILE': 'oracle'})
+
+    def test_replicas_inherit_the_primary_settings(self):
+        primary = databases.database(self.base_dir, env={'DATABASE_PROFILE': 'postgresql'})
+        aliases, usages = databases.replicas(primary, env={'DATABASE_READ_REPLICAS': 'r1:5433, r2'})
+        self.assertEqual(usages, {'reads': ['reads_replica_1', 'reads_replica_2'], 'analytics': []})
+        self.assertEqual((aliases['reads_replica_1']['HOST'], aliases['reads_replica_1']['PORT']), ('r1', '5433'))
+        self.assertEqual(aliases['reads_replica_2']['PORT'], '5432')
+        self.assertEqual(aliases['reads_replica_2']['TEST'], {'MIRROR': 'default'})
+
+
+class QRCodeStoreTests(TestCase):
+    def setUp(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.directory = directory.name
+
+    def test_keys_depend_only_on_the_payload(self):
+        self.assertEqual(QRCodeStore.key_for('DR:ABC'), hashlib.sha256(b'DR:ABC').hexdigest())
+        self.assertNotEqual(QRCodeStore.key_for('DR:ABC'), QRCodeStore.key_for('DR:ABD'))
+
+    def test_memory_is_lru_and_disk_keeps_evicted_entries(self):
+        store = ContentStore(self.directory, memory_entries=2)
+        for key in ('aa1', 'bb2', 'cc3'):
+            store.store(key, key.encode())
+        store.load('bb2')
+        store.store('dd4', b'dd4')
+        self.assertEqual(list(store._memory), ['bb2', 'dd4'])
+        self.assertEqual(store.load('aa1'), b'aa1')
+        self.assertEqual(list(store._memory), ['dd4', 'aa1'])
+
+    def test_disk_is_bounded(self):
+        store = ContentStore(self.directory, memory_entries=1, disk_entries=10)
+        for number in range(12):
+            store.store(f'{number:02d}key', b'x')
+        self.assertLessEqual(len(store._disk_files()), 10)
+        self.assertTrue(store.contains('11key'))
+
+    def test_disk_eviction_is_lru_and_overwrites_are_not_counted(self):
+        store = ContentStore(self.directory, memory_entries=1, disk_entries=10)
+        for _ in range(3):
+            store.store('00key', b'x')
+        self.assertEqual(store._disk_count, 1)
+        for number in range(1, 10):
+            store.store(f'{number:02d}key', b'x')
+        for age, entry in enumerate(sorted(store._disk_files(), key=lambda f: f.name)):
+            os.utime(entry.path, (1000 + age, 1000 + age))
+        store.clear()
+        store.load('00key')  # Le plus ancien, mais lu en dernier
+        store.store('10key', b'x')
+        self.assertTrue(store.contains('00key'))
+        self.assertFalse(os.path.exists(store.path_for('01key')))
+
+    def test_png_view_and_template(self):
+        client = Client.objects.create(
+            sexe='F', nom='Voahangy', prenom='Lala', date_naissance='1990-10-10',
+            adresse='Lot XI', cin='601',
+        )
+        with mock.patch.object(qrcode_store, 'directory', self.directory):
+            qrcode_store.clear()
+            response = APIClient().get(f'/api/clients/{client.pk}/qrcode.png/')
+            self.assertEqual(response['Content-Type'], 'image/png')
+            self.assertTrue(response.content.startswith(b'\x89PNG'))
+            revalidated = APIClient().get(f'/api/clients/{client.pk}/qrcode.png/',
+                                          HTTP_IF_NONE_MATCH=response['ETag'])
+            self.assertEqual(revalidated.status_code, 304)
+        self.assertIn(f'src="/api/clients/{client.pk}/qrcode.png/"', render_to_string('qr.html', {'client': client}))
+
+
+class ClientImportTests(TestCase):
+    header = 'sexe,nom,prenom,date_naissance,lieu_naissance,adresse,cin\n'
+
+    @classmethod
+    def setUpTestData(cls):
+        region = Region.objects.create(nom='Atsinanana')
+        cls.commune = Commune.objects.create(nom='Toamasina', region=region)
+
+    def csv(self, count, extra=''):
+        rows = ''.join(
+            f'M,Razafy,Tojo{i},1990-01-0{i % 9 + 1},{self.commune.pk},Lot {i},50{i}\n'
+            for i in range(count)
+        )
+        return BytesIO((self.header + rows + extra).encode())
+
+    def resume(self, data, key='registre.csv.checkpoint'):
+        checkpoint = Checkpoint(key)
+        report = ImportReport(created=checkpoint.state['created'], rejected=checkpoint.state['rejected'])
+        return import_clients(data, batch_size=2, checkpoint=checkpoint, report=report)
+
+    def test_upload_and_status_are_reserved_to_agents(self):
+        api = APIClient()
+        upload = SimpleUploadedFile('registre.csv', self.csv(1).getvalue())
+        self.assertEqual(api.post('/api/clients/import/', {'file': upload}).status_code, 401)
+        self.assertEqual(api.get('/api/clients/import/abc/').status_code, 401)
+        api.force_authenticate(User.objects.create(username='citoyen', email='citoyen@digitaratasy.mg',
+                                                   is_client=True))
+        self.assertEqual(api.get('/api/clients/import/abc/').status_code, 403)
+        self.assertFalse(Job.objects.exists())
+
+    def test_interrupted_batch_is_not_replayed_as_rejects(self):
+        original_save = Checkpoint.save
+        saves = []
+
+        def crash_on_second_batch(checkpoint, **state):
+            saves.append(state)
+            if len(saves) == 2:
+                raise OSError('arrêt du processus')
+            return original_save(checkpoint, **state)
+
+        with mock.patch.object(Checkpoint, 'save', crash_on_second_batch):
+            with self.assertRaises(OSError):
+                self.resume(self.csv(5))
+        # Le deuxième lot a été annulé avec son point de contrôle
+        self.assertEqual(Client.objects.count(), 2)
+        self.assertEqual(Checkpoint('registre.csv.checkpoint').position, 2)
+
+        report = self.resume(self.csv(5))
+        self.assertEqual((report.created, report.rejected), (5, 0))
+        self.assertEqual(Client.objects.count(), 5)
+        self.assertTrue(Checkpoint('registre.csv.checkpoint').state['done'])
+
+    def test_malformed_csv_row_is_rejected(self):
+        report = self.resume(self.csv(3, extra='M,' + 'x' * 200000 + '\n'), key=None)
+        self.assertEqual((report.created, report.rejected), (3, 1))
+        self.assertIn('CSV invalide', report.errors[0]['errors']['non_field_errors'][0])
+
+
+class BulkEnrolmentTests(TestCase):
+    def rows(self, cins):
+        return [
+            {'sexe': 'M', 'nom': 'Randria', 'prenom': f'Hasina{cin}', 'date_naissance': '1988-02-02',
+             'adresse': 'Lot II', 'cin': cin}
+            for cin in cins
+        ]
+
+    def test_duplicate_cins_are_reported_by_row(self):
+        enrol_clients(self.rows(['401']))
+        report = enrol_clients(self.rows(['401', '402', '402', '403']), batch_size=2)
+        self.assertEqual((report.created, report.rejected), (2, 2))
+        self.assertEqual([error['index'] for error in report.errors], [0, 2])
+        self.assertTrue(all('cin' in error['errors'] for error in report.errors))
+
+    def test_cin_inserted_concurrently_is_rejected_and_the_rest_retried(self):
+        calls = []
+
+        def concurrent_import(clients):
+            calls.append(len(clients))
+            if len(calls) == 1:
+                # Un autre import enregistre le CIN 412 entre la vérification et l'insertion
+                Client.objects.create(sexe='F', nom='Autre', prenom='Import', date_naissance='1990-01-01',
+                                      adresse='Lot I', cin='412')
+                raise IntegrityError('UNIQUE constraint failed: app_client.cin')
+            return create_clients(clients)
+
+        with mock.patch('app.bulk.create_clients', side_effect=concurrent_import):
+            report = enrol_clients(self.rows(['411', '412', '413']))
+        self.assertEqual(calls, [3, 2])
+        self.assertEqual((report.created, report.rejected), (2, 1))
+        self.assertEqual(report.errors[0]['index'], 1)
+
+    def test_other_integrity_errors_are_raised(self):
+        with mock.patch('app.bulk.create_clients', side_effect=IntegrityError('NOT NULL constraint failed')):
+            with self.assertRaises(IntegrityError):
+                enrol_clients(self.rows(['421', '422']))
+        self.assertFalse(Client.objects.filter(cin__in=['421', '422']).exists())
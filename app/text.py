@@ -0,0 +1,8 @@
+import unicodedata
+
+
+def normalize(text):
+    """Texte sans accents, en minuscules, espaces superflus retirés."""
+    text = unicodedata.normalize('NFKD', text or '')
+    text = ''.join(c for c in text if not unicodedata.combining(c))
+    return ' '.join(text.lower().split())
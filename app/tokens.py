@@ -0,0 +1,271 @@
+"""Jetons de rafraîchissement : liste noire filtrée en mémoire et purge.
+
+Avec ``ROTATE_REFRESH_TOKENS`` et ``BLACKLIST_AFTER_ROTATION``, chaque
+rafraîchissement vérifie la liste noire puis y ajoute l'ancien jeton. Les
+tables ``token_blacklist`` grossissent donc à chaque rafraîchissement :
+``manage.py prune_tokens`` supprime par lots les jetons expirés.
+
+La vérification passe d'abord par un filtre de Bloom des JTI en liste noire
+(``blacklist_filter``). Un filtre de Bloom ne donne jamais de faux négatif :
+un JTI absent du filtre n'est pas en liste noire et la base n'est pas
+consultée ; un JTI présent est confirmé en base. Le filtre est chargé au
+premier usage puis complété, au plus toutes les ``TOKEN_BLACKLIST_SYNC_INTERVAL``
+secondes, par les jetons mis en liste noire depuis la dernière lecture et
+non expirés.
+
+Entre deux lectures, un jeton révoqué par un autre processus peut échapper
+au filtre. Pour la rotation ce n'est pas un problème : la mise en liste
+noire de l'ancien jeton (``RefreshToken.blacklist``) échoue s'il y figurait
+déjà, ce qui refuse un jeton rejoué sans requête supplémentaire.
+"""
+import hashlib
+import math
+import threading
+import time
+from datetime import timedelta
+
+from django.conf import settings
+from django.utils import timezone
+from django.utils.translation import gettext_lazy as _
+from rest_framework.exceptions import AuthenticationFailed
+from rest_framework_simplejwt import tokens
+from rest_framework_simplejwt.exceptions import TokenError
+from rest_framework_simplejwt.serializers import TokenRefreshSerializer
+from rest_framework_simplejwt.settings import api_settings
+from rest_framework_simplejwt.token_blacklist.models import BlacklistedToken, OutstandingToken
+from rest_framework_simplejwt.utils import datetime_from_epoch
+
+from .authentication import REVOKED, revoked_reason, user_state
+
+# Recouvrement des lectures incrémentales : une transaction validée après la
+# lecture précédente peut porter une date antérieure
+SYNC_OVERLAP = timedelta(minutes=1)
+REBUILD_INTERVAL = 24 * 3600
+MIN_CAPACITY = 10000
+
+
+def sync_interval():
+    return getattr(settings, 'TOKEN_BLACKLIST_SYNC_INTERVAL', 5)
+
+
+class BloomFilter:
+    """Ensemble probabiliste de chaînes (taux de faux positifs ``error_rate``)."""
+
+    def __init__(self, capacity, error_rate=0.01):
+        self.capacity = capacity
+        self.size = max(8, int(-capacity * math.log(error_rate) / math.log(2) ** 2))
+        self.hashes = max(1, round(self.size / capacity * math.log(2)))
+        self.bits = bytearray((self.size + 7) // 8)
+        self.count = 0
+
+    def _positions(self, item):
+        digest = hashlib.blake2b(item.encode(), digest_size=16).digest()
+        h1 = int.from_bytes(digest[:8], 'little')
+        h2 = int.from_bytes(digest[8:], 'little') | 1
+        return [(h1 + i * h2) % self.size for i in range(self.hashes)]
+
+    def add(self, item):
+        for position in self._positions(item):
+            self.bits[position >> 3] |= 1 << (position & 7)
+        self.count += 1
+
+    def __contains__(self, item):
+        return all(self.bits[position >> 3] & (1 << (position & 7))
+                   for position in self._positions(item))
+
+
+class BlacklistFilter:
+    """Filtre des JTI en liste noire, propre au processus, avec compteurs.
+
+    Les lectures en base se font hors du verrou (un seul thread à la fois,
+    les autres gardent le filtre courant) ; le verrou ne protège que le
+    remplacement du filtre, ses ajouts et les compteurs.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._sync_lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        self.bloom = None
+        self.built_at = 0.0
+        self.synced_at = 0.0
+        # Heure de la dernière lecture : la suivante ne lit que les jetons
+        # mis en liste noire depuis, même si la liste noire était vide
+        self.last_read = None
+        self.stats = {
+            'lookups': 0, 'skipped': 0, 'db_checks': 0, 'blacklisted': 0,
+            'false_positives': 0, 'syncs': 0, 'rebuilds': 0,
+        }
+
+    def count(self, *names):
+        with self._lock:
+            for name in names:
+                self.stats[name] += 1
+
+    def _due(self, force):
+        return (force or self.bloom is None
+                or time.monotonic() - self.synced_at >= sync_interval())
+
+    @staticmethod
+    def _jtis(queryset):
+        return queryset.values_list('token__jti', flat=True).iterator(chunk_size=5000)
+
+    def _rebuild(self, now):
+        queryset = BlacklistedToken.objects.filter(token__expires_at__gt=now)
+        bloom = BloomFilter(max(MIN_CAPACITY, 2 * queryset.count()))
+        for jti in self._jtis(queryset):
+            bloom.add(jti)
+        with self._lock:
+            self.bloom = bloom
+            self.built_at = time.monotonic()
+            self.stats['rebuilds'] += 1
+
+    def _refresh(self, now):
+        jtis = list(self._jtis(BlacklistedToken.objects.filter(
+            blacklisted_at__gte=self.last_read - SYNC_OVERLAP,
+            token__expires_at__gt=now,
+        )))
+        with self._lock:
+            for jti in jtis:
+                self.bloom.add(jti)
+
+    def sync(self, force=False):
+        if not self._due(force):
+            return
+        # Premier chargement : il faut attendre le filtre ; ensuite, un thread
+        # déjà en train de lire suffit
+        if not self._sync_lock.acquire(blocking=force or self.bloom is None):
+            return
+        try:
+            if not self._due(force):
+                return
+            now = timezone.now()
+            bloom = self.bloom
+            if (bloom is None or self.last_read is None or bloom.count > bloom.capacity
+                    or time.monotonic() - self.built_at > REBUILD_INTERVAL):
+                self._rebuild(now)
+            else:
+                self._refresh(now)
+            self.last_read = now
+            with self._lock:
+                self.synced_at = time.monotonic()
+                self.stats['syncs'] += 1
+        finally:
+            self._sync_lock.release()
+
+    def might_contain(self, jti):
+        self.sync()
+        if jti in self.bloom:
+            self.count('lookups')
+            return True
+        self.count('lookups', 'skipped')
+        return False
+
+    def add(self, jti):
+        with self._lock:
+            if self.bloom is not None:
+                self.bloom.add(jti)
+
+    def report(self):
+        with self._lock:
+            stats = dict(self.stats)
+            bloom = self.bloom
+        lookups = stats['lookups']
+        return {
+            **stats,
+            'skip_rate': round(stats['skipped'] / lookups, 4) if lookups else None,
+            'filter_entries': bloom.count if bloom else 0,
+            'filter_bytes': len(bloom.bits) if bloom else 0,
+        }
+
+
+blacklist_filter = BlacklistFilter()
+
+
+class RefreshToken(tokens.RefreshToken):
+    def check_blacklist(self):
+        jti = self.payload[api_settings.JTI_CLAIM]
+        if not blacklist_filter.might_contain(jti):
+            return
+        if BlacklistedToken.objects.filter(token__jti=jti).exists():
+            blacklist_filter.count('db_checks', 'blacklisted')
+            raise TokenError(_("Token is blacklisted"))
+        blacklist_filter.count('db_checks', 'false_positives')
+
+    def blacklist(self):
+        """Met le jeton en liste noire ; échoue s'il y était déjà (jeton rejoué)."""
+        jti = self.payload[api_settings.JTI_CLAIM]
+        token, _created = OutstandingToken.objects.get_or_create(
+            jti=jti,
+            defaults={
+                'user_id': self.payload.get(api_settings.USER_ID_CLAIM),
+                'created_at': self.current_time,
+                'token': str(self),
+                'expires_at': datetime_from_epoch(self.payload['exp']),
+            },
+        )
+        blacklisted, created = BlacklistedToken.objects.get_or_create(token=token)
+        blacklist_filter.add(jti)
+        if not created:
+            raise TokenError(_("Token is blacklisted"))
+        return blacklisted, created
+
+
+class FilteredTokenRefreshSerializer(TokenRefreshSerializer):
+    """Rafraîchissement sans lecture de ``User`` ni de la liste noire (cas courant)."""
+
+    token_class = RefreshToken
+
+    def validate(self, attrs):
+        refresh = self.token_class(attrs['refresh'])
+
+        user_id = refresh.payload.get(api_settings.USER_ID_CLAIM)
+        if user_id is not None:
+            state = user_state(user_id)
+            if state is None or (api_settings.CHECK_USER_IS_ACTIVE and not state[0]):
+                raise AuthenticationFailed(
+                    self.error_messages['no_active_account'], 'no_active_account',
+                )
+            reason = revoked_reason(refresh.payload, state)
+            if reason:
+                raise AuthenticationFailed(REVOKED[reason], reason)
+
+        data = {'access': str(refresh.access_token)}
+        if api_settings.ROTATE_REFRESH_TOKENS:
+            if api_settings.BLACKLIST_AFTER_ROTATION:
+                refresh.blacklist()
+            refresh.set_jti()
+            refresh.set_exp()
+            refresh.set_iat()
+            refresh.outstand()
+            data['refresh'] = str(refresh)
+        return data
+
+
+def table_sizes():
+    now = timezone.now()
+    return {
+        'outstanding': OutstandingToken.objects.count(),
+        'outstanding_expired': OutstandingToken.objects.filter(expires_at__lte=now).count(),
+        'blacklisted': BlacklistedToken.objects.count(),
+        'blacklisted_expired': BlacklistedToken.objects.filter(
+            token__expires_at__lte=now
+        ).count(),
+    }
+
+
+def prune_expired(batch_size=5000):
+    """Supprime par lots les jetons expirés (et leur entrée en liste noire)."""
+    deleted = 0
+    now = timezone.now()
+    while True:
+        ids = list(
+            OutstandingToken.objects.filter(expires_at__lte=now)
+            .order_by('pk').values_list('pk', flat=True)[:batch_size]
+        )
+        if not ids:
+            return deleted
+        BlacklistedToken.objects.filter(token_id__in=ids).delete()
+        deleted += OutstandingToken.objects.filter(pk__in=ids).delete()[0]
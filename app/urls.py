@@ -1,23 +1,41 @@
 from django.urls import path, include
 from rest_framework.routers import DefaultRouter
-from . import views
+from . import async_views, views
 from rest_framework_simplejwt.views import TokenRefreshView
 
+# Variantes asynchrones (ASGI) des routes les plus sollicitées
+async_urlpatterns = [
+    path('clients/<int:pk>/', async_views.client_detail, name='async-client-detail'),
+    path('clients/<int:pk>/qrcode.png', async_views.client_qrcode, name='async-client-qrcode'),
+    path('stats/', async_views.statistics, name='async-statistics'),
+    path('forgot-password/', async_views.forgot_password, name='async-forgot-password'),
+]
+
 router = DefaultRouter()
 router.register(r'users', views.UserViewSet)
 router.register(r'demandes-acte', views.DemandeActeViewSet)
 router.register(r'regions', views.RegionViewSet)
 router.register(r'communes', views.CommuneViewSet)
 router.register(r'clients', views.ClientViewSet)
+router.register(r'jobs', views.JobViewSet)
 
 urlpatterns = [
-    path('', include(router.urls)),
+    # Avant le routeur : sinon 'bulk' est pris pour l'identifiant d'un client
     path('clients/bulk/', views.ClientBulkCreateView.as_view(), name='client-bulk-create'),
+    path('clients/search/', views.ClientSearchView.as_view(), name='client-search'),
+    path('clients/import/', views.ClientImportView.as_view(), name='client-import'),
+    path('clients/import/<slug:token>/', views.ClientImportStatusView.as_view(), name='client-import-status'),
+    path('qrcodes/verify/', views.QRCodeVerifyView.as_view(), name='qrcode-verify'),
+    path('async/', include(async_urlpatterns)),
+    path('', include(router.urls)),
     path('create-admin-commune/', views.AdminCommuneCreateView.as_view(), name='create-admin-commune'),
     path('stats/', views.StatisticsView.as_view(), name='statistics'),
+    path('stats/tokens/', views.TokenStatisticsView.as_view(), name='statistics-tokens'),
+    path('stats/demandes/', views.DemandeStatisticsView.as_view(), name='statistics-demandes'),
     path('token/',views.MyTokenObtainPairView.as_view(), name='token_obtain_pair'),
     path('token/refresh/', TokenRefreshView.as_view(), name='token_refresh'),
     path("forgot-password/", views.ForgotPasswordView.as_view(), name="forgot-password"),
     path("reset-password/", views.ResetPasswordView.as_view(), name="reset-password"),
+    path("activate-account/", views.ActivateAccountView.as_view(), name="activate-account"),
     path("change-password/", views.ChangePasswordView.as_view(), name="change-password"),
 ]
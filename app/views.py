@@ -1,35 +1,240 @@
+import os
+import uuid
+
+from django.conf import settings
 from django.shortcuts import render
 from rest_framework import viewsets, generics
 from .models import *
 from .serializer import *
+from .qrcodes import qrcode_store, verify_codes
+from .bulk import enrol_clients
+from .imports import FORMATS, Checkpoint, detect_format
+from .jobs import enqueue
+from . import actes, sheets, stats, tokens, workflow
+from .pagination import SearchPagination
+from .search import search_clients
+from .duplicates import find_candidates
+from .refcache import ReferenceDataCacheMixin
+from .routing import ReplicaReadMixin
+from .partitions import PartitionScopeMixin
+from .accounts import activation_code
+from .permissions import IsAgent
 from rest_framework.permissions import IsAuthenticated, IsAdminUser
 from rest_framework.response import Response
+from rest_framework.throttling import ScopedRateThrottle
 from rest_framework import status
 from rest_framework.views import APIView
+from rest_framework.decorators import action
+from rest_framework.parsers import MultiPartParser
+from django.http import HttpResponse, StreamingHttpResponse
+from django.utils import timezone
 from django.contrib.auth import get_user_model
+from rest_framework_simplejwt.exceptions import InvalidToken, TokenError
 from rest_framework_simplejwt.views import TokenObtainPairView
 
-class UserViewSet(viewsets.ModelViewSet):
+class EagerLoadingViewMixin:
+    """Applique au queryset le plan de chargement déclaré par le sérialiseur.
+
+    En lecture, seules les colonnes des champs demandés (``?fields=``/``?omit=``)
+    sont chargées.
+    """
+
+    def get_queryset(self):
+        queryset = super().get_queryset()
+        serializer_class = self.get_serializer_class()
+        setup = getattr(serializer_class, 'setup_eager_loading', None)
+        if setup is None:
+            return queryset
+        columns = None
+        if self.request.method == 'GET' and issubclass(serializer_class, SparseFieldsetsMixin):
+            columns = self.get_serializer().get_sparse_columns()
+        return setup(queryset, columns)
+
+class UserViewSet(ReplicaReadMixin, EagerLoadingViewMixin, viewsets.ModelViewSet):
     queryset = User.objects.all()
     serializer_class = UserSerializer
 
-class RegionViewSet(viewsets.ModelViewSet):
+class RegionViewSet(ReplicaReadMixin, ReferenceDataCacheMixin, EagerLoadingViewMixin, viewsets.ModelViewSet):
     queryset = Region.objects.all()
     serializer_class = RegionSerializer
 
-class CommuneViewSet(viewsets.ModelViewSet):
+class CommuneViewSet(ReplicaReadMixin, ReferenceDataCacheMixin, EagerLoadingViewMixin, viewsets.ModelViewSet):
     queryset = Commune.objects.all()
     serializer_class = CommuneSerializer
 
-class ClientViewSet(viewsets.ModelViewSet):
+class ClientViewSet(ReplicaReadMixin, PartitionScopeMixin, EagerLoadingViewMixin, viewsets.ModelViewSet):
+    """Clients ; filtres ?commune= et ?region= limités à la partition de la région."""
     queryset = Client.objects.all()
     serializer_class = ClientSerializer
 
-class DemandeActeViewSet(viewsets.ModelViewSet):
+    def perform_create(self, serializer):
+        client = serializer.save()
+        # Doublons probables signalés à l'agent, sans bloquer l'enrôlement
+        self.duplicate_candidates = self._candidates(client)
+
+    def create(self, request, *args, **kwargs):
+        response = super().create(request, *args, **kwargs)
+        response.data['doublons_probables'] = self.duplicate_candidates
+        return response
+
+    @action(detail=True, methods=['get'])
+    def duplicates(self, request, pk=None):
+        return Response(self._candidates(self.get_object()))
+
+    def _candidates(self, client):
+        candidates = find_candidates(client)
+        return DuplicateCandidateSerializer(
+            [{'client': other, 'score': score} for score, other in candidates], many=True
+        ).data
+
+    @action(detail=True, methods=['get'], url_path='activation-code',
+            permission_classes=[IsAgent])
+    def activation_code(self, request, pk=None):
+        """Code à remettre au client pour activer son compte (agents uniquement)."""
+        client = self.get_object()
+        user = User.objects.filter(client_linked=client).first()
+        code = activation_code(user) if user else None
+        if code is None:
+            return Response({"message": "Aucun compte à activer pour ce client."},
+                            status=status.HTTP_409_CONFLICT)
+        return Response({"email": user.email, "activation_code": code})
+
+    @action(detail=False, methods=['get'], url_path='planches-qr', url_name='qr-sheets',
+            permission_classes=[IsAgent])
+    def qr_sheets(self, request):
+        """Planches de cartes QR (?commune=, ?region=, ?type=pdf|png), en flux (agents uniquement)."""
+        params = QRSheetQuerySerializer(data=request.query_params)
+        params.is_valid(raise_exception=True)
+        clients = sheets.sheet_clients(
+            commune=params.validated_data.get('commune'),
+            region=params.validated_data.get('region'),
+        )
+        kind = params.validated_data['type']
+        content = sheets.stream_sheets(clients, format=kind,
+                                       workers=getattr(settings, 'QR_SHEETS_WORKERS', 1))
+        if kind == 'pdf':
+            response = StreamingHttpResponse(content, content_type='application/pdf')
+            response['Content-Disposition'] = 'attachment; filename="planches-qr.pdf"'
+        else:
+            response = StreamingHttpResponse(content, content_type='application/zip')
+            response['Content-Disposition'] = 'attachment; filename="planches-qr.zip"'
+        return response
+
+    @action(detail=True, methods=['get'], url_path='qrcode.png', url_name='qrcode')
+    def qrcode_png(self, request, pk=None):
+        client = self.get_object()
+        key, png = qrcode_store.get(client.qrcode_payload())
+        etag = f'"{key}"'
+        if request.headers.get('If-None-Match') == etag:
+            return HttpResponse(status=status.HTTP_304_NOT_MODIFIED, headers={'ETag': etag})
+        return HttpResponse(png, content_type='image/png', headers={
+            'ETag': etag,
+            'Cache-Control': 'private, max-age=3600',
+        })
+
+class ClientSearchView(ReplicaReadMixin, generics.ListAPIView):
+    """Recherche : ?q=nom prénom (préfixes, sans accents), cin, born_after,
+    born_before, commune, region. Résultats classés par pertinence."""
+    serializer_class = ClientSerializer
+    pagination_class = SearchPagination
+
+    def get_queryset(self):
+        params = ClientSearchQuerySerializer(data=self.request.query_params)
+        params.is_valid(raise_exception=True)
+        return search_clients(**params.validated_data)
+
+class DemandeActeViewSet(ReplicaReadMixin, PartitionScopeMixin, EagerLoadingViewMixin, viewsets.ModelViewSet):
+    """Demandes d'acte ; filtres ?statut=, ?type_acte=, ?commune=, ?region=, ?agent=."""
     queryset = DemandeActe.objects.all()
     serializer_class = DemandeActeSerializer
     #permission_classes = [IsAuthenticated]
 
+    def get_queryset(self):
+        queryset = super().get_queryset()
+        for param in ('statut', 'type_acte', 'agent'):
+            value = self.request.query_params.get(param)
+            if value:
+                queryset = queryset.filter(**{param: value})
+        return queryset
+
+    @action(detail=False, methods=['post'], permission_classes=[IsAgent])
+    def claim(self, request):
+        """Réserve les prochaines demandes en attente de la file de l'agent.
+
+        Sans ``commune``, la file est celle de la commune administrée par l'agent.
+        """
+        params = DemandeClaimSerializer(data=request.data)
+        params.is_valid(raise_exception=True)
+        commune = params.validated_data.get('commune')
+        if commune is None and request.user.is_admin_commune:
+            commune = Commune.objects.filter(admin_commune=request.user.pk).values_list(
+                'pk', flat=True
+            ).first()
+        ids = workflow.claim_next(
+            request.user.pk, limit=params.validated_data['limit'],
+            commune=commune, type_acte=params.validated_data.get('type_acte'),
+        )
+        demandes = self.get_serializer_class().setup_eager_loading(
+            DemandeActe.objects.filter(pk__in=ids).order_by('date_demande', 'id')
+        )
+        return Response(self.get_serializer(demandes, many=True).data)
+
+    @action(detail=True, methods=['get'], url_path='acte.pdf', url_name='acte',
+            permission_classes=[IsAuthenticated])
+    def acte_pdf(self, request, pk=None):
+        demande = self.get_object()
+        if demande.statut not in actes.PRINTABLE:
+            return Response({"detail": "La demande n'est pas encore traitée."},
+                            status=status.HTTP_409_CONFLICT)
+        key, pdf = actes.get_acte(demande)
+        etag = f'"{key}"'
+        if request.headers.get('If-None-Match') == etag:
+            return HttpResponse(status=status.HTTP_304_NOT_MODIFIED, headers={'ETag': etag})
+        return HttpResponse(pdf, content_type='application/pdf', headers={
+            'ETag': etag,
+            'Content-Disposition': f'inline; filename="acte-{demande.pk}.pdf"',
+        })
+
+    @action(detail=False, methods=['get'], url_path='actes.zip', url_name='actes-zip',
+            permission_classes=[IsAgent])
+    def actes_zip(self, request):
+        """Archive des actes d'une commune (?commune=, obligatoire), traités ou délivrés, en flux."""
+        if not request.query_params.get('commune', '').isdigit():
+            return Response({"commune": ["Ce champ est obligatoire."]},
+                            status=status.HTTP_400_BAD_REQUEST)
+        demandes = self.get_queryset().filter(statut__in=actes.PRINTABLE).select_related(
+            'client'
+        ).order_by('date_demande', 'id')
+        response = StreamingHttpResponse(actes.stream_zip(demandes), content_type='application/zip')
+        response['Content-Disposition'] = 'attachment; filename="actes.zip"'
+        return response
+
+    @action(detail=True, methods=['post'], permission_classes=[IsAgent])
+    def transition(self, request, pk=None):
+        params = DemandeTransitionSerializer(data=request.data)
+        params.is_valid(raise_exception=True)
+        demande = self.get_object()
+        try:
+            workflow.transition(demande, params.validated_data['statut'], agent=request.user.pk)
+        except workflow.TransitionError as e:
+            return Response({"detail": e.messages[0]}, status=status.HTTP_409_CONFLICT)
+        return Response(self.get_serializer(demande).data)
+
+class JobViewSet(EagerLoadingViewMixin, viewsets.ReadOnlyModelViewSet):
+    queryset = Job.objects.all()
+    serializer_class = JobSerializer
+    # Les payloads contiennent des identifiants de clients et des chemins de fichiers
+    permission_classes = [IsAdminUser]
+    cursor_ordering = '-id'
+
+    def get_queryset(self):
+        queryset = super().get_queryset()
+        for param, lookup in (('status', 'status'), ('kind', 'kind'), ('key', 'idempotency_key')):
+            value = self.request.query_params.get(param)
+            if value:
+                queryset = queryset.filter(**{lookup: value})
+        return queryset
+
 class AdminCommuneCreateView(generics.CreateAPIView):
     serializer_class = AdminCommuneCreateSerializer
     #permission_classes = [IsAuthenticated]
@@ -40,55 +245,115 @@ class ClientBulkCreateView(generics.CreateAPIView):
     # permission_classes = [IsAuthenticated] 
 
     def create(self, request, *args, **kwargs):
-        serializer = self.get_serializer(data=request.data, many=True)
-        serializer.is_valid(raise_exception=True)
-        self.perform_create(serializer)
-        headers = self.get_success_headers(serializer.data)
-        return Response(serializer.data, status=status.HTTP_201_CREATED, headers=headers)
+        if not isinstance(request.data, list):
+            return Response(
+                {"detail": "Une liste de clients est attendue."},
+                status=status.HTTP_400_BAD_REQUEST,
+            )
+
+        # Validation, insertion et comptes par lots ; erreurs rapportées ligne par ligne
+        report = enrol_clients(request.data)
+        if report.created == 0 and report.errors:
+            return Response(report.as_dict(), status=status.HTTP_400_BAD_REQUEST)
+        return Response(report.as_dict(), status=status.HTTP_201_CREATED)
+
+class ClientImportView(APIView):
+    """Dépôt d'un registre CSV/NDJSON, importé en arrière-plan par le worker."""
+    parser_classes = [MultiPartParser]
+    permission_classes = [IsAgent]
+
+    def post(self, request, format=None):
+        upload = request.FILES.get('file')
+        if upload is None:
+            return Response({"file": ["Ce champ est obligatoire."]}, status=status.HTTP_400_BAD_REQUEST)
+        fmt = request.data.get('format') or detect_format(upload.name)
+        if fmt not in FORMATS:
+            return Response({"format": [f"Format inconnu : {fmt}"]}, status=status.HTTP_400_BAD_REQUEST)
+
+        token = uuid.uuid4().hex
+        os.makedirs(settings.CLIENT_IMPORTS_DIR, exist_ok=True)
+        with open(os.path.join(settings.CLIENT_IMPORTS_DIR, token), 'wb') as f:
+            for chunk in upload.chunks():
+                f.write(chunk)
+
+        job = enqueue('clients.import_file', {'token': token, 'format': fmt},
+                      key=f'clients.import_file:{token}')
+        return Response({"token": token, "job": job.pk}, status=status.HTTP_202_ACCEPTED)
+
+class ClientImportStatusView(APIView):
+    permission_classes = [IsAgent]
+
+    def get(self, request, token, format=None):
+        path = os.path.join(settings.CLIENT_IMPORTS_DIR, f'{token}.checkpoint')
+        if not Checkpoint.exists(path):
+            return Response({"detail": "Import en attente ou inconnu."}, status=status.HTTP_404_NOT_FOUND)
+        return Response(Checkpoint(path).state)
+
+class StatisticsView(ReplicaReadMixin, APIView):
+    replica_usage = 'analytics'
 
-class StatisticsView(APIView):
     def get(self, request, format=None):
-        User = get_user_model()
-        
-        data = {
-            "users": User.objects.count(),
-            "regions": Region.objects.count(),
-            "communes": Commune.objects.count(),
-            "clients": Client.objects.count(),
-            "administrateurs": User.objects.filter(is_admin_commune=True).count(),
-            "demandes_acte": DemandeActe.objects.count(),
-            
-            "types_acte": {
-                choice[1]: DemandeActe.objects.filter(type_acte=choice[0]).count()
-                for choice in TypeActe.choices
-            },
-            "clients_par_commune": [
-                {
-                    "commune": commune.nom,
-                    "count": Client.objects.filter(lieu_naissance=commune).count()
-                } 
-                for commune in Commune.objects.all()
-            ]
-        }
-        
-        serializer = StatisticsSerializer(data)
+        serializer = StatisticsSerializer(stats.statistics())
         return Response(serializer.data)
 
+class QRCodeVerifyView(APIView):
+    """Vérifie un code scanné (``code``) ou un lot (``codes``, postes de contrôle)."""
+
+    def post(self, request, format=None):
+        params = QRCodeVerifySerializer(data=request.data)
+        params.is_valid(raise_exception=True)
+        codes = params.validated_data.get('codes') or [params.validated_data['code']]
+        results = verify_codes(codes, max_age=params.validated_data.get('max_age'))
+        if 'codes' in params.validated_data:
+            return Response({'resultats': results})
+        return Response(results[0])
+
+class TokenStatisticsView(APIView):
+    """Taille des tables de jetons et efficacité du filtre de ce processus."""
+    permission_classes = [IsAdminUser]
+
+    def get(self, request, format=None):
+        return Response({
+            'tables': tokens.table_sizes(),
+            'filtre': tokens.blacklist_filter.report(),
+        })
+
+class DemandeStatisticsView(ReplicaReadMixin, APIView):
+    """Demandes par période (?period=day|week|month), type d'acte et région."""
+    replica_usage = 'analytics'
+
+    def get(self, request, format=None):
+        params = DemandeStatisticsQuerySerializer(data=request.query_params)
+        params.is_valid(raise_exception=True)
+        rows = stats.demandes_breakdown(
+            start=params.validated_data.get('start'),
+            end=params.validated_data.get('end'),
+            period=params.validated_data['period'],
+        )
+        return Response(DemandeStatSerializer(rows, many=True).data)
+
 class MyTokenObtainPairView(TokenObtainPairView):
     serializer_class = MytokenObtainPairView
 
     def post(self, request, *args, **kwargs):
-        response = super().post(request, *args, **kwargs)
-        if response.status_code == 200:
-            user = User.objects.get(email=request.data['email'])
-            user.is_online = True
-            user.save()
-        return response
+        serializer = self.get_serializer(data=request.data)
+        try:
+            serializer.is_valid(raise_exception=True)
+        except TokenError as e:
+            raise InvalidToken(e.args[0])
+
+        # Le sérialiseur a déjà authentifié l'utilisateur : une seule écriture
+        # ciblée, sans signaux (les caches d'utilisateurs restent valides)
+        User.objects.filter(pk=serializer.user.pk).update(last_login=timezone.now())
+        return Response(serializer.validated_data, status=status.HTTP_200_OK)
     
     
 User = get_user_model()
 
 class ForgotPasswordView(APIView):
+    throttle_classes = [ScopedRateThrottle]
+    throttle_scope = 'forgot_password'
+
     def post(self, request):
         serializer = ForgotPasswordSerializer(data=request.data)
         if serializer.is_valid():
@@ -96,12 +361,25 @@ class ForgotPasswordView(APIView):
         return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
 
 class ResetPasswordView(APIView):
+    throttle_classes = [ScopedRateThrottle]
+    throttle_scope = 'reset_password'
+
     def post(self, request):
         serializer = ResetPasswordSerializer(data=request.data)
         if serializer.is_valid():
             return Response({"message": "Mot de passe réinitialisé avec succès."}, status=status.HTTP_200_OK)
         return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
 
+class ActivateAccountView(APIView):
+    throttle_classes = [ScopedRateThrottle]
+    throttle_scope = 'activate_account'
+
+    def post(self, request):
+        serializer = ActivateAccountSerializer(data=request.data)
+        if serializer.is_valid():
+            return Response({"message": "Compte activé avec succès."}, status=status.HTTP_200_OK)
+        return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
+
 class ChangePasswordView(APIView):
     permission_classes = [IsAuthenticated]
 
@@ -0,0 +1,116 @@
+"""Traitement des demandes d'acte : machine à états et files de travail.
+
+Cycle de vie d'une demande (``DemandeActe.Statut``) :
+
+    en attente -> en cours -> traitée -> délivrée
+        |            |  \\
+        |            |   -> en attente (demande relâchée par l'agent)
+        +------------+-> rejetée
+
+Chaque changement de statut est un UPDATE conditionnel sur le statut
+attendu : deux agents ne peuvent pas faire passer la même demande dans deux
+états différents. Les agents réservent les demandes en attente de leur
+commune par lots (``claim_next``), dans l'ordre d'arrivée, sans parcourir la
+liste complète.
+"""
+from django.core.exceptions import ValidationError
+from django.db import connection, transaction
+from django.utils import timezone
+
+from .models import DemandeActe
+
+Statut = DemandeActe.Statut
+
+TRANSITIONS = {
+    Statut.EN_ATTENTE: {Statut.EN_COURS, Statut.REJETEE},
+    Statut.EN_COURS: {Statut.EN_ATTENTE, Statut.TRAITEE, Statut.REJETEE},
+    Statut.TRAITEE: {Statut.DELIVREE},
+    Statut.DELIVREE: set(),
+    Statut.REJETEE: set(),
+}
+
+MAX_CLAIM = 100
+
+
+class TransitionError(ValidationError):
+    """Changement de statut refusé (transition interdite ou concurrente)."""
+
+
+def allowed(current, target):
+    return target in TRANSITIONS.get(current, ())
+
+
+def transition(demande, target, agent=None):
+    """Fait passer ``demande`` au statut ``target`` ; lève ``TransitionError`` sinon."""
+    current = demande.statut
+    if not allowed(current, target):
+        raise TransitionError(
+            f"Transition impossible de « {current} » vers « {target} »."
+        )
+
+    agent_id = getattr(agent, 'pk', agent)
+    filters = {'pk': demande.pk, 'statut': current}
+    if current == Statut.EN_COURS and agent_id is not None:
+        # Seul l'agent qui a pris la demande en charge la termine, la relâche
+        # ou la rejette
+        if demande.agent_id != agent_id:
+            raise TransitionError("La demande est prise en charge par un autre agent.")
+        filters['agent_id'] = agent_id
+
+    fields = {'statut': target}
+    if target == Statut.EN_COURS:
+        fields.update(agent_id=agent_id, date_prise_en_charge=timezone.now())
+    elif target == Statut.EN_ATTENTE:
+        fields.update(agent_id=None, date_prise_en_charge=None)
+
+    if not DemandeActe.objects.filter(**filters).update(**fields):
+        raise TransitionError("La demande a été modifiée entre-temps, rechargez-la.")
+    for name, value in fields.items():
+        setattr(demande, name, value)
+    demande._snapshot()
+    return demande
+
+
+def work_queue(commune=None, type_acte=None, statut=Statut.EN_ATTENTE):
+    """Demandes d'une file, dans l'ordre d'arrivée (index ``demande_*_idx``)."""
+    queryset = DemandeActe.objects.filter(statut=statut)
+    if commune is not None:
+        queryset = queryset.filter(commune=commune)
+    if type_acte:
+        queryset = queryset.filter(type_acte=type_acte)
+    return queryset.order_by('date_demande', 'id')
+
+
+def claim_next(agent, limit=1, commune=None, type_acte=None):
+    """Réserve pour ``agent`` jusqu'à ``limit`` demandes en attente ; retourne leurs ids.
+
+    Avec ``SELECT ... FOR UPDATE SKIP LOCKED`` (PostgreSQL, MySQL 8, Oracle),
+    chaque agent verrouille des lignes différentes sans attendre les autres.
+    Sinon (SQLite), la réservation est un seul UPDATE dont la sous-requête
+    choisit les lignes : la base sérialise les écritures, l'instruction est
+    donc atomique, et les lignes réservées sont relues grâce à l'horodatage
+    de prise en charge propre à l'appel.
+    """
+    limit = max(1, min(limit, MAX_CLAIM))
+    agent_id = getattr(agent, 'pk', agent)
+    queue = work_queue(commune=commune, type_acte=type_acte)
+    claimed_at = timezone.now()
+
+    if connection.features.has_select_for_update_skip_locked:
+        with transaction.atomic():
+            ids = list(
+                queue.select_for_update(skip_locked=True).values_list('pk', flat=True)[:limit]
+            )
+            DemandeActe.objects.filter(pk__in=ids).update(
+                statut=Statut.EN_COURS, agent_id=agent_id, date_prise_en_charge=claimed_at,
+            )
+        return ids
+
+    DemandeActe.objects.filter(
+        pk__in=queue.values('pk')[:limit], statut=Statut.EN_ATTENTE,
+    ).update(statut=Statut.EN_COURS, agent_id=agent_id, date_prise_en_charge=claimed_at)
+    return list(
+        DemandeActe.objects.filter(
+            statut=Statut.EN_COURS, agent_id=agent_id, date_prise_en_charge=claimed_at,
+        ).order_by('date_demande', 'id').values_list('pk', flat=True)
+    )
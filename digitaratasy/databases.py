@@ -0,0 +1,133 @@
+"""Profils de base de données, choisis par ``DATABASE_PROFILE`` (variable d'environnement).
+
+- ``sqlite`` (par défaut) : fichier ``db.sqlite3``. Les transactions prennent
+  le verrou d'écriture dès leur début (``BEGIN IMMEDIATE``) et attendent
+  jusqu'à ``busy_timeout`` au lieu d'échouer sur « database is locked ».
+  Avec ``SQLITE_JOURNAL_MODE=wal`` (en production), les lecteurs ne bloquent
+  plus l'écrivain. Le mode WAL est enregistré dans le fichier lui-même : il
+  n'est pas activé par défaut, pour ne pas modifier la base de développement
+  suivie par git.
+- ``postgresql`` : connexion décrite par les variables ``POSTGRES_*``. Avec
+  ``POSTGRES_POOL_SIZE`` (psycopg 3 et psycopg_pool), un pool de connexions
+  par processus ; sinon des connexions persistantes (``CONN_MAX_AGE``)
+  vérifiées avant réutilisation.
+
+Réplicas en lecture (voir app/routing.py) : ``DATABASE_READ_REPLICAS`` et
+``DATABASE_ANALYTICS_REPLICAS``, listes séparées par des virgules de fichiers
+SQLite (copiés depuis la base principale par ``manage.py sync_replicas``) ou
+d'hôtes PostgreSQL ``hôte[:port]`` (réplication en flux, mêmes identifiants).
+
+Les fonctions propres à un moteur (files ``SKIP LOCKED`` de app/workflow.py,
+recherche plein texte de app/search.py, upsert de app/jobs.py) se choisissent
+d'après la connexion, pas d'après le profil.
+"""
+import os
+
+from django.core.exceptions import ImproperlyConfigured
+
+SQLITE_BUSY_TIMEOUT = 20  # secondes
+SQLITE_JOURNAL_MODES = ('delete', 'truncate', 'persist', 'wal')
+# Réglages propres à chaque connexion (le fichier n'est pas modifié)
+SQLITE_PRAGMAS = [
+    f'PRAGMA busy_timeout={SQLITE_BUSY_TIMEOUT * 1000}',
+    'PRAGMA mmap_size=268435456',  # 256 Mo
+    'PRAGMA cache_size=-65536',  # 64 Mo par connexion
+    'PRAGMA temp_store=MEMORY',
+]
+
+
+def sqlite(base_dir, env):
+    pragmas = list(SQLITE_PRAGMAS)
+    journal_mode = env.get('SQLITE_JOURNAL_MODE', '').lower()
+    if journal_mode:
+        if journal_mode not in SQLITE_JOURNAL_MODES:
+            raise ImproperlyConfigured(
+                f"SQLITE_JOURNAL_MODE inconnu : {journal_mode!r} (choix : {', '.join(SQLITE_JOURNAL_MODES)})"
+            )
+        pragmas.insert(0, f'PRAGMA journal_mode={journal_mode.upper()}')
+    if journal_mode == 'wal':
+        # En WAL, NORMAL ne synchronise qu'aux checkpoints : sans risque de
+        # corruption, au prix des dernières transactions en cas de coupure
+        pragmas.append('PRAGMA synchronous=NORMAL')
+    return {
+        'ENGINE': 'django.db.backends.sqlite3',
+        'NAME': env.get('SQLITE_PATH', base_dir / 'db.sqlite3'),
+        'CONN_MAX_AGE': int(env.get('DATABASE_CONN_MAX_AGE', 60)),
+        'OPTIONS': {
+            'timeout': SQLITE_BUSY_TIMEOUT,
+            'transaction_mode': 'IMMEDIATE',
+            'init_command': '; '.join(pragmas),
+        },
+    }
+
+
+def postgresql(base_dir, env):
+    database = {
+        'ENGINE': 'django.db.backends.postgresql',
+        'NAME': env.get('POSTGRES_DB', 'digitaratasy'),
+        'USER': env.get('POSTGRES_USER', 'digitaratasy'),
+        'PASSWORD': env.get('POSTGRES_PASSWORD', ''),
+        'HOST': env.get('POSTGRES_HOST', 'localhost'),
+        'PORT': env.get('POSTGRES_PORT', '5432'),
+        'OPTIONS': {},
+    }
+    pool_size = int(env.get('POSTGRES_POOL_SIZE', 0))
+    if pool_size:
+        # Le pool de Django exclut CONN_MAX_AGE : les connexions lui sont rendues
+        # à la fin de chaque requête
+        database['CONN_MAX_AGE'] = 0
+        database['OPTIONS']['pool'] = {
+            'min_size': max(1, pool_size // 4),
+            'max_size': pool_size,
+            'timeout': 10,
+        }
+    else:
+        database['CONN_MAX_AGE'] = int(env.get('DATABASE_CONN_MAX_AGE', 600))
+        database['CONN_HEALTH_CHECKS'] = True
+    return database
+
+
+PROFILES = {
+    'sqlite': sqlite,
+    'postgresql': postgresql,
+}
+REPLICA_VARIABLES = {
+    'reads': 'DATABASE_READ_REPLICAS',
+    'analytics': 'DATABASE_ANALYTICS_REPLICAS',
+}
+
+
+def database(base_dir, env=os.environ):
+    """Réglages ``DATABASES['default']`` du profil ``DATABASE_PROFILE``."""
+    profile = env.get('DATABASE_PROFILE', 'sqlite')
+    if profile not in PROFILES:
+        raise ImproperlyConfigured(f"DATABASE_PROFILE inconnu : {profile!r} (choix : {', '.join(PROFILES)})")
+    return PROFILES[profile](base_dir, env)
+
+
+def replica(primary, location):
+    """Réglages d'un réplica : ceux de ``primary``, pointés vers ``location``."""
+    database = {**primary, 'OPTIONS': dict(primary['OPTIONS'])}
+    if primary['ENGINE'].endswith('sqlite3'):
+        database['NAME'] = location
+        # Lecture seule : inutile de réserver le verrou d'écriture
+        database['OPTIONS'].pop('transaction_mode', None)
+    else:
+        host, _, port = location.partition(':')
+        database.update(HOST=host, PORT=port or primary['PORT'])
+    # Les tests lisent la base de test principale
+    database['TEST'] = {'MIRROR': 'default'}
+    return database
+
+
+def replicas(primary, env=os.environ):
+    """Réplicas déclarés : ``({alias: réglages}, {usage: [alias]})``."""
+    databases, usages = {}, {}
+    for usage, variable in REPLICA_VARIABLES.items():
+        locations = [value.strip() for value in env.get(variable, '').split(',') if value.strip()]
+        usages[usage] = []
+        for number, location in enumerate(locations, 1):
+            alias = f'{usage}_replica_{number}'
+            databases[alias] = replica(primary, location)
+            usages[usage].append(alias)
+    return databases, usages
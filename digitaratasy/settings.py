@@ -14,6 +14,8 @@ from datetime import timedelta
 import os
 from pathlib import Path
 
+from . import databases
+
 # Build paths inside the project like this: BASE_DIR / 'subdir'.
 BASE_DIR = Path(__file__).resolve().parent.parent
 
@@ -58,6 +60,7 @@ MIDDLEWARE = [
     'django.contrib.auth.middleware.AuthenticationMiddleware',
     'django.contrib.messages.middleware.MessageMiddleware',
     'django.middleware.clickjacking.XFrameOptionsMiddleware',
+    'app.routing.ReplicaRoutingMiddleware',
 ]
 
 ROOT_URLCONF = 'digitaratasy.urls'
@@ -84,12 +87,39 @@ WSGI_APPLICATION = 'digitaratasy.wsgi.application'
 # Database
 # https://docs.djangoproject.com/en/3.2/ref/settings/#databases
 
+# Profil choisi par la variable d'environnement DATABASE_PROFILE (sqlite par
+# défaut, ou postgresql) : voir digitaratasy/databases.py
 DATABASES = {
-    'default': {
-        'ENGINE': 'django.db.backends.sqlite3',
-        'NAME': BASE_DIR / 'db.sqlite3',
-    }
+    'default': databases.database(BASE_DIR),
 }
+# Réplicas en lecture par usage (app/routing.py) : DATABASE_READ_REPLICAS et
+# DATABASE_ANALYTICS_REPLICAS. Sans réplica, tout est lu sur `default`.
+_replicas, DATABASE_REPLICAS = databases.replicas(DATABASES['default'])
+DATABASES.update(_replicas)
+DATABASE_ROUTERS = ['app.routing.ReplicaRouter']
+# Durée pendant laquelle l'auteur d'une écriture relit la base principale
+DATABASE_STICKY_SECONDS = 10
+
+# Cache partagé entre les processus : génération des données de référence
+# (app/refcache.py), état des comptes (app/authentication.py), marques des
+# réplicas (app/routing.py). Redis si REDIS_URL est défini ; sinon des fichiers
+# dans var/cache, partagés par les workers d'une même machine. Un cache local
+# (LocMem) ne propagerait pas les invalidations d'un worker aux autres.
+if os.environ.get('REDIS_URL'):
+    CACHES = {'default': {
+        'BACKEND': 'django.core.cache.backends.redis.RedisCache',
+        'LOCATION': os.environ['REDIS_URL'],
+    }}
+else:
+    CACHES = {'default': {
+        'BACKEND': 'django.core.cache.backends.filebased.FileBasedCache',
+        'LOCATION': os.path.join(BASE_DIR, 'var', 'cache'),
+    }}
+
+# Données de référence (app/refcache.py) : génération relue au plus toutes les
+# REFDATA_CHECK_INTERVAL secondes, état local reconstruit après REFDATA_MAX_AGE
+REFDATA_CHECK_INTERVAL = 2
+REFDATA_MAX_AGE = 300
 
 
 # Password validation
@@ -131,6 +161,60 @@ USE_TZ = True
 STATIC_URL = '/static/'
 MEDIA_URL = '/media/'
 MEDIA_ROOT = os.path.join(BASE_DIR, 'media')
+
+# QR codes des clients, générés à la demande (voir app/qrcodes.py)
+QRCODE_CACHE = {
+    'DIR': os.path.join(MEDIA_ROOT, 'qrcodes'),
+    'MEMORY_ENTRIES': 256,
+    'DISK_ENTRIES': 10000,
+}
+
+# Photos des clients (app/photos.py) : côté maximal en pixels et vignettes
+PHOTO_MAX_SIZE = 1600
+PHOTO_THUMBNAILS = {'petite': 96, 'moyenne': 320}
+
+ACTES_CACHE = {
+    'DIR': os.path.join(MEDIA_ROOT, 'actes'),
+    'MEMORY_ENTRIES': 32,
+    'DISK_ENTRIES': 100000,
+}
+
+# Processus de rendu des planches QR servies par l'API (app/sheets.py) ;
+# les gros tirages passent par `manage.py render_qrsheets --workers N`
+QR_SHEETS_WORKERS = 1
+
+# Vues asynchrones (app/async_views.py, sous ASGI) : threads pour le disque
+ASYNC_IO_WORKERS = 32
+
+# E-mails : mis en file par les requêtes (app/mailspool.py), envoyés par
+# `python manage.py send_mail_spool` sur une connexion SMTP réutilisée
+EMAIL_HOST = os.environ.get('EMAIL_HOST', 'localhost')
+EMAIL_PORT = int(os.environ.get('EMAIL_PORT', 25))
+EMAIL_HOST_USER = os.environ.get('EMAIL_HOST_USER', '')
+EMAIL_HOST_PASSWORD = os.environ.get('EMAIL_HOST_PASSWORD', '')
+EMAIL_USE_TLS = os.environ.get('EMAIL_USE_TLS', '') == '1'
+EMAIL_TIMEOUT = 10
+DEFAULT_FROM_EMAIL = os.environ.get('DEFAULT_FROM_EMAIL', 'noreply@digitaratasy.mg')
+MAIL_SPOOL_MAX_ATTEMPTS = 8
+
+# Tâches de fond (app/jobs.py) : exécutées par `python manage.py run_jobs`.
+# Mettre à True pour les exécuter dans le processus web après le commit.
+JOBS_RUN_EAGERLY = False
+# Bail d'une tâche réservée (reprise par un autre worker à son expiration) et
+# conservation des tâches terminées, en secondes
+JOBS_LEASE = 1800
+JOBS_RETENTION = 7 * 24 * 3600
+
+# Statistiques lues dans la table de compteurs (app/stats.py) plutôt que
+# recalculées à chaque appel. Après activation : `manage.py rebuild_statistics`.
+STATISTICS_MATERIALIZED = False
+
+# Durée (en secondes) pendant laquelle l'état actif/mot de passe d'un
+# utilisateur est gardé en cache par app.authentication.ClaimsJWTAuthentication
+AUTH_STATE_CACHE_TTL = 60
+
+# Registres déposés via /api/clients/import/ (hors MEDIA_ROOT : non publics)
+CLIENT_IMPORTS_DIR = os.path.join(BASE_DIR, 'var', 'imports')
 # Default primary key field type
 # https://docs.djangoproject.com/en/3.2/ref/settings/#default-auto-field
 
@@ -138,10 +222,31 @@ DEFAULT_AUTO_FIELD = 'django.db.models.BigAutoField'
 
 AUTH_USER_MODEL = 'app.User'
 
+# Le premier hacheur s'applique aux nouveaux mots de passe ; les suivants
+# permettent de vérifier (puis de réécrire) les hachages existants.
+PASSWORD_HASHERS = [
+    'app.hashers.PBKDF2SHA512PasswordHasher',
+    'django.contrib.auth.hashers.PBKDF2PasswordHasher',
+    'django.contrib.auth.hashers.PBKDF2SHA1PasswordHasher',
+    'django.contrib.auth.hashers.Argon2PasswordHasher',
+    'django.contrib.auth.hashers.BCryptSHA256PasswordHasher',
+    'django.contrib.auth.hashers.ScryptPasswordHasher',
+]
+PASSWORD_PBKDF2_SHA512_ITERATIONS = 210000
+
 REST_FRAMEWORK ={
     'DEFAULT_AUTHENTICATION_CLASSES':(
-        'rest_framework_simplejwt.authentication.JWTAuthentication',
-    )
+        'app.authentication.ClaimsJWTAuthentication',
+    ),
+    'DEFAULT_PAGINATION_CLASS': 'app.pagination.IdCursorPagination',
+    'PAGE_SIZE': 50,
+    # Points d'entrée à code ou PIN (ScopedRateThrottle, par adresse IP ou
+    # par utilisateur) : limite les essais de codes
+    'DEFAULT_THROTTLE_RATES': {
+        'forgot_password': '5/hour',
+        'reset_password': '10/hour',
+        'activate_account': '10/hour',
+    },
 }
 
 SIMPLE_JWT = {
@@ -167,12 +272,22 @@ SIMPLE_JWT = {
     
     'AUTH_TOKEN_CLASSES': ('rest_framework_simplejwt.tokens.AccessToken',),
     'TOKEN_TYPE_CLAIM':'token_type',
-    'TOKEN_USER_CLASS':'rest_framework_simplejwt.models.TokenUser',
+    'TOKEN_USER_CLASS':'app.authentication.ClaimsUser',
+    # Jetons invalidés par un changement de mot de passe (claim hash_password)
+    'CHECK_REVOKE_TOKEN': True,
     
     'JTI_CLAIM':'jti',  
     
     'SLIDING_TOKEN_LIFETIME': timedelta(minutes=30),
     'SLIDING_TOKEN_REFRESH_EXP_CLAIM': 'refresh_exp',
     'SLIDING_TOKEN_REFRESH_LIFETIME': timedelta(days=1),
+
+    # Liste noire consultée à travers un filtre en mémoire (app/tokens.py)
+    'TOKEN_REFRESH_SERIALIZER': 'app.tokens.FilteredTokenRefreshSerializer',
 }
 
+# Délai maximal (en secondes) avant qu'un processus voie les jetons mis en
+# liste noire par les autres. Purge des jetons expirés : `manage.py prune_tokens`
+# (à planifier, par exemple chaque nuit).
+TOKEN_BLACKLIST_SYNC_INTERVAL = 5
+